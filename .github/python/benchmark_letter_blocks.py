@@ -0,0 +1,480 @@
+'''
+Benchmarks the letter block generation of a system, without Regolith. The
+_plugins of the system are loaded and its _map.py is evaluated like
+system_template does it, with synthetic letter sets (or the letter sets of
+the system's _scope.json).
+
+Every configuration (render mode and render backend) is measured twice: a
+cold run that renders all of the images into an empty copy of the system, and a
+warm run that rebuilds the same copy, so the letter cache skips the images.
+Each run is a separate process. The result of a run has:
+- the total time of the _map.py evaluation,
+- the time spent in each phase (font load, metrics, draw, resize, PNG
+  encode, file moves, the rest of generate_letter_sets and the rest of the
+  _map.py expansion),
+- the peak RSS,
+- the number of letter images and the images per second.
+
+The phases are measured in the benchmarked process only, use --workers 1
+(the default) to get all of them.
+
+Usage:
+    python ./.github/python/benchmark_letter_blocks.py [system]
+        [--letters 128] [--backgrounds 3] [--letter-sets synthetic|scope]
+        [--render-modes glyph atlas]
+        [--backends oversample freetype] [--stream]
+        [--encoding default|fast|release]
+        [--output results.json] [--compare baseline.json]
+
+The system is a folder of regolith/filters_data/system_template (by default
+"more_letter_blocks"). The system itself is not modified.
+'''
+from pathlib import Path
+from collections import defaultdict
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+from PIL import Image, ImageDraw
+import PIL
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+SYSTEM_TEMPLATE_PATH = ROOT_PATH / "regolith/filters_data/system_template"
+FONT_PATH = "fonts/AzeretMono-Black.ttf"
+RESULTS_VERSION = 2
+
+# The phases in the order they are reported
+PHASES = [
+    "font_load", "metrics", "draw", "resize", "encode", "file_moves",
+    "generate", "map_expansion",
+]
+
+
+class PhaseTimer:
+    """
+    Measures the time spent in the phases of the generation. The time of a
+    phase excludes the time of the phases called from it (e.g. the resize of
+    the background while loading the font and the background). The PNG
+    encoding runs in the threads of the letter pipeline, in parallel with
+    the other phases, so the phases can add up to more than the total time.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+        # Time spent in the nested phases of each running phase, per thread
+        self._local = threading.local()
+
+    def wrap(self, phase, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            nested = self._local.__dict__.setdefault("nested", [])
+            nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.seconds[phase] += elapsed - nested.pop()
+                    self.calls[phase] += 1
+                if nested:
+                    nested[-1] += elapsed
+        return timed
+
+
+def load_plugins(system_path):
+    """
+    Execute the _plugins of a system into a new module, the same way
+    system_template makes them available to the _map.py.
+    """
+    module = types.ModuleType(f"benchmark_{system_path.name}")
+    sys.modules[module.__name__] = module
+    for plugin_path in sorted((system_path / "_plugins").glob("*.py")):
+        code = compile(plugin_path.read_text(encoding="utf-8"), str(plugin_path), "exec")
+        exec(code, module.__dict__)
+    return module
+
+
+def instrument(plugins, timer):
+    """
+    Replace the functions of the phases with timed versions.
+    """
+    plugin_phases = {
+        "_load_render_context": "font_load",
+        "measure_glyph": "metrics",
+        "paint_glyph": "draw",
+        "_move_custom_backgrounds": "file_moves",
+        "generate_letter_sets": "generate",
+    }
+    for name, phase in plugin_phases.items():
+        if hasattr(plugins, name):
+            setattr(plugins, name, timer.wrap(phase, getattr(plugins, name)))
+    ImageDraw.ImageDraw.text = timer.wrap("draw", ImageDraw.ImageDraw.text)
+    Image.Image.resize = timer.wrap("resize", Image.Image.resize)
+    Image.Image.save = timer.wrap("encode", Image.Image.save)
+
+
+def load_letter_scope(system_path):
+    """
+    Read the letter sets, the character lists and the letter set defaults
+    from the _scope.json of a system.
+    """
+    lines = (system_path / "_scope.json").read_text(encoding="utf-8").splitlines()
+    # The scope allows line comments
+    text = "\n".join(line for line in lines if not line.lstrip().startswith("//"))
+    scope = json.loads(text)
+    return {
+        "letter_sets": scope["letter_sets"],
+        "character_lists": scope.get("character_lists", {}),
+        "letter_set_defaults": scope.get("letter_set_defaults", {}),
+    }
+
+
+def synthetic_letters(count):
+    """
+    Get a list of letters with the first printable characters after the
+    ASCII space, grouped like the letters of the real letter sets.
+    """
+    letters = []
+    code_point = 0x21
+    while len(letters) < count:
+        char = chr(code_point)
+        code_point += 1
+        if not char.isprintable() or not char.strip():
+            continue
+        if char.isalpha():
+            group = "letter"
+        elif char.isdigit():
+            group = "number"
+        else:
+            group = "symbol"
+        letters.append({"char": char, "safe_name": None, "group": group})
+    return letters
+
+
+def synthetic_letter_scope(system_path, letter_count, background_count):
+    """
+    Create letter sets with the bundled font, one for each of the first
+    background_count backgrounds of the system. All of them share one
+    character list.
+    """
+    backgrounds = sorted((system_path / "letter_blocks").glob("*.block.png"))
+    return {
+        "letter_sets": [
+            {
+                "id": f"benchmark_{background.name.removesuffix('.block.png')}",
+                "characters": "synthetic",
+                "background_image_path": f"letter_blocks/{background.name}",
+                "suffix": f"_{background.name.removesuffix('.block.png')}",
+            }
+            for background in backgrounds[:background_count]
+        ],
+        "character_lists": {"synthetic": synthetic_letters(letter_count)},
+        "letter_set_defaults": {
+            "font_size": 48,
+            "text_color": [10, 10, 10, 255],
+            "image_size": [64, 64],
+            "font_path": FONT_PATH,
+            "aliasing": True,
+            "downsample": "lanczos",
+        },
+    }
+
+
+def letter_count(letter_scope):
+    """
+    Count the letters of all of the letter sets.
+    """
+    count = 0
+    for letter_set in letter_scope["letter_sets"]:
+        if "letters" in letter_set:
+            count += len(letter_set["letters"])
+            continue
+        names = letter_set.get(
+            "characters", letter_scope["letter_set_defaults"].get("characters", []))
+        if isinstance(names, str):
+            names = [names]
+        count += sum(len(letter_scope["character_lists"][name]) for name in names)
+    return count
+
+
+def copy_system(system_path, work_path):
+    """
+    Copy a system without the letter images and the JSON files generated
+    into it by Regolith.
+    """
+    def ignore(directory, names):
+        if Path(directory).resolve() == system_path.resolve():
+            return [name for name in names if name == "letter_json"]
+        if Path(directory).resolve() != (system_path / "letter_blocks").resolve():
+            return []
+        return [
+            name for name in names
+            if name.startswith(".") or (Path(directory) / name).is_dir()
+        ]
+    shutil.copytree(system_path, work_path, ignore=ignore)
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process and of its finished child
+    processes (the worker processes), in MiB.
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_once(work_path, workers, encoding):
+    """
+    Evaluate the _map.py of a copied system and measure it. This runs in its
+    own process, started by measure().
+    """
+    os.chdir(work_path)
+    plugins = load_plugins(work_path)
+    timer = PhaseTimer()
+    instrument(plugins, timer)
+    with open("_benchmark_letter_sets.json", encoding="utf-8") as f:
+        letter_scope = json.load(f)
+    scope = plugins.__dict__
+    scope.update(letter_scope)
+    scope.update(
+        letter_workers=workers, letter_encoding=encoding, letter_profile=None,
+        letter_validation=None, letter_block_mode="letter", letter_block_compat=True,
+        letter_attachable_mode="letter",
+        AUTO="AUTO", AUTO_FLAT="AUTO_FLAT", AUTO_FLAT_SUBFOLDER="AUTO_FLAT_SUBFOLDER")
+    map_code = compile(Path("_map.py").read_text(encoding="utf-8"), "_map.py", "eval")
+
+    evaluate = timer.wrap("map_expansion", lambda: eval(map_code, scope))
+    start = time.perf_counter()
+    # Silence the progress messages of the generator
+    with contextlib.redirect_stdout(io.StringIO()):
+        map_items = evaluate()
+    seconds = time.perf_counter() - start
+
+    images = sum(
+        1 for glyph in plugins.index_glyphs("letter_blocks").glyphs
+        if glyph.category is not None)
+    return {
+        "seconds": seconds,
+        "images": images,
+        # Number of PNG files written (the letter images and their encodes)
+        "encoded": timer.calls["encode"],
+        "images_per_second": images / seconds if seconds else None,
+        "map_items": len(map_items),
+        "peak_rss_mb": peak_rss_mb(),
+        "phases": {phase: timer.seconds.get(phase, 0.0) for phase in PHASES},
+    }
+
+
+def measure(work_path, workers, encoding):
+    """
+    Run run_once in a new process, so its caches and peak RSS don't depend on
+    the previous runs.
+    """
+    process = subprocess.run(
+        [
+            sys.executable, __file__, "--run", str(work_path), "--workers", str(workers),
+            "--encoding", encoding,
+        ],
+        capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed:\n{process.stderr}")
+    return json.loads(process.stdout)
+
+
+def max_pixel_difference(reference_dir, output_dir):
+    """
+    Compare the letter images of two runs and return the largest channel
+    difference.
+    """
+    difference = 0
+    for reference_path in Path(reference_dir).glob("*/**/*.png"):
+        output_path = Path(output_dir) / reference_path.relative_to(reference_dir)
+        reference = np.asarray(Image.open(reference_path).convert("RGBA"), dtype=np.int16)
+        output = np.asarray(Image.open(output_path).convert("RGBA"), dtype=np.int16)
+        difference = max(difference, int(np.abs(reference - output).max()))
+    return difference
+
+
+def environment():
+    """
+    Describe the machine and the versions the results were measured with.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_PATH, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def print_result(result):
+    phases = ", ".join(
+        f"{phase} {seconds:.3f}" for phase, seconds in result["phases"].items())
+    rss = result["peak_rss_mb"]
+    rss = f"{rss:.0f} MiB" if rss is not None else "n/a"
+    print(
+        f"{result['name']:>20}: {result['seconds']:8.3f} s, "
+        f"{result['images_per_second']:8.1f} images/s, peak RSS {rss}")
+    print(f"{'':>22}{phases}")
+
+
+def compare(results, baseline_path, max_regression):
+    """
+    Compare the results to the results of a previous benchmark.
+
+    Returns:
+        The names of the results that are slower than the baseline by more
+        than max_regression (a fraction of the baseline time).
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    regressions = []
+    print(f"Compared to {baseline_path}:")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        regressed = ratio > 1 + max_regression
+        if regressed:
+            regressions.append(result["name"])
+        print(
+            f"{result['name']:>20}: {old['seconds']:8.3f} s -> "
+            f"{result['seconds']:8.3f} s ({ratio:6.2f}x)"
+            + (" REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the letter block generation.")
+    parser.add_argument("system", nargs="?", default="more_letter_blocks")
+    parser.add_argument("--letters", type=int, default=128,
+                        help="Number of letters of each synthetic letter set")
+    parser.add_argument("--backgrounds", type=int, default=3,
+                        help="Number of synthetic letter sets, one per background")
+    parser.add_argument("--letter-sets", choices=["synthetic", "scope"], default="synthetic",
+                        help="Benchmark synthetic letter sets or the ones of the _scope.json")
+    parser.add_argument("--render-modes", nargs="+", default=["glyph"])
+    parser.add_argument("--backends", nargs="+", default=["oversample"],
+                        help="Render backends, the render mode only applies to "
+                        "the oversample backend")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true",
+                        help="Render the letter sets in the streaming mode")
+    parser.add_argument("--encoding", default="default",
+                        help="PNG encoding profile: default, fast or release")
+    parser.add_argument("--output", help="Path of the JSON file to write the results to")
+    parser.add_argument("--compare", help="Path of the JSON results to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed slowdown compared to --compare, 0.2 is 20%%")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_once(Path(args.run), args.workers, args.encoding)))
+        return
+
+    system_path = SYSTEM_TEMPLATE_PATH / args.system
+    if args.letter_sets == "scope":
+        letter_scope = load_letter_scope(system_path)
+    else:
+        letter_scope = synthetic_letter_scope(system_path, args.letters, args.backgrounds)
+    print(
+        f"{args.system}: {len(letter_scope['letter_sets'])} letter sets, "
+        f"{letter_count(letter_scope)} letters")
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        reference_paths = {}
+        configurations = [
+            (backend, render_mode)
+            for backend in args.backends
+            for render_mode in args.render_modes
+        ]
+        for backend, render_mode in configurations:
+            name = render_mode
+            if backend != "oversample":
+                name += f"/{backend}"
+            work_path = Path(temp_dir) / name.replace("/", "_")
+            copy_system(system_path, work_path)
+            with open(work_path / "_benchmark_letter_sets.json", "w", encoding="utf-8") as f:
+                json.dump(
+                    dict(letter_scope, letter_sets=[
+                        dict(
+                            ls, render_mode=render_mode, backend=backend,
+                            stream=args.stream)
+                        for ls in letter_scope["letter_sets"]
+                    ]),
+                    f)
+            for run in ("cold", "warm"):
+                result = {
+                    "name": f"{name}/{run}",
+                    "render_mode": render_mode,
+                    "backend": backend,
+                    "run": run,
+                    **measure(work_path, args.workers, args.encoding),
+                }
+                results.append(result)
+                print_result(result)
+            # The images of all configurations of a backend should be the same,
+            # the other backends show how much they change the images
+            reference_path = reference_paths.setdefault(render_mode, work_path)
+            if reference_path != work_path:
+                difference = max_pixel_difference(
+                    reference_path / "letter_blocks", work_path / "letter_blocks")
+                print(f"{'':>22}max pixel difference to {reference_path.name}: {difference}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": RESULTS_VERSION,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "environment": environment(),
+                    "arguments": {
+                        key: value for key, value in vars(args).items()
+                        if key not in ("run", "output", "compare")
+                    },
+                    "results": results,
+                },
+                f, indent="\t")
+        print(f"Saved the results to {args.output}")
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
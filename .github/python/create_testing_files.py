@@ -1,16 +1,69 @@
+'''
+This script packages the behavior and resource packs of a sub product into
+an .mcaddon file. The files are streamed from the packs straight into the
+archive: the manifests and the language files are updated in memory, the
+entries are compressed by a pool of threads and the entries that didn't
+change since the previous archive are copied from it without compressing
+them again.
+
+The archives are deterministic: the entries are sorted and have fixed
+timestamps and permissions, so the same sources always produce the same
+bytes. A content manifest of every build is kept in the cache directory,
+when the content didn't change since the previous build and its archive is
+still there, the archive isn't written again.
+
+Usage:
+    python ./.github/python/create_testing_files.py <cache_dir> <root>
+        <mcaddon_dir> <version_tag> <sub_product>
+
+The first argument is the directory of the content manifests (it used to be
+a temporary directory for the packs). Keep it and the mcaddon directory
+between the builds (the release workflows cache them) to skip the unchanged
+archives and reuse the entries of the previous archive.
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import shutil
+from typing import NamedTuple, Optional
+import glob
+import hashlib
 import json
+import os
+import struct
 import sys
-import re
+import time
+import zipfile
+import zlib
+
+from lang_files import LangFile, build_languages, missing_keys_report
 
 # --- Constants and Arguments ---
-ZIP_FILES_PATH = sys.argv[1]  # Path to copy files into before zipping
+CACHE_PATH = sys.argv[1]      # Directory for the content manifests of the builds
 ROOT_PATH = sys.argv[2]       # Root of the addon
 MCADDON_FILE_ROOT = sys.argv[3]  # Directory to put the mcaddon file into
 ZIP_FILE_SUFFIX = sys.argv[4]    # Suffix for the zip file name (version tag)
 SUB_PRODUCT_NAME = sys.argv[5]   # Sub product name
 
+# Number of threads compressing the entries
+PACKAGING_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# zlib compression level of the entries (the level of shutil.make_archive)
+COMPRESS_LEVEL = 6
+# Build deterministic archives, DETERMINISTIC_PACKAGING=0 keeps the
+# modification times of the files instead
+DETERMINISTIC = os.environ.get("DETERMINISTIC_PACKAGING", "1") != "0"
+# Timestamp of the entries of deterministic archives: SOURCE_DATE_EPOCH (see
+# https://reproducible-builds.org/specs/source-date-epoch/) or the earliest
+# date a zip file can store
+SOURCE_DATE_EPOCH = os.environ.get("SOURCE_DATE_EPOCH")
+# Bump this when the archive layout changes, so the next build isn't skipped
+CONTENT_MANIFEST_VERSION = 1
+
+# Zip headers (without zip64 extensions)
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4sHHHHIIH")
+ZIP64_LIMIT = (1 << 32) - 1
+
 # Supported language codes
 LANGUAGES = [
     "de_DE", "ru_RU", "zh_CN", "fr_FR", "it_IT", "pt_BR", "fr_CA", "zh_TW",
@@ -20,33 +73,11 @@ LANGUAGES = [
 ]
 
 
-def rename_lang_file(path, product_name, product_description, pack_count, index):
-    """
-    Update pack.name and pack.description in a .lang file.
-    If multiple packs, append pack index to the name.
-    """
-    with open(path, "r", encoding="utf-8-sig") as file:
-        if pack_count > 1:
-            product_name = f"{product_name} pack {index}"
-        data = file.readlines()
-        modified_data = []
-        for line in data:
-            if line.startswith("pack.name"):
-                modified_data.append(f"pack.name={product_name}\n")
-            elif line.startswith("pack.description"):
-                modified_data.append(f"pack.description={product_description}\n")
-            else:
-                modified_data.append(line)
-    with open(path, "w", encoding="utf8") as file:
-        file.writelines(modified_data)
-
-
-def update_manifest_version(manifest_path, version_str):
+def update_manifest_version(manifest_text, version_str):
     """
-    Update the version fields in a manifest.json file.
+    Update the version fields in the content of a manifest.json file.
     """
-    with open(manifest_path, "r") as f:
-        manifest = json.load(f)
+    manifest = json.loads(manifest_text)
     # Remove leading 'v' and any suffix after '-'
     if version_str.startswith("v"):
         version_str = version_str[1:]
@@ -59,20 +90,25 @@ def update_manifest_version(manifest_path, version_str):
     for module in manifest.get("modules", []):
         if module.get("language") == "javascript":
             module["version"] = numeric_version
-    with open(manifest_path, "w") as f:
-        json.dump(manifest, f, indent=4)
+    return json.dumps(manifest, indent=4)
 
 
-def copy_and_prepare_pack(pack, dest_path, pack_icon_path, product_name, product_description, pack_count, index, version_str, is_behavior_pack):
+def read_text(path, encoding="utf8"):
     """
-    Copy a pack (behavior/resource) to the destination, update manifest and language files.
+    Read a text file with universal newlines, like open() in text mode.
     """
-    shutil.copytree(pack, dest_path)
-    if pack_icon_path is not None:
-        shutil.copy(pack_icon_path, dest_path / "pack_icon.png")
-    update_manifest_version(dest_path / "manifest.json", version_str)
-    # Update language files
-    texts_path = dest_path / "texts"
+    with open(path, "r", encoding=encoding) as file:
+        return file.read()
+
+
+def pack_entries(pack, arc_root, pack_icon_path, product_name, product_description, pack_count, index, version_str, is_behavior_pack):
+    """
+    List the entries of a pack (behavior/resource) in the archive, with the
+    updated manifest and language files, sorted by their names. The files
+    of the pack are read when the entries are compressed, the modified files
+    are kept in memory.
+    """
+    texts_path = pack / "texts"
     en_us_path = texts_path / "en_US.lang"
     if not en_us_path.exists():
         raise Exception(
@@ -80,49 +116,330 @@ def copy_and_prepare_pack(pack, dest_path, pack_icon_path, product_name, product
             f"The lang file should be in the location:\n"
             f"- {'behavior' if is_behavior_pack else 'resource'}_pack/{{pack}}/texts/en_US.lang\n"
         )
-    rename_lang_file(
-        path=en_us_path,
-        product_name=product_name,
-        product_description=product_description,
-        pack_count=pack_count,
-        index=index,
+    generated = {
+        "manifest.json": update_manifest_version(
+            read_text(pack / "manifest.json"), version_str).encode("utf8"),
+        "texts/languages.json": json.dumps(["en_US"] + LANGUAGES, indent=4).encode("utf8"),
+    }
+    # If multiple packs, append pack index to the name
+    if pack_count > 1:
+        product_name = f"{product_name} pack {index}"
+    # Rename the pack in en_US.lang and fill in the keys missing from the
+    # other languages (or the whole file) from it
+    translations = {
+        language: LangFile.read(texts_path / f"{language}.lang")
+        for language in LANGUAGES
+        if (texts_path / f"{language}.lang").exists()
+    }
+    languages, missing = build_languages(
+        LangFile.read(en_us_path), translations, LANGUAGES, product_name,
+        product_description)
+    if missing:
+        print(missing_keys_report(missing, f"package_release.py: {arc_root}/texts/"))
+    # The languages copied from en_US share the same file
+    encoded = {}
+    for language, lang_file in languages.items():
+        if id(lang_file) not in encoded:
+            encoded[id(lang_file)] = lang_file.to_bytes()
+        generated[f"texts/{language}.lang"] = encoded[id(lang_file)]
+
+    entries = []
+    for path in pack.rglob("*"):
+        relative = path.relative_to(pack).as_posix()
+        if path.is_dir() or relative in generated:
+            continue
+        if relative == "pack_icon.png" and pack_icon_path is not None:
+            continue
+        entries.append(ArchiveEntry(f"{arc_root}/{relative}", path, None))
+    if pack_icon_path is not None:
+        entries.append(ArchiveEntry(f"{arc_root}/pack_icon.png", pack_icon_path, None))
+    for relative, data in generated.items():
+        entries.append(ArchiveEntry(f"{arc_root}/{relative}", None, data))
+    # Sorted by the name in the archive, independently of the file system
+    return sorted(entries, key=lambda entry: entry.name)
+
+
+class ArchiveEntry(NamedTuple):
+    """
+    A file of the archive, either read from a source file or generated in
+    memory (data).
+    """
+    name: str
+    source: Optional[Path]
+    data: Optional[bytes]
+
+
+class PackedEntry(NamedTuple):
+    """
+    An entry of the archive ready to be written.
+    """
+    name: str
+    crc: int
+    method: int
+    file_size: int
+    date_time: tuple
+    payload: bytes
+    reused: bool
+
+
+def dos_date_time(timestamp, utc=False):
+    """
+    Convert a timestamp to the (time, date) pair of a zip entry.
+    """
+    year, month, day, hour, minute, second = (
+        time.gmtime(timestamp) if utc else time.localtime(timestamp))[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (
+        (hour << 11) | (minute << 5) | (second // 2),
+        ((year - 1980) << 9) | (month << 5) | day,
     )
-    # Copy en_US.lang to other languages if missing
-    for language in LANGUAGES:
-        lang_path = texts_path / f"{language}.lang"
-        if not lang_path.exists():
-            shutil.copy(en_us_path, lang_path)
-    # Write languages.json
-    with open(texts_path / "languages.json", "w") as f:
-        rp_languages = ["en_US"] + LANGUAGES
-        json.dump(rp_languages, f, indent=4)
-
-
-def clean_pack_name_in_texts(texts_dir):
-    """
-    Remove ' pack N' suffix from pack.name in all language files in the given directory.
-    """
-    languages = LANGUAGES + ["en_US"]
-    for language in languages:
-        path = texts_dir / f"{language}.lang"
-        if path.exists():
-            with open(path, "r", encoding="utf8") as file:
-                data = file.readlines()
-            modified_data = []
-            for line in data:
-                if line.startswith("pack.name"):
-                    # Remove ' pack N' at the end
-                    pattern = r" pack \d$"
-                    modified_data.append(re.sub(pattern, "", line))
-                else:
-                    modified_data.append(line)
-            with open(path, "w", encoding="utf8") as file:
-                file.writelines(modified_data)
+
+
+def fixed_date_time():
+    """
+    The (time, date) pair of the entries of deterministic archives.
+    """
+    if SOURCE_DATE_EPOCH:
+        return dos_date_time(int(SOURCE_DATE_EPOCH), utc=True)
+    return dos_date_time(0, utc=True)  # Clamped to 1980-01-01 00:00:00
+
+
+def read_entry(entry):
+    """
+    Read the content of an entry.
+    """
+    return entry.data if entry.data is not None else entry.source.read_bytes()
+
+
+def entry_date_time(entry):
+    """
+    Get the (time, date) pair of an entry: the fixed one of deterministic
+    archives, or the modification time of its file (the current time for
+    the generated files).
+    """
+    if DETERMINISTIC:
+        return fixed_date_time()
+    return dos_date_time(time.time() if entry.source is None else entry.source.stat().st_mtime)
+
+
+def read_previous_archive(path):
+    """
+    Read the central directory of a previously built archive.
+
+    Returns:
+        Dictionary of the entry names to their ZipInfo, empty if there is no
+        readable archive.
+    """
+    if path is None:
+        return {}
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return {
+                info.filename: info for info in archive.infolist()
+                if info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+            }
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"create_testing_files.py: Ignoring the previous archive {path}: {e}")
+        return {}
+
+
+def read_raw_entry(path, info):
+    """
+    Read the compressed data of an entry of a zip file, without
+    decompressing it.
+    """
+    with open(path, "rb") as file:
+        file.seek(info.header_offset)
+        header = file.read(LOCAL_HEADER.size)
+        if len(header) != LOCAL_HEADER.size or header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"Bad local header of {info.filename}")
+        fields = LOCAL_HEADER.unpack(header)
+        file.seek(fields[-2] + fields[-1], os.SEEK_CUR)
+        payload = file.read(info.compress_size)
+    if len(payload) != info.compress_size:
+        raise zipfile.BadZipFile(f"Truncated entry {info.filename}")
+    return payload
+
+
+def pack_entry(entry, previous_path, previous_entries):
+    """
+    Compress an entry. Runs in the worker threads, zlib releases the GIL
+    while it compresses and computes the checksums.
+
+    If the previous archive has an entry with the same name, size and
+    checksum, its compressed data is reused instead.
+    """
+    data = read_entry(entry)
+    crc = zlib.crc32(data)
+    date_time = entry_date_time(entry)
+
+    info = previous_entries.get(entry.name)
+    if info is not None and info.CRC == crc and info.file_size == len(data):
+        try:
+            return PackedEntry(
+                entry.name, crc, info.compress_type, len(data), date_time,
+                read_raw_entry(previous_path, info), True)
+        except (OSError, zipfile.BadZipFile):
+            pass
+
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    payload = compressor.compress(data) + compressor.flush()
+    if len(payload) >= len(data):
+        # Already compressed files (like PNG images) are stored
+        return PackedEntry(entry.name, crc, zipfile.ZIP_STORED, len(data), date_time, data, False)
+    return PackedEntry(entry.name, crc, zipfile.ZIP_DEFLATED, len(data), date_time, payload, False)
+
+
+def map_in_parallel(function, entries, workers, *args):
+    """
+    Call a function on the entries with a pool of threads, yielding the
+    results in the order of the entries. Only a limited number of entries is
+    kept in memory.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for entry in entries:
+            pending.append(executor.submit(function, entry, *args))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def pack_in_parallel(entries, workers, previous_path, previous_entries):
+    """
+    Compress the entries with a pool of threads, yielding them in the order
+    of the entries.
+    """
+    return map_in_parallel(pack_entry, entries, workers, previous_path, previous_entries)
+
+
+def describe_entry(entry):
+    """
+    Describe an entry in the content manifest. Runs in the worker threads,
+    hashlib releases the GIL while it hashes large files.
+    """
+    data = read_entry(entry)
+    return {
+        "name": entry.name,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def file_sha256(path):
+    """
+    Hash a file without reading it into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_manifest(entries, workers):
+    """
+    Create the content manifest of an archive: its entries, their sizes and
+    hashes and the settings the archive is built with. The content hash
+    covers all of them, archives with the same content hash have the same
+    bytes.
+    """
+    manifest = {
+        "version": CONTENT_MANIFEST_VERSION,
+        "settings": {
+            "compress_level": COMPRESS_LEVEL,
+            "date_time": list(fixed_date_time()),
+        },
+        "entries": list(map_in_parallel(describe_entry, entries, workers)),
+    }
+    manifest["content_hash"] = hashlib.sha256(
+        json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf8")
+    ).hexdigest()
+    return manifest
+
+
+def read_content_manifest(path):
+    """
+    Read the content manifest of the previous build, None if there is none.
+    """
+    try:
+        with open(path, "r", encoding="utf8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def archive_is_current(manifest, previous_manifest, mcaddon_file_path):
+    """
+    Check if the archive of the previous build has the content of the
+    manifest and is still in place, unmodified.
+    """
+    return (
+        previous_manifest is not None
+        and previous_manifest.get("content_hash") == manifest["content_hash"]
+        and previous_manifest.get("archive") == mcaddon_file_path.name
+        and mcaddon_file_path.exists()
+        and previous_manifest.get("archive_sha256") == file_sha256(mcaddon_file_path)
+    )
+
+
+def write_archive(path, packed_entries):
+    """
+    Write a zip file from the compressed entries.
+
+    Returns:
+        Tuple with the number of entries and the number of reused entries.
+    """
+    central_directory = []
+    reused = 0
+    with open(path, "wb") as file:
+        for packed in packed_entries:
+            name = packed.name.encode("utf8")
+            flags = 0 if packed.name.isascii() else 0x800  # UTF-8 name
+            offset = file.tell()
+            fields = (
+                20, flags, packed.method, *packed.date_time, packed.crc,
+                len(packed.payload), packed.file_size, len(name),
+            )
+            file.write(LOCAL_HEADER.pack(b"PK\x03\x04", *fields, 0))
+            file.write(name)
+            file.write(packed.payload)
+            central_directory.append(
+                CENTRAL_HEADER.pack(
+                    b"PK\x01\x02", (3 << 8) | 20, *fields, 0, 0, 0, 0,
+                    (0o100644 << 16), offset)
+                + name)
+            reused += packed.reused
+            if file.tell() > ZIP64_LIMIT:
+                raise Exception("The archive is too big, zip64 isn't supported")
+        if len(central_directory) > 0xFFFF:
+            raise Exception("The archive has too many entries, zip64 isn't supported")
+        directory_offset = file.tell()
+        for header in central_directory:
+            file.write(header)
+        file.write(END_OF_CENTRAL_DIRECTORY.pack(
+            b"PK\x05\x06", 0, 0, len(central_directory), len(central_directory),
+            file.tell() - directory_offset, directory_offset, 0))
+    return len(central_directory), reused
+
+
+def find_previous_archive(mcaddon_file_path, prefix):
+    """
+    Find the archive to reuse entries from: the archive being rebuilt or the
+    newest archive of the same sub product.
+    """
+    if mcaddon_file_path.exists():
+        return mcaddon_file_path
+    candidates = sorted(
+        mcaddon_file_path.parent.glob(f"{glob.escape(prefix)}*.mcaddon"),
+        key=lambda path: path.stat().st_mtime)
+    return candidates[-1] if candidates else None
 
 
 def main():
     print("create_testing_files.py: Script started")
-    zip_path = Path(ZIP_FILES_PATH)
     root_path = Path(ROOT_PATH)
     pack_path = root_path / "pack" / SUB_PRODUCT_NAME
     mcaddon_file_root = Path(MCADDON_FILE_ROOT)
@@ -150,65 +467,73 @@ def main():
             "- pack/pack_icon.jpg\n"
         )
 
-    # --- Copy and process Behavior Packs ---
-    bp_dir_list = [item for item in root_path.glob("behavior_packs/*") if item.is_dir()]
-    bp_pack_count = len(bp_dir_list)
-    for index, pack in enumerate(bp_dir_list):
-        bp_path = zip_path / f"behavior_packs/{index}"
-        copy_and_prepare_pack(
-            pack=pack,
-            dest_path=bp_path,
-            pack_icon_path=pack_icon_path,
-            product_name=product_name,
-            product_description=product_description,
-            pack_count=bp_pack_count,
-            index=index,
-            version_str=ZIP_FILE_SUFFIX,
-            is_behavior_pack=True
-        )
-        # For the first pack, copy texts to the root zip texts folder and clean pack index
-        if index == 0:
-            shutil.copytree(bp_path / "texts", zip_path / "texts")
-            clean_pack_name_in_texts(zip_path / "texts")
-
-    # --- Copy and process Resource Packs ---
-    rp_dir_list = [item for item in root_path.glob("resource_packs/*") if item.is_dir()]
-    rp_pack_count = len(rp_dir_list)
-    for index, pack in enumerate(rp_dir_list):
-        rp_path = zip_path / f"resource_packs/{index}"
-        copy_and_prepare_pack(
-            pack=pack,
-            dest_path=rp_path,
-            pack_icon_path=pack_icon_path,
-            product_name=product_name,
-            product_description=product_description,
-            pack_count=rp_pack_count,
-            index=index,
-            version_str=ZIP_FILE_SUFFIX,
-            is_behavior_pack=False
-        )
-
-    # --- Clean up unnecessary folders ---
-    for path in ["texts", "db"]:
-        try:
-            shutil.rmtree(zip_path / path)
-        except Exception:
-            print("Could not remove the path " + path)
-            pass
+    # --- List the files of the Behavior Packs and Resource Packs ---
+    def all_entries():
+        for pack_type, is_behavior_pack in (("behavior_packs", True), ("resource_packs", False)):
+            dir_list = sorted(item for item in root_path.glob(f"{pack_type}/*") if item.is_dir())
+            for index, pack in enumerate(dir_list):
+                yield from pack_entries(
+                    pack=pack,
+                    arc_root=f"{pack_type}/{index}",
+                    pack_icon_path=pack_icon_path,
+                    product_name=product_name,
+                    product_description=product_description,
+                    pack_count=len(dir_list),
+                    index=index,
+                    version_str=ZIP_FILE_SUFFIX,
+                    is_behavior_pack=is_behavior_pack
+                )
 
     # --- Create .mcaddon file ---
-    mcaddon_file_path = (
-        mcaddon_file_root / f"{product_creator}_{SUB_PRODUCT_NAME.title().replace('.', '_')}_{ZIP_FILE_SUFFIX}"
-    )
+    archive_prefix = f"{product_creator}_{SUB_PRODUCT_NAME.title().replace('.', '_')}_"
+    mcaddon_file_path = mcaddon_file_root / f"{archive_prefix}{ZIP_FILE_SUFFIX}.mcaddon"
     print(
         f"package_release.py: Creating mcaddon file at {mcaddon_file_path.as_posix()}"
     )
     mcaddon_file_root.mkdir(exist_ok=True, parents=True)
-    shutil.make_archive(mcaddon_file_path, "zip", zip_path)
-    shutil.move(
-        f"{mcaddon_file_path.as_posix()}.zip", f"{mcaddon_file_path.as_posix()}.mcaddon"
+    start = time.perf_counter()
+    # The entries are listed once for the manifest and the archive, the
+    # files themselves are read when they're hashed and compressed
+    entries = list(all_entries())
+
+    # Skip the archive if the previous build produced the same content
+    manifest = None
+    if DETERMINISTIC:
+        manifest_path = Path(CACHE_PATH) / f"{archive_prefix}content_manifest.json"
+        manifest = content_manifest(entries, PACKAGING_WORKERS)
+        print(f"package_release.py: Content hash {manifest['content_hash']}")
+        if archive_is_current(manifest, read_content_manifest(manifest_path), mcaddon_file_path):
+            print(
+                f"package_release.py: The content didn't change since the previous "
+                f"build, keeping {mcaddon_file_path.as_posix()}"
+            )
+            print("package_release.py: Finished with no errors!")
+            return
+
+    previous_path = find_previous_archive(mcaddon_file_path, archive_prefix)
+    previous_entries = read_previous_archive(previous_path)
+    temp_path = mcaddon_file_path.with_name(f".{mcaddon_file_path.name}.tmp")
+    try:
+        entry_count, reused = write_archive(
+            temp_path,
+            pack_in_parallel(entries, PACKAGING_WORKERS, previous_path, previous_entries))
+        os.replace(temp_path, mcaddon_file_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    print(
+        f"package_release.py: Packed {entry_count} files ({reused} reused from the "
+        f"previous archive) in {time.perf_counter() - start:.2f}s"
     )
 
+    if manifest is not None:
+        manifest["archive"] = mcaddon_file_path.name
+        manifest["archive_sha256"] = file_sha256(mcaddon_file_path)
+        manifest_path.parent.mkdir(exist_ok=True, parents=True)
+        with open(manifest_path, "w", encoding="utf8") as file:
+            json.dump(manifest, file, indent=1)
+        print(f"package_release.py: Saved the content manifest to {manifest_path.as_posix()}")
+
     print("package_release.py: Finished with no errors!")
 
 
@@ -0,0 +1,176 @@
+'''
+This module reads and writes the .lang files of the packs. A file is parsed
+once into a LangFile, an ordered key->value model that keeps its comments
+and blank lines, so the packaging script can rename the pack, fill in the
+keys missing from the translations and write all of the languages from
+memory.
+
+It can also be run on its own to report the keys missing from the
+translations of a folder:
+    python ./.github/python/lang_files.py <folder with the .lang files>
+'''
+from pathlib import Path
+import sys
+
+
+class LangFile:
+    """
+    The content of a .lang file: "key=value" entries in their original order,
+    with the comments and blank lines in between.
+    """
+    def __init__(self, text=""):
+        # Lines of the file: (key, value) for the entries, (None, line) for
+        # the comments and blank lines
+        self.lines = []
+        # Positions of the entries of every key (a key can be listed more
+        # than once, the game uses the last one)
+        self.positions = {}
+        # Only "\n" (or "\r\n") ends a line, str.splitlines() would also cut
+        # the values at characters like U+2028 or "\x0c"
+        text = text.replace("\r\n", "\n")
+        self.trailing_newline = text.endswith("\n") or not text
+        lines = text.split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        for line in lines:
+            key, separator, value = line.partition("=")
+            if separator and key and not key.startswith("#"):
+                self.positions.setdefault(key, []).append(len(self.lines))
+                self.lines.append((key, value))
+            else:
+                self.lines.append((None, line))
+
+    @classmethod
+    def read(cls, path):
+        """
+        Parse a .lang file, with or without the UTF-8 byte order mark.
+        """
+        with open(path, "r", encoding="utf-8-sig", newline="") as file:
+            return cls(file.read())
+
+    def copy(self):
+        """
+        Create a copy that can be modified independently.
+        """
+        lang_file = LangFile()
+        lang_file.lines = list(self.lines)
+        lang_file.positions = {key: list(positions) for key, positions in self.positions.items()}
+        lang_file.trailing_newline = self.trailing_newline
+        return lang_file
+
+    def keys(self):
+        """
+        The keys of the entries, in their order.
+        """
+        return self.positions.keys()
+
+    def get(self, key, default=None):
+        """
+        Get the value of a key (its last entry).
+        """
+        positions = self.positions.get(key)
+        return self.lines[positions[-1]][1] if positions else default
+
+    def set(self, key, value):
+        """
+        Set the value of a key. Every entry of the key is updated, a new key
+        is added at the end.
+        """
+        if key not in self.positions:
+            if not self.trailing_newline:
+                self.trailing_newline = True
+            self.positions[key] = [len(self.lines)]
+            self.lines.append((key, value))
+            return
+        for position in self.positions[key]:
+            self.lines[position] = (key, value)
+
+    def merge_missing(self, fallback):
+        """
+        Add the entries of the fallback language that are missing from this
+        file, in the order of the fallback file.
+
+        Returns:
+            The list of the added keys.
+        """
+        missing = [key for key in fallback.keys() if key not in self.positions]
+        for key in missing:
+            self.set(key, fallback.get(key))
+        return missing
+
+    def to_text(self):
+        """
+        Serialize the file, with "\\n" line endings.
+        """
+        text = "\n".join(
+            line if key is None else f"{key}={line}" for key, line in self.lines)
+        return text + "\n" if self.trailing_newline and self.lines else text
+
+    def to_bytes(self):
+        """
+        Serialize the file as UTF-8 (without the byte order mark).
+        """
+        return self.to_text().encode("utf8")
+
+
+def build_languages(en_us, translations, languages, product_name, product_description):
+    """
+    Build the .lang files of all of the languages of a pack.
+
+    Args:
+        en_us: The parsed en_US.lang of the pack.
+        translations: Dictionary of the language codes to the parsed .lang
+            files that exist in the pack.
+        languages: The language codes to build, besides en_US.
+        product_name: The pack name.
+        product_description: The pack description.
+
+    Returns:
+        A tuple with a dictionary of the language codes (en_US first) to the
+        built files and a dictionary of the language codes to the keys of
+        en_US missing from their translations (filled in from en_US).
+    """
+    en_us = en_us.copy()
+    en_us.set("pack.name", product_name)
+    en_us.set("pack.description", product_description)
+    built = {"en_US": en_us}
+    missing = {}
+    for language in languages:
+        translation = translations.get(language)
+        if translation is None:
+            built[language] = en_us
+            continue
+        translation = translation.copy()
+        missing_keys = translation.merge_missing(en_us)
+        if missing_keys:
+            missing[language] = missing_keys
+        built[language] = translation
+    return built, missing
+
+
+def missing_keys_report(missing, label=""):
+    """
+    Format the keys missing from the translations for the log.
+    """
+    lines = []
+    for language, keys in missing.items():
+        shown = ", ".join(keys[:5]) + (", ..." if len(keys) > 5 else "")
+        lines.append(f"{label}{language}: {len(keys)} missing keys ({shown})")
+    return "\n".join(lines)
+
+
+def main():
+    folder = Path(sys.argv[1])
+    en_us = LangFile.read(folder / "en_US.lang")
+    missing = {}
+    for path in sorted(folder.glob("*.lang")):
+        if path.stem == "en_US":
+            continue
+        missing_keys = [key for key in en_us.keys() if key not in LangFile.read(path).positions]
+        if missing_keys:
+            missing[path.stem] = missing_keys
+    print(missing_keys_report(missing) or "No missing keys")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+'''
+Rebuilds the letter blocks of a system while they're edited. The script
+watches the sources of the system (the _scope.json, the fonts, the
+backgrounds, the templates, the _map.py and the _plugins), copies the saved
+files into a work copy of the system and evaluates the _map.py there, like
+system_template does it, in the same process every time. The fonts,
+backgrounds and glyph metrics stay loaded between the rebuilds, only the
+changed ones are loaded again, and the letter cache re-renders only the
+images of the letter sets (and of the characters) that changed.
+
+The sources are polled, so the script works without any extra packages.
+Stop it with Ctrl+C.
+
+Usage:
+    python ./.github/python/watch_letter_blocks.py [system]
+        [--work-dir regolith/build/watch/<system>] [--workers 1]
+        [--interval 0.25] [--verbose]
+
+The system is a folder of regolith/filters_data/system_template (by default
+"more_letter_blocks"). The system itself is not modified, except for the
+block states of new letters (letter_block_states.json), which are kept in
+it.
+'''
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import traceback
+import types
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+SYSTEM_TEMPLATE_PATH = ROOT_PATH / "regolith/filters_data/system_template"
+# Folders of the system generated by the _map.py, they are not watched
+GENERATED_FOLDERS = {"letter_json", "__pycache__"}
+# Line comments of the _scope.json
+SCOPE_COMMENT = re.compile(r"^\s*//.*$", re.MULTILINE)
+
+
+def is_source(relative_path):
+    """
+    Check if a file of the system is a source of the letter blocks. The
+    letter images are generated into the subfolders of letter_blocks, next
+    to the backgrounds.
+    """
+    parts = relative_path.parts
+    if any(part.startswith(".") or part in GENERATED_FOLDERS for part in parts):
+        return False
+    return not (parts[0] == "letter_blocks" and len(parts) > 2)
+
+
+def scan_sources(system_path):
+    """
+    List the sources of a system with their modification times and sizes.
+    """
+    sources = {}
+    for directory, folders, files in os.walk(system_path):
+        directory = Path(directory)
+        relative_directory = directory.relative_to(system_path)
+        folders[:] = [
+            folder for folder in folders
+            if is_source(relative_directory / folder / "_")
+        ]
+        for name in files:
+            relative_path = relative_directory / name
+            if not is_source(relative_path):
+                continue
+            try:
+                stat = (directory / name).stat()
+            except OSError:  # Removed while scanning
+                continue
+            sources[relative_path.as_posix()] = (stat.st_mtime_ns, stat.st_size)
+    return sources
+
+
+def sync_sources(system_path, work_path, previous):
+    """
+    Copy the changed sources into the work copy and remove the removed ones.
+
+    Returns:
+        A tuple with the current sources (see scan_sources) and the paths of
+        the changed, added and removed sources, relative to the system.
+    """
+    current = scan_sources(system_path)
+    changed = sorted(
+        path for path in current.keys() | previous.keys()
+        if current.get(path) != previous.get(path))
+    for path in changed:
+        target = work_path / path
+        if path in current:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(system_path / path, target)
+        elif target.exists():
+            target.unlink()
+    return current, changed
+
+
+class LetterBlocksBuild:
+    """
+    The plugins, the scope and the _map.py of the work copy, loaded once and
+    reloaded only when they change.
+    """
+
+    def __init__(self, system_path, work_path, workers, verbose):
+        self.system_path = system_path
+        self.work_path = work_path
+        self.workers = workers
+        self.verbose = verbose
+        self.plugins = None
+        self.map_code = None
+        self.scope = None
+        self.sources = {}
+        self.rendered = 0
+
+    def load_plugins(self):
+        module = types.ModuleType(f"watch_{self.work_path.name}")
+        sys.modules[module.__name__] = module
+        for plugin_path in sorted((self.work_path / "_plugins").glob("*.py")):
+            code = compile(plugin_path.read_text(encoding="utf-8"), str(plugin_path), "exec")
+            exec(code, module.__dict__)
+        # Count the rendered images
+        render_work_units = module._render_work_units
+
+        def counted_render_work_units(*args, **kwargs):
+            stats = render_work_units(*args, **kwargs)
+            self.rendered += stats[0]
+            return stats
+        module._render_work_units = counted_render_work_units
+        # Keep the block states of the new letters in the system, the work
+        # copy isn't committed (see letter_block_types.py)
+        module.letter_block_states_dir = str(self.system_path)
+        self.plugins = module
+
+    def load_scope(self):
+        text = (self.work_path / "_scope.json").read_text(encoding="utf-8")
+        scope = json.loads(SCOPE_COMMENT.sub("", text))
+        scope.update(
+            letter_workers=self.workers,
+            AUTO="AUTO", AUTO_FLAT="AUTO_FLAT", AUTO_FLAT_SUBFOLDER="AUTO_FLAT_SUBFOLDER")
+        self.scope = scope
+
+    def letter_set_sources(self):
+        return self.plugins.letter_set_sources(
+            self.scope["letter_sets"], self.scope.get("character_lists"),
+            self.scope.get("letter_set_defaults"), self.scope.get("letter_encoding", "default"))
+
+    def rebuild(self, changed):
+        """
+        Load the changed parts of the system and evaluate the _map.py.
+        """
+        start = time.perf_counter()
+        if self.plugins is None or any(path.startswith("_plugins/") for path in changed):
+            self.load_plugins()
+            print("Loaded the plugins")
+        else:
+            dropped = self.plugins.forget_source_files(changed)
+            if dropped:
+                print("Reloading: " + ", ".join(dropped))
+        if self.map_code is None or "_map.py" in changed:
+            self.map_code = compile(
+                (self.work_path / "_map.py").read_text(encoding="utf-8"), "_map.py", "eval")
+        self.load_scope()
+
+        sources = self.letter_set_sources()
+        if self.sources:
+            affected = self.plugins.affected_letter_sets(self.sources, sources, changed)
+            for set_id, reasons in affected.items():
+                print(f"  {set_id}: " + ", ".join(reasons))
+        else:
+            print(f"Building {len(sources)} letter sets")
+        self.sources = sources
+
+        self.rendered = 0
+        output = io.StringIO()
+        # system_template evaluates the _map.py in the scope of the plugins
+        scope = self.plugins.__dict__
+        scope.update(self.scope)
+        cwd = os.getcwd()
+        os.chdir(self.work_path)
+        try:
+            with contextlib.redirect_stdout(sys.stdout if self.verbose else output):
+                map_items = eval(self.map_code, scope)
+        finally:
+            os.chdir(cwd)
+        print(
+            f"Rebuilt in {time.perf_counter() - start:.2f} s: "
+            f"{self.rendered} letter images rendered, {len(map_items)} map items")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the letter blocks while they're edited.")
+    parser.add_argument("system", nargs="?", default="more_letter_blocks")
+    parser.add_argument("--work-dir",
+                        help="Work copy of the system, by default regolith/build/watch/<system>")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, 1 keeps everything in this process")
+    parser.add_argument("--interval", type=float, default=0.25,
+                        help="Seconds between the checks of the sources")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the messages of the plugins")
+    args = parser.parse_args()
+
+    system_path = SYSTEM_TEMPLATE_PATH / args.system
+    work_path = Path(args.work_dir) if args.work_dir else ROOT_PATH / "regolith/build/watch" / args.system
+    work_path.mkdir(parents=True, exist_ok=True)
+    build = LetterBlocksBuild(system_path, work_path.resolve(), args.workers, args.verbose)
+
+    print(f"Watching {system_path}, building into {work_path}")
+    sources = {}
+    try:
+        while True:
+            sources, changed = sync_sources(system_path, work_path, sources)
+            if changed:
+                shown = ", ".join(changed[:5]) + (", ..." if len(changed) > 5 else "")
+                print(f"Changed: {shown}")
+                try:
+                    build.rebuild(changed)
+                except Exception:
+                    # Keep watching, the next save may fix it
+                    traceback.print_exc()
+                    print("Rebuild failed, waiting for the next change")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,19 @@
 (
-    [
-        # Generate letter images for each letter_set
-        *[
-            generate_letter_images(
-                map_py_item={"source": "letter_blocks/**/*.block.png", "target": AUTO_FLAT_SUBFOLDER,"on_conflict": "skip"},
-                letters=ls["letters"],
-                output_dir="./letter_blocks",
-                font_size=ls["font_size"],
-                text_color=tuple(ls["text_color"]),
-                image_size=tuple(ls["image_size"]),
-                font_path=ls["font_path"],
-                background_image_path=ls["background_image_path"],
-                suffix=ls["suffix"],
-                aliasing=ls["aliasing"]
-            )
-            for ls in letter_sets
-        ]
+    # Record where the time is spent, if profiling is turned on (see
+    # profiling.py)
+    start_profiling(letter_profile)
+    + [
+        # Generate letter images for all of the letter_sets
+        generate_letter_sets(
+            map_py_item={"source": "letter_blocks/**/*.block.png", "target": AUTO_FLAT_SUBFOLDER,"on_conflict": "skip"},
+            letter_sets=letter_sets,
+            output_dir="./letter_blocks",
+            workers=letter_workers,
+            encoding=letter_encoding,
+            character_lists=character_lists,
+            defaults=letter_set_defaults,
+            validation=letter_validation
+        )
     ]
     + [
         # Textures
@@ -25,24 +23,14 @@
             "source": "block/item_texture.json",
             "target": "RP/textures/item_texture.json",
             "on_conflict": "merge",
-            "scope": {
-                "letters": [
-                    p.stem.removesuffix(".block")
-                    for p in Path("letter_blocks").glob("**/*.png")
-                ]
-            },
+            "scope": {"letters": glyph_scope("letter_blocks")["letters"]},
             "json_template": True,
         },
         {
             "source": "block/terrain_texture.json",
             "target": "RP/textures/terrain_texture.json",
             "on_conflict": "merge",
-            "scope": {
-                "letters": [
-                    p.stem.removesuffix(".block")
-                    for p in Path("letter_blocks").glob("**/*.png")
-                ]
-            },
+            "scope": {"letters": glyph_scope("letter_blocks")["letters"]},
             "json_template": True,
         },
         # Assign the texture to the block
@@ -50,58 +38,83 @@
             "source": "block/blocks.json",
             "target": "RP/blocks.json",
             "on_conflict": "merge",
-            "scope": {
-                "letters": [
-                    p.stem.removesuffix(".block")
-                    for p in Path("letter_blocks").glob("**/*.png")
-                ]
-            },
+            "scope": letter_block_scope("letter_blocks", letter_block_mode, letter_block_compat),
             "json_template": True,
         },
     ]
-    + [
-        # Block definition
-        {
-            "source": "block/letter_block.block.json",
-            "target": f"BP/blocks/{p.stem.removesuffix('.block')}.block.json",
-            "scope": {"letter": p.stem.removesuffix(".block"), "background": p.parent.name if p.parent.name != "letter_blocks" else p.name.removesuffix('.block.png')},
-            "json_template": True,
-        }
-        for p in Path("letter_blocks").glob("**/*.png")
-    ]
-    + [
-        # Block loot
-        {
-            "source": "block/letter_block.loot.json",
-            "target": f"BP/loot_tables/edu_tools/{p.stem.removesuffix('.block')}.loot.json",
-            "scope": {"letter": p.stem.removesuffix(".block")},
-            "json_template": True,
-        }
-        for p in Path("letter_blocks").glob("**/*.png")
-    ]
-    + [
-        # Item definition
-        {
-            "source": "block/letter_block_placer.bp_item.json",
-            "target": f"BP/items/{p.stem.removesuffix('.block')}.bp_item.json",
-            "scope": {
-                "letter": p.stem.removesuffix(".block"),
-                "group": p.parent.parent.name,
-            },
-            "json_template": True,
-        }
-        for p in Path("letter_blocks").glob("**/*.png")
-    ]
-    + [
-        # Attachable
-        {
-            "source": "block/letter_block_placer.attachable.json",
-            "target": f"RP/attachables/{p.stem.removesuffix('.block')}.attachable.json",
-            "scope": {"letter": p.stem.removesuffix(".block")},
-            "json_template": True,
-        }
-        for p in Path("letter_blocks").glob("**/*.png")
-    ]
+    + emit_json_templates(
+        # The block, loot table, item and attachable of every letter, rendered
+        # once into files that are only rewritten when they change. Only the
+        # strings that are a single expression in backticks are evaluated (no
+        # K(...) keys, see letter_templates.py)
+        [
+            # Block definition of the letters with their own block type (see
+            # letter_block_types.py)
+            {
+                "source": "block/letter_block.block.json",
+                "target": f"BP/blocks/{glyph.letter}.block.json",
+                "scope": {"letter": glyph.letter, "background": glyph.background},
+            }
+            for glyph in letter_block_glyphs("letter_blocks", letter_block_mode, letter_block_compat)
+        ]
+        + [
+            # Block definition of the block types with the letters as permutations
+            {
+                "source": "block/letter_block_type.block.json",
+                "target": f"BP/blocks/{block_type.name}.block.json",
+                "scope": letter_block_type_scope(block_type),
+            }
+            for block_type in letter_block_types("letter_blocks", letter_block_mode)
+        ]
+        + [
+            # Block loot
+            {
+                "source": "block/letter_block.loot.json",
+                "target": f"BP/loot_tables/edu_tools/{glyph.letter}.loot.json",
+                "scope": {"letter": glyph.letter},
+            }
+            for glyph in index_glyphs("letter_blocks").glyphs
+        ]
+        + [
+            # Item definition
+            {
+                "source": "block/letter_block_placer.bp_item.json",
+                "target": f"BP/items/{glyph.letter}.bp_item.json",
+                "scope": {
+                    "letter": glyph.letter,
+                    "group": glyph.group,
+                    "format_version": letter_block_item_format_version(letter_block_mode),
+                    "block": letter_block_placement(
+                        glyph.letter, "letter_blocks", letter_block_mode),
+                },
+            }
+            for glyph in index_glyphs("letter_blocks").glyphs
+        ]
+        + [
+            # Attachable of the letters with their own attachable (see
+            # letter_attachables.py)
+            {
+                "source": "block/letter_block_placer.attachable.json",
+                "target": f"RP/attachables/{glyph.letter}.attachable.json",
+                "scope": {"letter": glyph.letter},
+            }
+            for glyph in letter_attachable_glyphs("letter_blocks", letter_attachable_mode)
+        ]
+        + [
+            # Attachable and render controller shared by a group of letters
+            {
+                "source": source,
+                "target": f"RP/{folder}/{group.name}{extension}",
+                "scope": letter_attachable_scope(group),
+            }
+            for group in letter_attachable_groups("letter_blocks", letter_attachable_mode)
+            for source, folder, extension in (
+                ("block/letter_block_placer_group.attachable.json", "attachables", ".attachable.json"),
+                ("block/letter_block_placer.rc.json", "render_controllers", ".rc.json"),
+            )
+        ],
+        output_dir="./letter_json"
+    )
     + [
         # Attachable model and animaiton
         {"source": "block/letter_block_placer.geo.json", "target": AUTO_FLAT},
@@ -113,24 +126,23 @@
             "source": "block/letter_block.mcfunction",
             "target": AUTO_FLAT,
             "scope": {
-                "blocks": [
-                    f'edu_tools:letter_block_{p.stem.removesuffix(".block")}_placer'
-                    for p in Path("letter_blocks").glob("**/*.png")
-                ],
-                "categories": [
-                    [
-                        f'edu_tools:letter_block_{p.stem.removesuffix(".block")}_placer'
-                        for p in subfolder.glob("**/*.png")
-                    ]
-                    for subfolder in Path("letter_blocks").iterdir()
-                    if subfolder.is_dir()
-                ],
-                "category_names": [
-                    subfolder.name
-                    for subfolder in Path("letter_blocks").iterdir()
-                    if subfolder.is_dir()
-                ],
+                name: glyph_scope("letter_blocks", "edu_tools:letter_block_{letter}_placer")[name]
+                for name in ("blocks", "categories", "category_names")
             },
         }
     ]
+    + (
+        [
+            # The functions replacing the blocks of the old worlds with the
+            # permutations of the block types
+            {
+                "source": "block/letter_block_migration.mcfunction",
+                "target": AUTO_FLAT,
+                "scope": letter_block_migration_scope("letter_blocks", letter_block_mode),
+            }
+        ]
+        if letter_block_compat and letter_block_types("letter_blocks", letter_block_mode)
+        else []
+    )
+    + finish_profiling()
 )
@@ -0,0 +1,79 @@
+'''
+This script caches the rasterized masks of the glyphs. The letter sets that
+only differ in their background or text color draw the same glyphs at the
+same positions, so every glyph is rasterized once and painted onto each
+background through its mask. Painting the text color through the mask is the
+same operation ImageDraw.text does, so the images don't change.
+'''
+from collections import OrderedDict
+from typing import Any
+from PIL import Image, ImageDraw
+
+# Maximum number of masks kept by each process. A mask is cropped to the
+# glyph, at most one byte per pixel of the oversampled image.
+GLYPH_MASK_CACHE_SIZE = 1024
+
+# (font, character, position, image size) -> (origin, cropped mask) or None
+# for glyphs that draw nothing. The keys hold the font objects themselves (the
+# fonts compare by identity), so a font stays alive while its masks are cached
+# and a new font can't be mistaken for a freed one.
+_glyph_masks: OrderedDict = OrderedDict()
+
+def glyph_mask(
+        font: Any,
+        char: str,
+        position: tuple[int, int],
+        size: tuple[int, int]
+    ) -> tuple[tuple[int, int], Image.Image] | None:
+    """
+    Get the mask of a character drawn at a position of an image. The mask is
+    rasterized only if it's not cached yet.
+
+    Args:
+        font: The font of the character (a font of the font registry, the
+            fonts are identified by the object).
+        char: The character.
+        position: Position of the text, like in ImageDraw.text.
+        size: Tuple with (width, height) of the image, the parts of the glyph
+            outside of the image are clipped.
+
+    Returns:
+        A tuple with the position of the top left corner of the mask in the
+        image and the 'L' mask cropped to the glyph, or None if the glyph
+        doesn't cover any pixels.
+    """
+    key = (font, char, position, size)
+    if key in _glyph_masks:
+        _glyph_masks.move_to_end(key)
+        return _glyph_masks[key]
+    with profile_span("rasterize"):
+        mask = Image.new('L', size, 0)
+        ImageDraw.Draw(mask).text(position, char, font=font, fill=255)
+        box = mask.getbbox()
+    entry = None if box is None else (box[:2], mask.crop(box))
+    _glyph_masks[key] = entry
+    if len(_glyph_masks) > GLYPH_MASK_CACHE_SIZE:
+        _glyph_masks.popitem(last=False)
+    return entry
+
+def paint_glyph(
+        img: Image.Image,
+        origin: tuple[int, int],
+        mask: tuple[tuple[int, int], Image.Image] | None,
+        color: Any
+    ):
+    """
+    Paint a color through a glyph mask onto an image, like ImageDraw.text
+    draws the glyph.
+
+    Args:
+        img: The image to paint on.
+        origin: Position of the image the mask was rasterized for (see
+            glyph_mask) in img, (0, 0) if it's the same size.
+        mask: The mask returned by glyph_mask.
+        color: The text color.
+    """
+    if mask is None:
+        return
+    (x, y), mask_image = mask
+    img.paste(color, (origin[0] + x, origin[1] + y), mask_image)
@@ -0,0 +1,184 @@
+'''
+This script provides the render backends of generate_letter_images, the ways
+a letter is rasterized. Every backend draws a letter of a letter set from its
+render settings and its glyph metrics (see draw_letter):
+- "oversample" draws the letter with a 4x bigger font on the oversampled
+  image and downsamples the image (see _draw_letter),
+- "freetype" rasterizes the glyph directly at the size of the letter image,
+  with the hinting and anti-aliasing of FreeType, and paints it onto the
+  downsampled background. It skips the 16x bigger images of the oversampling,
+  but its glyphs look slightly different.
+The differences between the backends are measured on the generated images by
+the validation (see validate_letter_sets), so the letter sets that can use
+the faster backend can be found.
+'''
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+from PIL import Image, ImageChops
+
+try:
+    import numpy as np
+except ImportError:  # Without NumPy, the images are compared one at a time
+    np = None
+
+# The render backends, the first one is the default
+RENDER_BACKENDS = ("oversample", "freetype")
+# Number of letters rendered by one work unit of the "freetype" backend, the
+# letters are cheap to render, so they're sent to the workers in batches
+FREETYPE_BATCH_SIZE = 32
+# Pixels with a larger channel difference are counted as changed by
+# backend_differences, smaller ones are barely visible
+BACKEND_DIFFERENCE_THRESHOLD = 16
+
+@lru_cache(maxsize=None)
+def _letter_background(settings: "RenderSettings") -> Image.Image | None:
+    '''
+    Returns the background of a letter set downsampled to the size of the
+    letter images, like the "oversample" backend downsamples it, or None
+    for the letter sets without a background.
+    '''
+    _, background_image = _load_render_context(settings)
+    if background_image is None:
+        return None
+    with profile_span("resize"):
+        return background_image.resize(settings.image_size, resample=_resample_filter(settings))
+
+def _draw_letter_freetype(
+        settings: "RenderSettings",
+        char: str,
+        metric: "GlyphMetric"
+    ) -> Image.Image:
+    '''
+    Draws a single letter at the size of the letter image, the "freetype"
+    backend. The metrics are the ones of the font at its size (see
+    _scaled_font_size).
+    '''
+    background = _letter_background(settings)
+    if background is not None:
+        img = background.copy()
+    else:
+        img = Image.new('RGBA', settings.image_size, (0, 0, 0, 0))
+    _, font = _letter_font(settings, char)
+    position, _ = _glyph_position(metric, settings.image_size)
+    # FreeType rasterizes the glyph at the size of the font, the letter sets
+    # with other backgrounds share its mask
+    mask = glyph_mask(font, char, position, settings.image_size)
+    with profile_span("draw"):
+        paint_glyph(img, (0, 0), mask, settings.text_color)
+    return img
+
+def draw_letter(
+        settings: "RenderSettings",
+        char: str,
+        metric: "GlyphMetric"
+    ) -> Image.Image:
+    """
+    Draw a single letter with the render backend of its letter set.
+
+    Args:
+        settings: The render settings of the letter set.
+        char: The character.
+        metric: The metrics of the character, measured with the font of the
+            backend (see _measure_letter).
+
+    Returns:
+        The letter image.
+    """
+    if settings.backend == "freetype":
+        return _draw_letter_freetype(settings, char, metric)
+    return _draw_letter(settings, char, metric)
+
+def _render_letters_freetype(
+        settings: "RenderSettings",
+        items: list[tuple[str, Path, "GlyphMetric"]]
+    ) -> tuple[int, int, int | None]:
+    '''
+    Renders a batch of letters of a letter set with the "freetype" backend
+    and saves them.
+
+    Returns:
+        The encoding stats of the images (see _render_work_unit).
+    '''
+    stats = (0, 0, 0)
+    for char, image_path, metric in items:
+        img = _draw_letter_freetype(settings, char, metric)
+        stats = _add_encoding_stats(stats, save_letter_image(img, image_path, settings.encoding))
+    return stats
+
+def backend_differences(
+        images: list[Image.Image],
+        references: list[Image.Image]
+    ) -> list[tuple[int, float, int]]:
+    """
+    Compare the images drawn by two render backends.
+
+    Args:
+        images: The RGBA images drawn by one backend.
+        references: The RGBA images of the same letters drawn by the other
+            backend, with the same sizes.
+
+    Returns:
+        A tuple for every image with its largest channel difference, the
+        mean channel difference and the number of pixels with a channel
+        difference larger than BACKEND_DIFFERENCE_THRESHOLD.
+    """
+    if not images:
+        return []
+    if np is not None:
+        difference = np.abs(
+            np.stack([np.asarray(img, dtype=np.int16) for img in images])
+            - np.stack([np.asarray(img, dtype=np.int16) for img in references]))
+        changed = (difference > BACKEND_DIFFERENCE_THRESHOLD).any(axis=3).sum(axis=(1, 2))
+        return list(zip(
+            difference.max(axis=(1, 2, 3)).tolist(),
+            difference.mean(axis=(1, 2, 3)).tolist(),
+            changed.tolist()))
+    differences = []
+    for img, reference in zip(images, references):
+        bands = ImageChops.difference(img, reference).split()
+        # The largest difference of the four channels
+        largest = bands[0]
+        for band in bands[1:]:
+            largest = ImageChops.lighter(largest, band)
+        histogram = largest.histogram()
+        total = sum(
+            value * count
+            for band in bands for value, count in enumerate(band.histogram()))
+        differences.append((
+            max(value for value, count in enumerate(histogram) if count),
+            total / (len(bands) * img.width * img.height),
+            sum(histogram[BACKEND_DIFFERENCE_THRESHOLD + 1:])))
+    return differences
+
+def backend_difference_report(
+        backend: str,
+        chars: list[str],
+        differences: list[tuple[int, float, int]],
+        pixels: int
+    ) -> dict[str, Any]:
+    """
+    Summarize the differences between the images of a letter set and the
+    images drawn by another render backend (see backend_differences).
+
+    Args:
+        backend: The name of the other backend.
+        chars: The characters of the compared images.
+        differences: The differences of the images.
+        pixels: The number of pixels of an image.
+
+    Returns:
+        The report: the backend, the largest channel difference, the mean
+        channel difference, the fraction of the pixels that changed and the
+        characters with the largest differences.
+    """
+    worst = sorted(zip(chars, differences), key=lambda item: -item[1][0])[:10]
+    return {
+        "backend": backend,
+        "max": max((largest for largest, _, _ in differences), default=0),
+        "mean": sum(mean for _, mean, _ in differences) / max(1, len(differences)),
+        "changed_pixels": (
+            sum(changed for _, _, changed in differences)
+            / max(1, len(differences) * pixels)),
+        "worst": [(char, largest) for char, (largest, _, _) in worst if largest],
+    }
@@ -0,0 +1,153 @@
+'''
+This script saves the letter images as PNG files with the encoding profile
+selected in the scope:
+- "default" - Pillow's default settings.
+- "fast" - low zlib effort, for development builds.
+- "release" - the smallest lossless encoding: opaque images without the
+  alpha channel, images with up to 256 colors as palette images, no metadata
+  and optimized compression.
+All of the profiles are lossless, the decoded pixels are the same.
+The files are written atomically, an interrupted build never leaves a
+truncated image behind.
+'''
+from pathlib import Path
+from PIL import Image
+import io
+import os
+
+ENCODING_PROFILES = ("default", "fast", "release")
+
+def _reduce_image(img: Image.Image) -> Image.Image:
+    '''
+    Converts an RGBA image to the smallest mode that keeps all of its pixels.
+    '''
+    opaque = img.getchannel('A').getextrema() == (255, 255)
+    colors = img.getcolors(256)
+    if colors is None:
+        reduced = img.convert('RGB') if opaque else img.copy()
+    else:
+        # Map the pixels to a palette with the most common colors first.
+        # Image.quantize could approximate the colors, this doesn't.
+        colors.sort(key=lambda color: -color[0])
+        palette_mode = 'RGB' if opaque else 'RGBA'
+        index = {color[:len(palette_mode)]: i for i, (_, color) in enumerate(colors)}
+        reduced = Image.new('P', img.size)
+        reduced.putpalette(
+            [channel for color in index for channel in color], palette_mode)
+        reduced.putdata([index[pixel[:len(palette_mode)]] for pixel in img.getdata()])
+    # Drop the metadata (e.g. the color profile of the background)
+    reduced.info = {}
+    return reduced
+
+def encode_letter_image(img: Image.Image, encoding: str) -> bytes:
+    """
+    Encode a letter image as PNG.
+
+    Args:
+        img: The RGBA image.
+        encoding: The encoding profile, see ENCODING_PROFILES.
+
+    Returns:
+        The content of the PNG file.
+    """
+    output = io.BytesIO()
+    if encoding == "default":
+        img.save(output, format="PNG")
+    elif encoding == "fast":
+        img.save(output, format="PNG", compress_level=1)
+    elif encoding == "release":
+        _reduce_image(img).save(output, format="PNG", optimize=True)
+    else:
+        raise ValueError(
+            f"Unknown encoding '{encoding}', expected one of: "
+            + ", ".join(ENCODING_PROFILES))
+    return output.getvalue()
+
+def write_file_atomic(path: Path, data: bytes):
+    """
+    Write a file through a temporary file in the same directory, renamed to
+    the final path once it's complete. The directory must exist.
+
+    Args:
+        path: Path of the file.
+        data: The content of the file.
+    """
+    # The process ID keeps the temporary files of the worker processes apart
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def encode_letter_file(img: Image.Image, encoding: str) -> tuple[bytes, int | None]:
+    """
+    Encode a letter image with an encoding profile and measure the size it
+    would have with the default profile.
+
+    Args:
+        img: The RGBA image.
+        encoding: The encoding profile, see ENCODING_PROFILES.
+
+    Returns:
+        The content of the PNG file and its size with the default profile
+        (see save_letter_image).
+    """
+    with profile_span("encode"):
+        data = encode_letter_image(img, encoding)
+    if encoding == "default":
+        return data, len(data)
+    if encoding == "release":
+        return data, len(encode_letter_image(img, "default"))
+    return data, None
+
+def save_letter_image(
+        img: Image.Image,
+        image_path: Path,
+        encoding: str
+    ) -> tuple[int, int | None]:
+    """
+    Save a letter image with an encoding profile. While the letter pipeline
+    of the current process is running (see letter_writer), the image is
+    queued to it instead, and its sizes are counted by the pipeline.
+
+    Args:
+        img: The RGBA image, not modified afterwards.
+        image_path: Path of the PNG file, in an existing directory.
+        encoding: The encoding profile, see ENCODING_PROFILES.
+
+    Returns:
+        The size of the file and the size the file would have with the
+        default profile. The default size is measured only for the "release"
+        profile (None for "fast", encoding it twice would cost the time the
+        profile saves). (0, 0) when the image was queued to the pipeline.
+    """
+    if queue_letter_image(img, image_path, encoding):
+        return 0, 0
+    data, default_size = encode_letter_file(img, encoding)
+    with profile_span("write"):
+        write_file_atomic(image_path, data)
+    return len(data), default_size
+
+def encoding_summary(encoding: str, stats: tuple[int, int, int | None]) -> str:
+    """
+    Describe the output of save_letter_image for a number of images.
+
+    Args:
+        encoding: The encoding profile.
+        stats: Tuple with the number of images, the size of their files and
+            the size with the default profile (None if unknown).
+
+    Returns:
+        A message for the log.
+    """
+    images, written, default_written = stats
+    message = f"Encoded {images} letter images with the '{encoding}' profile: {written} bytes"
+    if default_written is not None and encoding != "default":
+        saved = default_written - written
+        percent = 100 * saved / default_written if default_written else 0
+        message += f", saved {saved} bytes ({percent:.1f}%) compared to 'default'"
+    return message
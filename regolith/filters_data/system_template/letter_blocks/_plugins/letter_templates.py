@@ -0,0 +1,316 @@
+'''
+This script renders the JSON templates of the letter blocks (the block, loot
+table, item and attachable of every letter) into an output directory, so the
+_map.py maps the rendered files instead of evaluating thousands of
+"json_template" entries on every run. Every template is parsed and compiled
+once, and every distinct scope is rendered once. A manifest with the hashes
+of the rendered files lets the next run skip the files that didn't change and
+delete the files that are not produced anymore.
+
+Only the strings that are a single expression in backticks are evaluated, the
+other forms of "json_template" (like the K(...) keys of blocks.json) are not
+supported, the templates using them are mapped with "json_template".
+'''
+from pathlib import Path
+from typing import Any
+import hashlib
+import json
+import marshal
+import os
+import re
+import types
+
+# Name of the manifest file stored in the output directory
+TEMPLATE_MANIFEST_FILE = ".template_manifest.json"
+# Bump this when the rendering code changes in a way that affects the output
+TEMPLATE_MANIFEST_VERSION = 1
+
+# Strings, line comments and block comments of the JSON templates
+_JSON_TOKENS = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.S)
+
+def _code_names(code: types.CodeType) -> set[str]:
+    # The global (and attribute) names used by the code and by its nested
+    # code (comprehensions and lambdas)
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+class _Expression:
+    '''
+    A compiled expression of a template (a string in backticks).
+    '''
+    __slots__ = ("source", "code", "names")
+
+    def __init__(self, source: str, path: str):
+        self.source = source
+        self.code = compile(source, path, "eval")
+        self.names = frozenset(_code_names(self.code))
+
+def _compile_template(value: Any, path: str) -> Any:
+    # Replace the strings in backticks with compiled expressions
+    if isinstance(value, dict):
+        template = {}
+        for key, item in value.items():
+            key = _compile_template(key, path)
+            if isinstance(key, _Expression) and "K" in key.names:
+                raise ValueError(
+                    f"Unsupported key '`{key.source}`': "
+                    "K(...) keys are not supported, map it with \"json_template\"")
+            template[key] = _compile_template(item, path)
+        return template
+    if isinstance(value, list):
+        return [_compile_template(item, path) for item in value]
+    if isinstance(value, str) and len(value) >= 2 and value[0] == value[-1] == "`":
+        return _Expression(value[1:-1], path)
+    return value
+
+def _render_key(key: Any, scope: dict[str, Any]) -> str:
+    if not isinstance(key, _Expression):
+        return key
+    value = eval(key.code, scope)
+    if not isinstance(value, str):
+        raise ValueError(
+            f"The key '`{key.source}`' of a JSON template is {type(value).__name__}, "
+            "expected a string")
+    return value
+
+def _render_template(value: Any, scope: dict[str, Any]) -> Any:
+    if isinstance(value, _Expression):
+        return eval(value.code, scope)
+    if isinstance(value, dict):
+        return {
+            _render_key(key, scope): _render_template(item, scope)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_render_template(item, scope) for item in value]
+    return value
+
+def _template_names(value: Any) -> set[str]:
+    # The names used by the expressions of a compiled template
+    if isinstance(value, _Expression):
+        return set(value.names)
+    names = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            names |= _template_names(key) | _template_names(item)
+    elif isinstance(value, list):
+        for item in value:
+            names |= _template_names(item)
+    return names
+
+def _describe_global(value: Any) -> Any:
+    # A stable description of a global that isn't JSON data, for the hash of
+    # the inputs of a template
+    if isinstance(value, types.FunctionType):
+        return hashlib.sha256(marshal.dumps(value.__code__)).hexdigest()
+    if isinstance(value, types.ModuleType):
+        return value.__name__
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}"
+    # Unknown objects change the hash on every run, their files are rendered
+    # again
+    return repr(value)
+
+def _globals_key(names: set[str], scope: dict[str, Any]) -> str:
+    '''
+    Returns the JSON description of the globals used by a template and not
+    overridden by its scope.
+    '''
+    used = {
+        name: globals()[name] for name in sorted(names)
+        if name not in scope and name in globals()
+    }
+    try:
+        return json.dumps(used, sort_keys=True, default=_describe_global)
+    except (TypeError, ValueError):
+        # Keys that can't be sorted or circular data
+        return repr(used)
+
+_templates: dict[tuple, Any] = {}
+
+def load_json_template(path: str) -> Any:
+    """
+    Parse and compile a JSON template. The comments are removed and the
+    strings that are a single expression in backticks are compiled. The
+    result is memoized on the file's path, size and modification time.
+
+    Args:
+        path: Path to the template.
+
+    Returns:
+        The compiled template, see render_json_template.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    template = _templates.get(key)
+    if template is None:
+        with open(path, "r", encoding="utf-8") as f:
+            text = _JSON_TOKENS.sub(lambda m: m.group(1) or "", f.read())
+        try:
+            template = _compile_template(json.loads(text), path)
+        except ValueError as e:
+            raise ValueError(f"Unable to parse the JSON template '{path}': {e}") from e
+        _templates[key] = template
+    return template
+
+def render_json_template(template: Any, scope: dict[str, Any]) -> Any:
+    """
+    Evaluate the expressions of a compiled template.
+
+    Args:
+        template: The template returned by load_json_template.
+        scope: The variables of the expressions.
+
+    Returns:
+        The JSON data.
+    """
+    return _render_template(template, scope)
+
+class TemplateManifest:
+    '''
+    The manifest of the files rendered into an output directory. It maps the
+    files (paths relative to the output directory) to the hash of their
+    inputs (the template and the scope) and the hash of their content.
+    '''
+    def __init__(self, output_dir: str | Path):
+        self.root = Path(output_dir)
+        self.path = self.root / TEMPLATE_MANIFEST_FILE
+        self.files: dict[str, list[str]] = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == TEMPLATE_MANIFEST_VERSION:
+                    self.files = data.get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable template manifest '{self.path}': {e}")
+
+    def save(self):
+        """
+        Write the manifest to the output directory.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": TEMPLATE_MANIFEST_VERSION, "files": self.files},
+                f, indent=1, sort_keys=True)
+
+def _remove_empty_parents(root: Path, directory: Path):
+    while directory != root and root in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
+
+def emit_json_templates(
+        map_py_items: list[dict[str, Any]],
+        output_dir: str
+    ) -> list[dict[str, Any]]:
+    """
+    Render templated map items into files in the output directory. Only the
+    files whose template or scope changed since the previous run are
+    rendered, and only the files whose content changed are written. The
+    files rendered by the previous run that are not produced anymore are
+    deleted.
+
+    The expressions see the globals of the plugins, overridden by the scope
+    of the item. The globals used by a template are hashed with its inputs,
+    the functions by their code (but not the functions they call).
+
+    Args:
+        map_py_items: The map items with "source" (the template), "target"
+            and "scope", like the items of _map.py with "json_template".
+        output_dir: The directory of the rendered files.
+
+    Returns:
+        The map items copying the rendered files to their targets.
+    """
+    root = Path(output_dir)
+    manifest = TemplateManifest(root)
+    previous_files = manifest.files
+    manifest.files = {}
+    # The rendered content of every distinct template and scope
+    rendered: dict[tuple[str, str], tuple[str, bytes | None]] = {}
+    # The directories are created once, not for every file
+    created_directories = set()
+    # The names used by every template and the globals used by every
+    # template with the names of its scope
+    names: dict[str, set[str]] = {}
+    globals_keys: dict[tuple[str, tuple[str, ...]], str] = {}
+    # The globals of the plugins with the scope of the item being rendered,
+    # the globals it overrides are restored after rendering it
+    plugin_globals = globals()
+    render_scope = dict(plugin_globals)
+    with profile_span("emit_json_templates", output_dir=output_dir):
+        result = []
+        written = 0
+        for item in map_py_items:
+            source = item["source"]
+            target = item["target"]
+            scope = item.get("scope", {})
+            relative = Path(target).as_posix()
+            output_path = root / relative
+            scope_key = json.dumps(scope, sort_keys=True)
+            input_key = (source, scope_key)
+            if input_key not in rendered:
+                if source not in names:
+                    names[source] = _template_names(load_json_template(source))
+                globals_key_id = (source, tuple(sorted(scope)))
+                if globals_key_id not in globals_keys:
+                    globals_keys[globals_key_id] = _globals_key(names[source], scope)
+                input_hash = hashlib.sha256(
+                    json.dumps([
+                        TEMPLATE_MANIFEST_VERSION, file_digest(source), scope_key,
+                        globals_keys[globals_key_id],
+                    ]).encode("utf-8")).hexdigest()
+                rendered[input_key] = (input_hash, None)
+            input_hash, data = rendered[input_key]
+
+            previous = previous_files.get(relative)
+            if previous is not None and previous[0] == input_hash and output_path.exists():
+                manifest.files[relative] = previous
+            else:
+                if data is None:
+                    with profile_span("render_template", target=relative):
+                        render_scope.update(scope)
+                        try:
+                            content = render_json_template(load_json_template(source), render_scope)
+                        finally:
+                            for name in scope:
+                                if name in plugin_globals:
+                                    render_scope[name] = plugin_globals[name]
+                                else:
+                                    del render_scope[name]
+                        data = json.dumps(content, indent="\t", ensure_ascii=False).encode("utf-8")
+                    rendered[input_key] = (input_hash, data)
+                content_hash = hashlib.sha256(data).hexdigest()
+                if previous is None or previous[1] != content_hash or not output_path.exists():
+                    if output_path.parent not in created_directories:
+                        output_path.parent.mkdir(parents=True, exist_ok=True)
+                        created_directories.add(output_path.parent)
+                    with open(output_path, "wb") as f:
+                        f.write(data)
+                    written += 1
+                manifest.files[relative] = [input_hash, content_hash]
+            result.append({**{
+                key: value for key, value in item.items()
+                if key not in ("source", "scope", "json_template")
+            }, "source": output_path.as_posix()})
+
+        # Delete the files of the previous run that are not produced anymore
+        removed = 0
+        for relative in previous_files.keys() - manifest.files.keys():
+            stale_path = root / relative
+            if stale_path.exists():
+                os.remove(stale_path)
+                removed += 1
+                _remove_empty_parents(root, stale_path.parent)
+    manifest.save()
+    print(
+        f"Rendered templates into '{output_dir}': {len(result)} files, "
+        f"{written} written, {removed} removed")
+    return result
@@ -0,0 +1,335 @@
+'''
+This script checks the generated letter images, so broken glyphs are found
+without loading the textures in the game. The images of every letter set are
+compared with the blank image of the set (its background, downsampled like
+the letters) in one vectorized pass, which finds:
+- "empty" images, where the glyph didn't draw anything,
+- "clipped" images, where the glyph touches the edges of the image,
+- "tofu" images, where none of the fonts of the set has the character, so
+  the "missing glyph" box is drawn,
+- "missing" images, that weren't generated.
+It also draws a contact sheet of every letter set, with the images that have
+problems outlined, and it can compare the images with the images drawn by
+another render backend (see letter_backends.py). The letter sets are checked
+in parallel by the worker processes of the letter generation.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any
+from PIL import Image, ImageChops, ImageDraw
+import json
+import math
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:  # Without NumPy, the images are checked one at a time
+    np = None
+
+# Name of the report written to the preview directory
+VALIDATION_REPORT_FILE = "validation_report.json"
+# The problems found by the validation, with their outline color in the
+# contact sheets, the first problem of an image is the most likely cause of
+# the others (e.g. the "missing glyph" box of a font can touch the edges)
+VALIDATION_PROBLEMS = {
+    "missing": (255, 160, 0, 255),
+    "tofu": (255, 0, 255, 255),
+    "empty": (0, 128, 255, 255),
+    "clipped": (255, 0, 0, 255),
+}
+# Layout of the contact sheets
+_SHEET_COLUMNS = 16
+_SHEET_GAP = 4
+_SHEET_BACKGROUND = (96, 96, 96, 255)
+# Characters of the letter set IDs replaced in the names of the contact sheets
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^\w.-]")
+
+def _blank_tile(settings: "RenderSettings") -> Image.Image:
+    '''
+    Returns the image of a letter set without a letter: the background
+    downsampled like the letter images, or a transparent image.
+    '''
+    background = _letter_background(settings)
+    if background is None:
+        return Image.new('RGBA', settings.image_size, (0, 0, 0, 0))
+    return background
+
+def _ink_stats(tiles: list[Image.Image], blank: Image.Image) -> tuple[list[bool], list[bool]]:
+    '''
+    Finds the images without any pixels of the glyph and the images with
+    pixels of the glyph at their edges. The pixels of the glyph are the ones
+    that differ from the blank image.
+
+    Returns:
+        A tuple with the "empty" and the "clipped" flag of every image.
+    '''
+    if not tiles:
+        return [], []
+    if np is not None:
+        ink = (np.stack([np.asarray(tile) for tile in tiles]) != np.asarray(blank)).any(axis=3)
+        empty = ~ink.any(axis=(1, 2))
+        clipped = (
+            ink[:, 0, :].any(axis=1) | ink[:, -1, :].any(axis=1)
+            | ink[:, :, 0].any(axis=1) | ink[:, :, -1].any(axis=1))
+        return empty.tolist(), clipped.tolist()
+    empty, clipped = [], []
+    for tile in tiles:
+        # The largest difference of the four channels
+        bands = ImageChops.difference(tile, blank).split()
+        ink = bands[0]
+        for band in bands[1:]:
+            ink = ImageChops.lighter(ink, band)
+        box = ink.getbbox()
+        empty.append(box is None)
+        clipped.append(
+            box is not None
+            and (box[0] == 0 or box[1] == 0 or box[2] == tile.width or box[3] == tile.height))
+    return empty, clipped
+
+def _is_tofu(settings: "RenderSettings", char: str) -> bool:
+    '''
+    Checks if none of the fonts of a letter set has a character. Characters
+    drawn with a system font are not checked.
+    '''
+    font_path = letter_font_path(settings.font_path, settings.fallback_fonts, char)
+    if not font_path or not os.path.exists(font_path):
+        return False
+    return not font_has_character(font_path, char)
+
+def _contact_sheet(
+        tiles: list[Image.Image | None],
+        problems: list[list[str]],
+        image_size: tuple
+    ) -> Image.Image:
+    '''
+    Draws the images of a letter set in a grid, the images with problems
+    are outlined with the color of their first problem.
+    '''
+    width, height = image_size
+    columns = max(1, min(_SHEET_COLUMNS, len(tiles)))
+    rows = max(1, math.ceil(len(tiles) / columns))
+    sheet = Image.new(
+        'RGBA',
+        (columns * (width + _SHEET_GAP) + _SHEET_GAP, rows * (height + _SHEET_GAP) + _SHEET_GAP),
+        _SHEET_BACKGROUND)
+    draw = ImageDraw.Draw(sheet)
+    for i, (tile, tile_problems) in enumerate(zip(tiles, problems)):
+        x = _SHEET_GAP + (i % columns) * (width + _SHEET_GAP)
+        y = _SHEET_GAP + (i // columns) * (height + _SHEET_GAP)
+        if tile is not None:
+            sheet.paste(tile, (x, y), tile)
+        if tile_problems:
+            draw.rectangle(
+                (x - 2, y - 2, x + width + 1, y + height + 1),
+                outline=VALIDATION_PROBLEMS[tile_problems[0]], width=2)
+    return sheet
+
+def _compare_backend(
+        settings: "RenderSettings",
+        backend: str,
+        images: list[tuple[str, str]],
+        tiles: list[Image.Image | None]
+    ) -> dict[str, Any]:
+    '''
+    Draws the letters of a letter set with another render backend and
+    compares them with the generated images (see backend_differences).
+    '''
+    settings = settings._replace(backend=backend)
+    chars, drawn, references = [], [], []
+    with profile_span("compare_backend", backend=backend):
+        for (char, _), tile in zip(images, tiles):
+            if tile is None:
+                continue
+            metric = measure_glyph(_letter_font(settings, char)[1], char)
+            chars.append(char)
+            drawn.append(draw_letter(settings, char, metric).convert('RGBA'))
+            references.append(tile)
+        differences = backend_differences(drawn, references)
+    width, height = settings.image_size
+    return backend_difference_report(backend, chars, differences, width * height)
+
+def validate_letter_set(
+        job: tuple[str, tuple, list[tuple[str, str]], str | None, str | None]
+    ) -> dict[str, Any]:
+    """
+    Check the images of a letter set and draw its contact sheet. This is the
+    function executed by the worker processes.
+
+    Args:
+        job: Tuple with the ID of the letter set, its render settings (as a
+            tuple), the (character, image path) pairs of its images, the
+            path of the contact sheet (None to skip it) and the render
+            backend the images are compared with (None to skip it).
+
+    Returns:
+        The report of the letter set: the number of images, the images with
+        each of the VALIDATION_PROBLEMS as (character, image path) pairs, the
+        path of the contact sheet and the differences to the other backend
+        (see backend_difference_report).
+    """
+    set_id, settings, images, preview_path, compare_backend = job
+    settings = RenderSettings(*settings)
+    blank = _blank_tile(settings)
+    report = {"images": len(images), **{problem: [] for problem in VALIDATION_PROBLEMS}}
+
+    tiles = []
+    for _, image_path in images:
+        try:
+            with Image.open(image_path) as img:
+                tile = img.convert('RGBA')
+            tiles.append(tile if tile.size == blank.size else None)
+        except OSError:
+            tiles.append(None)
+    loaded = [tile for tile in tiles if tile is not None]
+    empty, clipped = _ink_stats(loaded, blank)
+    flags = iter(zip(empty, clipped))
+
+    problems = []
+    for (char, image_path), tile in zip(images, tiles):
+        tile_problems = []
+        if tile is None:
+            tile_problems.append("missing")
+        if _is_tofu(settings, char):
+            tile_problems.append("tofu")
+        if tile is not None:
+            is_empty, is_clipped = next(flags)
+            if is_empty:
+                tile_problems.append("empty")
+            if is_clipped:
+                tile_problems.append("clipped")
+        for problem in tile_problems:
+            report[problem].append((char, image_path))
+        problems.append(tile_problems)
+
+    if preview_path is not None:
+        with profile_span("contact_sheet", set_id=set_id):
+            sheet = _contact_sheet(tiles, problems, settings.image_size)
+            save_letter_image(sheet, Path(preview_path), "fast")
+        report["preview"] = preview_path
+    if compare_backend is not None and compare_backend != settings.backend:
+        report["backend_difference"] = _compare_backend(settings, compare_backend, images, tiles)
+    return report
+
+def validate_letter_sets(
+        plans: list["LetterSetPlan"],
+        preview_dir: str | None = None,
+        workers: int | None = None,
+        plugins_dir: str = "_plugins",
+        compare_backend: str | None = None
+    ) -> dict[str, dict[str, Any]]:
+    """
+    Check the images of the letter sets and draw their contact sheets (see
+    validate_letter_set). The letter sets are checked in parallel by a pool
+    of worker processes. An image generated by multiple letter sets is
+    checked with the last one, the one that rendered it.
+
+    Args:
+        plans: The plans of the letter sets (see _plan_letter_set).
+        preview_dir: Directory of the contact sheets and of the report. None
+            only prints the problems.
+        workers: Number of worker processes. 1 checks the letter sets in the
+            current process, None uses one process per CPU core.
+        plugins_dir: Path to the _plugins folder of the system.
+        compare_backend: Render backend the images of the letter sets are
+            compared with (see RENDER_BACKENDS), the letter sets that use it
+            are not compared. None skips the comparison.
+
+    Returns:
+        Dictionary of the letter set IDs to their reports.
+    """
+    if compare_backend is not None and compare_backend not in RENDER_BACKENDS:
+        raise ValueError(
+            f"Unknown render backend '{compare_backend}', expected one of: "
+            + ", ".join(RENDER_BACKENDS))
+    owned = set()
+    jobs = []
+    for plan in reversed(plans):
+        images = []
+        for char, image_path, _ in plan.images:
+            if image_path not in owned:
+                owned.add(image_path)
+                images.append((char, str(image_path)))
+        preview_path = None
+        if preview_dir is not None:
+            file_name = _UNSAFE_FILENAME_CHARACTERS.sub("_", plan.set_id)
+            preview_path = str(Path(preview_dir) / f"{file_name}.png")
+        jobs.append((plan.set_id, tuple(plan.settings), images, preview_path, compare_backend))
+    jobs.reverse()
+    if preview_dir is not None:
+        Path(preview_dir).mkdir(parents=True, exist_ok=True)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    with profile_span("validate_letter_sets"):
+        if workers <= 1:
+            reports = [validate_letter_set(job) for job in jobs]
+        else:
+            worker_module, bootstrap_scope = _load_worker_module(plugins_dir)
+            validate_function = worker_module.validate_letter_set
+            if profiling_enabled():
+                validate_function = partial(worker_module.profiled_worker_call, validate_function)
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=exec,
+                    initargs=(_WORKER_MODULE_SOURCE, bootstrap_scope)) as executor:
+                reports = []
+                for report in executor.map(validate_function, jobs):
+                    if profiling_enabled():
+                        report, events = report
+                        add_worker_spans(events)
+                    reports.append(report)
+    reports = {job[0]: report for job, report in zip(jobs, reports)}
+
+    print(validation_summary(reports))
+    if preview_dir is not None:
+        report_path = Path(preview_dir) / VALIDATION_REPORT_FILE
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=1, ensure_ascii=False)
+        print(f"Saved the contact sheets and the validation report to '{preview_dir}'")
+    return reports
+
+def validation_summary(reports: dict[str, dict[str, Any]]) -> str:
+    """
+    Describe the problems found by validate_letter_sets for the log.
+
+    Args:
+        reports: The reports of the letter sets.
+
+    Returns:
+        A message for the log, with a line for every letter set with problems.
+    """
+    totals = {
+        problem: sum(len(report[problem]) for report in reports.values())
+        for problem in VALIDATION_PROBLEMS
+    }
+    lines = [
+        f"Validated {sum(report['images'] for report in reports.values())} letter images "
+        f"of {len(reports)} letter sets: "
+        + ", ".join(f"{count} {problem}" for problem, count in totals.items())
+    ]
+    for set_id, report in reports.items():
+        found = [
+            f"{problem} " + " ".join(char for char, _ in report[problem][:10])
+            + (" ..." if len(report[problem]) > 10 else "")
+            for problem in VALIDATION_PROBLEMS if report[problem]
+        ]
+        if found:
+            lines.append(f"  '{set_id}': " + "; ".join(found))
+    compared = {
+        set_id: report["backend_difference"]
+        for set_id, report in reports.items() if "backend_difference" in report
+    }
+    if compared:
+        lines.append(
+            "Differences to the render backends, the largest and the mean channel "
+            f"difference and the pixels that differ by more than {BACKEND_DIFFERENCE_THRESHOLD}:")
+    for set_id, difference in compared.items():
+        worst = " ".join(char for char, _ in difference["worst"][:5])
+        lines.append(
+            f"  '{set_id}' to '{difference['backend']}': max {difference['max']}, "
+            f"mean {difference['mean']:.2f}, {difference['changed_pixels']:.2%} pixels"
+            + (f" (worst: {worst})" if worst else ""))
+    return "\n".join(lines)
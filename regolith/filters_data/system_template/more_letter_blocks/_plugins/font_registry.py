@@ -0,0 +1,225 @@
+'''
+This script provides the process-wide registry of the fonts used to render
+the letters. Every font is opened once per process for each size, paths that
+can't be opened are remembered, so the system fonts are probed only once,
+and the characters of a font are read from its cmap table, so the letters
+missing from the font of a letter set can be drawn with a fallback font
+instead of the "missing glyph" box.
+'''
+from functools import lru_cache
+from typing import Any
+from PIL import ImageFont
+import multiprocessing
+import os
+import struct
+import sys
+
+# The fonts tried when the font of a letter set can't be loaded. Pillow
+# searches the font directories of the system for the plain filenames.
+_SYSTEM_FONTS = {
+    "win32": ["arial.ttf", "Arial.ttf"],
+    "darwin": [
+        "Arial.ttf",
+        "/System/Library/Fonts/Helvetica.ttc",
+        "/System/Library/Fonts/SFNSText.ttf",
+    ],
+    "linux": ["DejaVuSans.ttf", "FreeSans.ttf", "arial.ttf", "Arial.ttf"],
+}
+
+# Paths that failed to load. A font file that is missing or can't be read
+# fails for all sizes, so it's probed only once.
+_failed_fonts: set[str] = set()
+
+@lru_cache(maxsize=None)
+def load_font(path: str, size: int) -> Any:
+    """
+    Load a TrueType/OpenType font.
+
+    Args:
+        path: Path to the font file, or a filename searched by Pillow in the
+            font directories of the system.
+        size: Size of the font.
+
+    Returns:
+        The font, or None if it can't be loaded.
+    """
+    if not path or path in _failed_fonts:
+        return None
+    try:
+        return ImageFont.truetype(path, size)
+    except (OSError, ValueError):
+        _failed_fonts.add(path)
+        return None
+
+@lru_cache(maxsize=None)
+def resolve_font(font_path: str | None, size: int) -> Any:
+    """
+    Get the font of a letter set. If the font can't be loaded, the first
+    system font that can be is used, or Pillow's default font as the last
+    resort.
+
+    Only the main process logs the font, the worker processes load the same
+    fonts.
+
+    Args:
+        font_path: Path to the font of the letter set.
+        size: Size the letters are drawn at, four times the font_size of the
+            letter sets drawn on oversampled images.
+
+    Returns:
+        The font.
+    """
+    log = multiprocessing.parent_process() is None
+    if font_path and os.path.exists(font_path):
+        font = load_font(font_path, size)
+        if font is not None:
+            if log:
+                print(f"Successfully loaded custom font '{font_path}' with drawing size {size}")
+            return font
+        print(f"Error loading custom font '{font_path}'")
+
+    # Fallback to system fonts if custom font failed or wasn't specified
+    platform = sys.platform if sys.platform in _SYSTEM_FONTS else "linux"
+    for system_font in _SYSTEM_FONTS[platform]:
+        font = load_font(system_font, size)
+        if font is not None:
+            if log:
+                print(f"Using system font '{system_font}' with drawing size {size}")
+            return font
+
+    # Last resort: Use a default font and scale it (though this might not be perfect)
+    print(f"Using default font. Font size may not appear as expected.")
+    return ImageFont.load_default()
+
+def _read_cmap(data: bytes, offset: int) -> set[int]:
+    # Code points with a glyph in the Unicode subtables (formats 4 and 12)
+    # of the cmap table at the offset
+    code_points = set()
+    _, table_count = struct.unpack_from(">HH", data, offset)
+    for i in range(table_count):
+        platform_id, encoding_id, subtable_offset = struct.unpack_from(
+            ">HHI", data, offset + 4 + 8 * i)
+        if not (platform_id == 0 or (platform_id == 3 and encoding_id in (1, 10))):
+            continue
+        subtable = offset + subtable_offset
+        table_format = struct.unpack_from(">H", data, subtable)[0]
+        if table_format == 4:
+            segment_count = struct.unpack_from(">H", data, subtable + 6)[0] // 2
+            ends = struct.unpack_from(f">{segment_count}H", data, subtable + 14)
+            starts_offset = subtable + 16 + 2 * segment_count
+            starts = struct.unpack_from(f">{segment_count}H", data, starts_offset)
+            deltas = struct.unpack_from(
+                f">{segment_count}h", data, starts_offset + 2 * segment_count)
+            range_offsets_offset = starts_offset + 4 * segment_count
+            range_offsets = struct.unpack_from(
+                f">{segment_count}H", data, range_offsets_offset)
+            for segment, (start, end) in enumerate(zip(starts, ends)):
+                if start == 0xFFFF:
+                    continue
+                if range_offsets[segment] == 0:
+                    code_points.update(
+                        code for code in range(start, end + 1)
+                        if (code + deltas[segment]) & 0xFFFF)
+                    continue
+                for code in range(start, end + 1):
+                    glyph_offset = (
+                        range_offsets_offset + 2 * segment + range_offsets[segment]
+                        + 2 * (code - start))
+                    if struct.unpack_from(">H", data, glyph_offset)[0]:
+                        code_points.add(code)
+        elif table_format == 12:
+            group_count = struct.unpack_from(">I", data, subtable + 12)[0]
+            for group in range(group_count):
+                start, end, start_glyph = struct.unpack_from(
+                    ">III", data, subtable + 16 + 12 * group)
+                code_points.update(range(start + (start_glyph == 0), end + 1))
+    return code_points
+
+@lru_cache(maxsize=None)
+def font_characters(path: str) -> frozenset[int] | None:
+    """
+    Read the characters of a font file from its cmap table. For font
+    collections, the characters of the first font are read.
+
+    Args:
+        path: Path to the font file.
+
+    Returns:
+        The code points of the characters with a glyph, or None if the file
+        can't be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        font_offset = 0
+        if data[:4] == b"ttcf":
+            font_offset = struct.unpack_from(">I", data, 12)[0]
+        table_count = struct.unpack_from(">H", data, font_offset + 4)[0]
+        for i in range(table_count):
+            tag, _, table_offset, _ = struct.unpack_from(
+                ">4sIII", data, font_offset + 12 + 16 * i)
+            if tag == b"cmap":
+                return frozenset(_read_cmap(data, table_offset))
+    except (OSError, struct.error) as e:
+        print(f"Unable to read the characters of the font '{path}': {e}")
+    return None
+
+def font_has_character(path: str, char: str) -> bool:
+    """
+    Check if a font has a glyph for every character of a string.
+
+    Args:
+        path: Path to the font file.
+        char: The character (or a sequence of characters).
+
+    Returns:
+        True if the font has all of the characters, or if its characters
+        can't be read.
+    """
+    characters = font_characters(path)
+    return characters is None or all(ord(c) in characters for c in char)
+
+@lru_cache(maxsize=None)
+def letter_font_path(font_path: str | None, fallback_fonts: tuple, char: str) -> str | None:
+    """
+    Get the font file a character of a letter set is drawn with: the font of
+    the letter set, or the first of its fallback fonts that has the character.
+
+    Args:
+        font_path: Path to the font of the letter set.
+        fallback_fonts: Paths to the fallback fonts, in the order of
+            preference.
+        char: The character.
+
+    Returns:
+        The path to the font file, font_path if none of the fonts has the
+        character.
+    """
+    if not fallback_fonts:
+        return font_path
+    for path in (font_path, *fallback_fonts):
+        if path and os.path.exists(path) and font_has_character(path, char):
+            return path
+    return font_path
+
+def letter_font(font_path: str | None, fallback_fonts: tuple, size: int, char: str) -> tuple[str | None, Any]:
+    """
+    Get the font a character of a letter set is drawn with (see
+    letter_font_path).
+
+    Args:
+        font_path: Path to the font of the letter set.
+        fallback_fonts: Paths to the fallback fonts, in the order of
+            preference.
+        size: Size of the fonts.
+        char: The character.
+
+    Returns:
+        A tuple with the path to the font file and the font.
+    """
+    path = letter_font_path(font_path, fallback_fonts, char)
+    if path != font_path:
+        font = load_font(path, size)
+        if font is not None:
+            return path, font
+    return font_path, resolve_font(font_path, size)
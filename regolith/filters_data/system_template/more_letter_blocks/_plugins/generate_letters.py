@@ -2,12 +2,17 @@
 This script generates 64x64 images with transparent backgrounds for each letter
 in a string provided in the scope. It uses the Pillow library for image manipulation.
 '''
-from typing import Any, Dict, TypedDict
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, TypedDict
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import hashlib
+import itertools
+import math
 import os
 import re
-import shutil
+import sys
 
 from array import array
 
@@ -52,57 +57,631 @@ class LetterItem(TypedDict):
     safe_name: str
     group: str
 
-def generate_letter_images(
-        map_py_item: dict[str, Any],
-        letters: list[LetterItem],
-        output_dir: str = ".",
-        font_path: str = None,
-        font_size: int = 64,
-        text_color: tuple = (255, 255, 255, 255),
-        image_size: tuple = (64, 64),
-        background_image_path: str = None,
-        suffix: str = None,
-        aliasing: bool = False
-    ) -> dict[str, Any]:
+class RenderSettings(NamedTuple):
     '''
-    Generates an image for each letter in the provided string with transparent background.
-    
+    The settings of a letter set that affect how its images are rendered.
+    '''
+    font_path: str
+    font_size: int
+    text_color: tuple
+    image_size: tuple
+    work_size: tuple
+    background_image_path: str
+    aliasing: bool
+    # "glyph" renders every letter on its own image, "atlas" renders all
+    # letters of the set on one sheet and slices it
+    render_mode: str = "glyph"
+    # Filter used to downsample the oversampled images: "box", "nearest" or
+    # "lanczos" (see _RESAMPLE_FILTERS)
+    downsample: str = "lanczos"
+    # PNG encoding profile of the images (see letter_encoding.py)
+    encoding: str = "default"
+    # Fonts that draw the characters missing from the font (see letter_font)
+    fallback_fonts: tuple = ()
+    # "oversample" draws the letters on the oversampled images and
+    # downsamples them, "freetype" rasterizes them at the size of the images
+    # (see letter_backends.py)
+    backend: str = "oversample"
+
+def _scaled_font_size(settings: RenderSettings) -> int:
+    '''
+    Returns the size of the font used to draw on the oversampled images, or
+    on the letter images with the "freetype" backend.
+    '''
+    oversampled = settings.aliasing and settings.backend == "oversample"
+    return settings.font_size * (4 if oversampled else 1)
+
+@lru_cache(maxsize=None)
+def _load_render_context(settings: RenderSettings) -> tuple[Any, Any]:
+    '''
+    Loads the font and the background image of a letter set. The result is
+    cached, so every process loads them only once for each letter set.
+    Letters missing from the font are drawn with the fonts returned by
+    _letter_font.
+
     Args:
-        map_py_item: The map_py item from system_template.
-        letters: String containing all the letters to generate images for.
-        output_dir: Directory where the images will be saved.
-        font_path: Path to a custom font file. If None, default font will be used.
-        font_size: Font size to use.
-        text_color: RGBA color tuple for the text.
-        image_size: Tuple with (width, height) of the output image.
-        background_image_path: Path to background image. If None, transparent background will be used.
-        aliasing: Enable aliasing via oversampling and downsampling
-        
+        settings: The render settings of the letter set.
+
     Returns:
-        The unmodified map_py_item.
+        A tuple with the font and the background image (or None).
     '''
-    # Create output directory if it doesn't exist
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+    font_path, work_size = settings.font_path, settings.work_size
+    background_image_path = settings.background_image_path
+    # Load background image if provided
+    background_image = None
+    if background_image_path and os.path.exists(background_image_path):
+        try:
+            with profile_span("background_load", path=background_image_path):
+                background_image = Image.open(background_image_path).convert('RGBA')
+                background_image = background_image.resize(work_size, resample=Image.NEAREST)
+            print(f"Using background image: {background_image_path}")
+        except Exception as e:
+            print(f"Error loading background image: {e}")
+            background_image = None
+    else:
+        print("No background image provided or file not found. Using transparent background. Path: " + 
+              str(os.path.abspath(background_image_path) if background_image_path else "None"))
     
+    # The fonts are shared by all of the letter sets (see font_registry.py)
+    with profile_span("font_load", path=font_path):
+        font = resolve_font(font_path, _scaled_font_size(settings))
+    return font, background_image
+
+@lru_cache(maxsize=None)
+def _work_buffer(settings: RenderSettings) -> Image.Image:
+    '''
+    Returns the oversampled image the letters of a letter set are drawn on.
+    It's allocated once per process and letter set, every letter overwrites
+    it with the background before drawing.
+    '''
+    _, background_image = _load_render_context(settings)
+    buffer = Image.new('RGBA', settings.work_size, (0, 0, 0, 0))
+    if background_image:
+        # Keep the metadata (e.g. the color profile) of the background, like
+        # a copy of the background would
+        buffer.info = background_image.info.copy()
+    return buffer
+
+# The filters that can be used to downsample the oversampled images
+_RESAMPLE_FILTERS = {
+    "box": Image.BOX,
+    "nearest": Image.NEAREST,
+    "lanczos": Image.LANCZOS,
+}
+
+def _resample_filter(settings: RenderSettings) -> int:
+    '''
+    Returns the Pillow filter used to downsample the oversampled images.
+    '''
+    return _RESAMPLE_FILTERS[settings.downsample]
+
+def _letter_font(settings: RenderSettings, char: str) -> tuple[str | None, Any]:
+    '''
+    Returns the path to the font file and the font a character of a letter
+    set is drawn with, the font of the letter set or one of its fallback
+    fonts.
+    '''
+    return letter_font(
+        settings.font_path, settings.fallback_fonts, _scaled_font_size(settings), char)
+
+def _glyph_position(
+        metric: "GlyphMetric",
+        size: tuple
+    ) -> tuple[tuple[int, int], tuple[int, int, int, int] | None]:
+    '''
+    Calculates the position that centers a character in an image.
+
+    Args:
+        metric: The metrics of the character (see _measure_letter).
+        size: Tuple with (width, height) of the image.
+
+    Returns:
+        A tuple with the position of the text and the bounding box of the
+        drawn text at that position (None if it can't be measured).
+    '''
+    width, height = size
+    left, top, right, bottom, exact = metric
+    text_width = right - left
+    text_height = bottom - top
+
+    # Account for the text's position relative to the origin for proper centering
+    position = ((width - text_width) // 2 - left, (height - text_height) // 2 - top)
+    if not exact:
+        return position, None
+    return position, (
+        position[0] + left, position[1] + top,
+        position[0] + right, position[1] + bottom)
+
+def _measure_letter(
+        settings: RenderSettings,
+        char: str,
+        glyph_metrics: "GlyphMetrics"
+    ) -> "GlyphMetric":
+    '''
+    Gets the metrics of a character of a letter set. The character is
+    measured only if no letter set with the same font measured it before.
+    Characters drawn with a fallback font are stored under that font.
+
+    Args:
+        settings: The render settings of the letter set.
+        char: The character.
+        glyph_metrics: The glyph metrics of the output directory.
+
+    Returns:
+        The metrics of the character.
+    '''
+    font_path = letter_font_path(settings.font_path, settings.fallback_fonts, char)
+    font_digest = file_digest(font_path)
+    font_size = _scaled_font_size(settings)
+    metric = glyph_metrics.get(font_digest, font_size, char) if font_digest else None
+    if metric is None:
+        font_path, font = _letter_font(settings, char)
+        with profile_span("metrics"):
+            metric = measure_glyph(font, char)
+        # The metrics of a system font are not stored under the digest of
+        # the font file
+        if font_digest and getattr(font, "path", None) == font_path:
+            glyph_metrics.put(font_digest, font_size, char, metric)
+    return metric
+
+def _draw_letter(
+        settings: RenderSettings,
+        char: str,
+        metric: "GlyphMetric"
+    ) -> Image.Image:
+    '''
+    Draws a single letter on the oversampled image and downsamples it, the
+    "oversample" backend.
+
+    Returns:
+        The letter image.
+    '''
+    _, background_image = _load_render_context(settings)
+    _, font = _letter_font(settings, char)
+
+    # Reset the oversampled image
+    img = _work_buffer(settings)
+    if background_image:
+        img.paste(background_image, (0, 0))
+    else:
+        img.paste((0, 0, 0, 0), (0, 0, *settings.work_size))
+
+    position, _ = _glyph_position(metric, img.size)
+
+    # Draw the letter, the letter sets with other backgrounds share its mask
+    mask = glyph_mask(font, char, position, img.size)
+    with profile_span("draw"):
+        paint_glyph(img, (0, 0), mask, settings.text_color)
+
+    with profile_span("resize"):
+        return img.resize(settings.image_size, resample=_resample_filter(settings))
+
+def _render_letter(
+        settings: RenderSettings,
+        char: str,
+        image_path: Path,
+        metric: "GlyphMetric"
+    ) -> tuple[int, int | None]:
+    '''
+    Renders a single letter and saves it to image_path. The directory of the
+    image must exist (see _create_image_directories).
+
+    Returns:
+        The size of the file and its size with the default encoding (see
+        save_letter_image).
+    '''
+    img = _draw_letter(settings, char, metric)
+    return save_letter_image(img, image_path, settings.encoding)
+
+# Maximum number of letters rendered on one atlas sheet. Limits the memory
+# used by the sheet of large letter sets.
+_ATLAS_MAX_TILES = 64
+
+# Filters that only sample the pixels of the source tile when downsampling by
+# an integer factor. Sheets are downsampled at once only with these filters,
+# other filters would blend the neighbouring tiles at the tile edges.
+_TILE_LOCAL_FILTERS = (Image.NEAREST, Image.BOX)
+
+def _render_letter_atlas(
+        settings: RenderSettings,
+        items: list[tuple[str, Path, "GlyphMetric"]]
+    ):
+    '''
+    Renders the letters of a letter set onto one oversampled sheet, then
+    downsamples the sheet and slices it into the letter images. The images
+    are identical to the ones rendered by _render_letter.
+
+    Args:
+        settings: The render settings of the letter set.
+        items: List of (character, output path, metrics) tuples to render.
+
+    Returns:
+        The encoding stats of the images (see _render_work_unit).
+    '''
+    _, background_image = _load_render_context(settings)
+    stats = (0, 0, 0)
+    tile_width, tile_height = settings.work_size
+    columns = max(1, math.ceil(math.sqrt(len(items))))
+    rows = math.ceil(len(items) / columns)
+    sheet = Image.new('RGBA', (columns * tile_width, rows * tile_height), (0, 0, 0, 0))
+    if background_image:
+        # Keep the metadata (e.g. the color profile) of the background, like
+        # the copies of the background made by _render_letter
+        sheet.info = background_image.info.copy()
+
+    # Letters that would draw outside of their tile can't share the sheet
+    # with other letters, they are rendered on their own
+    tiles = []
+    for char, image_path, metric in items:
+        position, box = _glyph_position(metric, settings.work_size)
+        if box is None or box[0] < 0 or box[1] < 0 or box[2] > tile_width or box[3] > tile_height:
+            stats = _add_encoding_stats(stats, _render_letter(settings, char, image_path, metric))
+            continue
+        column, row = len(tiles) % columns, len(tiles) // columns
+        origin = (column * tile_width, row * tile_height)
+        if background_image:
+            sheet.paste(background_image, origin)
+        font = _letter_font(settings, char)[1]
+        mask = glyph_mask(font, char, position, settings.work_size)
+        with profile_span("draw"):
+            paint_glyph(sheet, origin, mask, settings.text_color)
+        tiles.append((origin, image_path))
+
+    image_width, image_height = settings.image_size
+    resample = _resample_filter(settings)
+    scale_x, scale_y = tile_width // image_width, tile_height // image_height
+    sheet_downsampled = (
+        resample in _TILE_LOCAL_FILTERS
+        and tile_width == scale_x * image_width
+        and tile_height == scale_y * image_height)
+    if sheet_downsampled:
+        with profile_span("resize", tiles=len(tiles)):
+            sheet = sheet.resize(
+                (columns * image_width, rows * image_height), resample=resample)
+    for (x, y), image_path in tiles:
+        if sheet_downsampled:
+            x, y = x // scale_x, y // scale_y
+            img = sheet.crop((x, y, x + image_width, y + image_height))
+        else:
+            img = sheet.crop((x, y, x + tile_width, y + tile_height))
+            with profile_span("resize"):
+                img = img.resize(settings.image_size, resample=resample)
+        stats = _add_encoding_stats(stats, save_letter_image(img, image_path, settings.encoding))
+    return stats
+
+def _add_encoding_stats(
+        stats: tuple[int, int, int | None],
+        image_stats: tuple[int, ...]
+    ) -> tuple[int, int, int | None]:
+    '''
+    Adds the encoding stats of an image (see save_letter_image) or of a work
+    unit to the encoding stats of the previous images.
+    '''
+    if len(image_stats) == 2:
+        image_stats = (1, *image_stats)
+    images, written, default_written = stats
+    if default_written is not None and image_stats[2] is not None:
+        default_written += image_stats[2]
+    else:
+        default_written = None
+    return images + image_stats[0], written + image_stats[1], default_written
+
+def _render_work_unit(
+        unit: tuple[tuple, list[tuple[str, str, tuple]]]
+    ) -> tuple[int, int, int | None]:
+    '''
+    Renders a work unit: a batch of characters of one letter set. This is the
+    function executed by the worker processes.
+
+    Returns:
+        The encoding stats: the number of rendered images, the size of their
+        files and their size with the default encoding (None if unknown).
+    '''
+    settings, items = unit
+    settings = RenderSettings(*settings)
+    items = [
+        (char, Path(image_path), GlyphMetric(*metric))
+        for char, image_path, metric in items
+    ]
+    if settings.backend == "freetype":
+        return _render_letters_freetype(settings, items)
+    if settings.render_mode == "atlas":
+        return _render_letter_atlas(settings, items)
+    stats = (0, 0, 0)
+    for char, image_path, metric in items:
+        stats = _add_encoding_stats(stats, _render_letter(settings, char, image_path, metric))
+    return stats
+
+# Runs in the parent process and in each worker process. It executes the
+# plugin files into a module registered in sys.modules, so that the functions
+# sent to the worker processes can be pickled by reference.
+_WORKER_MODULE_SOURCE = '''
+import sys
+import types
+from pathlib import Path
+if module_name not in sys.modules:
+    module = types.ModuleType(module_name)
+    sys.modules[module_name] = module
+    for plugin_path in sorted(Path(plugins_dir).glob("*.py")):
+        code = compile(plugin_path.read_text(encoding="utf-8"), str(plugin_path), "exec")
+        exec(code, module.__dict__)
+'''
+
+def _load_worker_module(plugins_dir: str) -> tuple[Any, dict[str, str]]:
+    '''
+    Loads the plugins into the module the worker processes load them into
+    (see _WORKER_MODULE_SOURCE), so the functions of the module can be sent
+    to the workers.
+
+    Args:
+        plugins_dir: Path to the _plugins folder of the system.
+
+    Returns:
+        A tuple with the module and the scope of _WORKER_MODULE_SOURCE, the
+        initializer arguments of the worker processes.
+    '''
+    plugins_dir = str(Path(plugins_dir).resolve())
+    bootstrap_scope = {
+        "module_name": "letter_blocks_plugins_" + hashlib.md5(
+            plugins_dir.encode("utf-8")).hexdigest()[:8],
+        "plugins_dir": plugins_dir,
+    }
+    exec(_WORKER_MODULE_SOURCE, dict(bootstrap_scope))
+    return sys.modules[bootstrap_scope["module_name"]], bootstrap_scope
+
+# Number of work units sent to the worker processes ahead of the finished
+# ones per worker, when the work units are produced by an iterator
+_UNITS_IN_FLIGHT_PER_WORKER = 4
+
+def _render_work_units(
+        units: Iterable[tuple[RenderSettings, list[tuple[str, str, tuple]]]],
+        workers: int = 1,
+        plugins_dir: str = "_plugins"
+    ) -> tuple[int, int, int | None]:
+    '''
+    Renders the work units, either serially or in a pool of worker processes.
+
+    Args:
+        units: List of (render settings, [(character, output path, metrics), ...])
+            tuples, each of them rendered by one call of _render_work_unit.
+            An iterator is consumed lazily, only a few work units per worker
+            exist at a time.
+        workers: Number of worker processes. 1 renders in the current process,
+            None uses one process per CPU core.
+        plugins_dir: Path to the _plugins folder of the system. The worker
+            processes load the rendering code from it.
+
+    Returns:
+        The encoding stats of all of the work units (see _render_work_unit).
+    '''
+    stats = (0, 0, 0)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if isinstance(units, list):
+        workers = min(workers, len(units))
+    if workers <= 1:
+        # The images are encoded and written by the letter pipeline while the
+        # next ones are rendered, the pipeline counts their sizes
+        with letter_writer() as writer:
+            for unit in units:
+                stats = _add_encoding_stats(stats, _render_work_unit(unit))
+        _, written, default_written = writer.stats
+        return _add_encoding_stats(stats, (0, written, default_written))
+    worker_module, bootstrap_scope = _load_worker_module(plugins_dir)
+    render_function = worker_module._render_work_unit
+    if profiling_enabled():
+        # The workers send their spans back with the results
+        render_function = partial(
+            worker_module.profiled_worker_call, render_function)
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=exec,
+            initargs=(_WORKER_MODULE_SOURCE, bootstrap_scope)) as executor:
+        if isinstance(units, list):
+            # Large chunks keep the font and background loaded by each worker
+            # busy, while leaving enough chunks to balance the load between
+            # the workers
+            chunksize = max(1, len(units) // (workers * 4))
+            # The settings are sent as plain tuples, the RenderSettings class
+            # of the calling scope can't be pickled
+            units = [(tuple(settings), items) for settings, items in units]
+            print(
+                f"Rendering {sum(len(items) for _, items in units)} letter images "
+                f"with {workers} worker processes")
+            results = executor.map(render_function, units, chunksize=chunksize)
+        else:
+            # Executor.map would submit all of the work units at once
+            print(f"Streaming letter images to {workers} worker processes")
+            results = _map_bounded(
+                executor, render_function,
+                ((tuple(settings), items) for settings, items in units),
+                workers * _UNITS_IN_FLIGHT_PER_WORKER)
+        for unit_stats in results:
+            if profiling_enabled():
+                unit_stats, events = unit_stats
+                add_worker_spans(events)
+            stats = _add_encoding_stats(stats, unit_stats)
+    return stats
+
+def _map_bounded(executor: ProcessPoolExecutor, function, iterable: Iterable, limit: int) -> Iterator:
+    '''
+    Like Executor.map, but submits at most limit calls ahead of the results
+    that were read.
+    '''
+    pending = []
+    for args in iterable:
+        pending.append(executor.submit(function, args))
+        if len(pending) >= limit:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+class LetterSetPlan(NamedTuple):
+    '''
+    The images of a letter set and the ones that have to be rendered by the
+    current run.
+    '''
+    set_id: str
+    settings: RenderSettings
+    # (character, output path, cache key) of every image of the set. Listed
+    # lazily by _LetterImages for the letter sets rendered in the streaming
+    # mode.
+    images: Iterable[tuple[str, Path, str]]
+    # (character, output path) of the images to render
+    pending: list[tuple[str, Path]]
+    characters: str
+    # The number of "rendered" images of a letter set rendered in the
+    # streaming mode (its images are not stored in pending), None for the
+    # other letter sets
+    stream: dict[str, int] | None = None
+
+def _decode_letters(letters: Iterable[LetterItem]) -> Iterator[tuple[str, str, str]]:
+    '''
+    Decodes the letters of a letter set lazily.
+
+    Yields:
+        Tuples with the character, its filename and its group.
+    '''
+    for item in letters:
+        char = escape_to_char(item["char"])
+        yield char, item.get("safe_name") or safe_filename(char), item.get("group")
+
+def _letter_image_path(
+        output_path: Path,
+        filename: str,
+        group: str,
+        background_subfolder: str | None,
+        suffix: str | None
+    ) -> Path:
+    '''
+    Returns the path of the image of a letter.
+    '''
+    output_path_group = output_path
+    if group:
+        output_path_group = output_path / group
+    # Add background subfolder if available
+    if background_subfolder:
+        output_path_group = output_path_group / background_subfolder
+
+    # Determine filename with optional background suffix
+    name = f"{filename}{suffix}.block.png" if suffix else f"{filename}.block.png"
+    return output_path_group / name
+
+def _background_subfolder(background_image_path: str | None) -> str | None:
+    '''
+    Returns the name of the subfolder of the images of a letter set with a
+    background, or None for the letter sets without a background.
+    '''
     # Extract background image name if provided
-    background_subfolder = None
-    if background_image_path:
-        # Get the filename without directory path
-        bg_filename = os.path.basename(background_image_path)
-        # Remove .block.png suffix if present
-        background_subfolder = bg_filename.replace('.block.png', '')
-    
+    if not background_image_path:
+        return None
+    # Get the filename without directory path
+    bg_filename = os.path.basename(background_image_path)
+    # Remove .block.png suffix if present
+    return bg_filename.replace('.block.png', '')
+
+def letter_set_id(
+        set_id: str | None,
+        background_image_path: str | None,
+        suffix: str | None,
+        font_size: int
+    ) -> str:
+    """
+    Get the ID of a letter set, the one set in the scope or the one derived
+    from its settings.
+
+    Args:
+        set_id: The "id" of the letter set, or None.
+        background_image_path: The background of the letter set.
+        suffix: The filename suffix of the letter set.
+        font_size: The font size of the letter set.
+
+    Returns:
+        The ID of the letter set.
+    """
+    if set_id is not None:
+        return set_id
+    return f"{_background_subfolder(background_image_path)}{suffix or ''}_{font_size}"
+
+class _LetterImages:
+    '''
+    The images of a letter set rendered in the streaming mode. The output
+    paths and cache keys are computed one at a time, every time the images
+    are iterated, instead of being stored.
+    '''
+    def __init__(self, char_map: dict[str, tuple[str, str]], image_path: Any, cache_key: Any):
+        self.char_map = char_map
+        self.image_path = image_path
+        self.cache_key = cache_key
+
+    def __iter__(self) -> Iterator[tuple[str, Path, str]]:
+        for char, (filename, group) in self.char_map.items():
+            if not char.strip():  # Skip whitespace-only characters
+                continue
+            yield char, self.image_path(filename, group), self.cache_key(char)
+
+def _plan_letter_set(
+        letters: list[LetterItem],
+        output_path: Path,
+        font_path: str,
+        font_size: int,
+        text_color: tuple,
+        image_size: tuple,
+        background_image_path: str,
+        suffix: str,
+        aliasing: bool,
+        set_id: str,
+        render_mode: str = "glyph",
+        downsample: str = "lanczos",
+        encoding: str = "default",
+        stream: bool = False,
+        fallback_fonts: list[str] | None = None,
+        backend: str = "oversample"
+    ) -> LetterSetPlan:
+    '''
+    Writes the character mapping of a letter set and lists its images. In the
+    streaming mode, the images are listed lazily while they're rendered.
+
+    Returns:
+        The plan of the letter set, with no pending images yet.
+    '''
+    if downsample not in _RESAMPLE_FILTERS:
+        raise ValueError(
+            f"Unknown downsample filter '{downsample}', expected one of: "
+            + ", ".join(_RESAMPLE_FILTERS))
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(
+            f"Unknown render backend '{backend}', expected one of: "
+            + ", ".join(RENDER_BACKENDS))
+    if encoding not in ENCODING_PROFILES:
+        raise ValueError(
+            f"Unknown encoding '{encoding}', expected one of: "
+            + ", ".join(ENCODING_PROFILES))
+    background_subfolder = _background_subfolder(background_image_path)
+
+    # Determine oversampling factor and working size before any image ops
+    scale = 4 if aliasing else 1
+    work_size = (image_size[0] * scale, image_size[1] * scale)
+    settings = RenderSettings(
+        font_path, font_size, tuple(text_color), tuple(image_size), work_size,
+        background_image_path, aliasing, render_mode, downsample, encoding, tuple(fallback_fonts or ()), backend)
+
+    if set_id is None:
+        set_id = letter_set_id(None, background_image_path, suffix, font_size)
+    background_digest = file_digest(background_image_path)
+
+    def cache_key(char: str) -> str:
+        # The key depends on the font the character is drawn with
+        font_digest = file_digest(
+            letter_font_path(font_path, settings.fallback_fonts, char))
+        return glyph_cache_key(
+            char, font_digest, font_size, text_color, image_size,
+            background_digest, aliasing, suffix, downsample, encoding, backend)
+
     # Adapt letters array → actual chars, filename and group
-    decoded = [
-        (escape_to_char(item["char"]),
-         item.get("safe_name"),
-         item.get("group"))
-        for item in letters
-    ]
     char_map = {
-        char: ((safe_name or safe_filename(char)), group)
-        for char, safe_name, group in decoded
+        char: (filename, group)
+        for char, filename, group in _decode_letters(letters)
     }
 
     # Create a reverse mapping for debugging and reference
@@ -112,119 +691,179 @@ def generate_letter_images(
         for char, (filename, group) in char_map.items():
             f.write(f"{char}\t{filename}\t{ord(char)}\t{group}\n")
     print(f"Created character mapping reference at {mapping_file_path}")
-    
-    # Determine oversampling factor and working size before any image ops
-    scale = 4 if aliasing else 1
-    work_size = (image_size[0] * scale, image_size[1] * scale)
 
-    # Load background image if provided
-    background_image = None
-    if background_image_path and os.path.exists(background_image_path):
-        try:
-            background_image = Image.open(background_image_path).convert('RGBA')
-            background_image = background_image.resize(work_size, resample=Image.NEAREST)
-            print(f"Using background image: {background_image_path}")
-        except Exception as e:
-            print(f"Error loading background image: {e}")
-            background_image = None
-    else:
-        print("No background image provided or file not found. Using transparent background. Path: " + 
-              str(os.path.abspath(background_image_path) if background_image_path else "None"))
-    
-    # Load font with better fallback handling
-    font = None
-    
-    # Try to load the specified custom font
-    font_size_used = font_size * (4 if aliasing else 1)
-    if font_path and os.path.exists(font_path):
-        try:
-            font = ImageFont.truetype(font_path, font_size_used)
-            print(f"Successfully loaded custom font '{font_path}' with size {font_size}")
-        except Exception as e:
-            print(f"Error loading custom font '{font_path}': {e}")
-            font = None
-    
-    # Fallback to system fonts if custom font failed or wasn't specified
-    if font is None:
-        system_fonts = [
-            "arial.ttf", "Arial.ttf",                  # Windows
-            "DejaVuSans.ttf", "FreeSans.ttf",          # Linux
-            "/System/Library/Fonts/Helvetica.ttc",     # macOS
-            "/System/Library/Fonts/SFNSText.ttf"       # macOS
-        ]
-        
-        for system_font in system_fonts:
-            try:
-                font = ImageFont.truetype(system_font, font_size_used)
-                print(f"Using system font '{system_font}' with size {font_size}")
-                break
-            except Exception:
-                continue
-    
-    # Last resort: Use a default font and scale it (though this might not be perfect)
-    if font is None:
-        print(f"Using default font. Font size may not appear as expected.")
-        font = ImageFont.load_default()
-        # Some versions of PIL don't support resizing the default font
-    
-    # Generate an image for each unique letter
+    if stream:
+        images = _LetterImages(
+            char_map,
+            lambda filename, group: _letter_image_path(
+                output_path, filename, group, background_subfolder, suffix),
+            cache_key)
+        return LetterSetPlan(
+            set_id, settings, images, [], "".join(char_map.keys()),
+            {"rendered": 0})
+
+    images = []
     for char, (filename, group) in char_map.items():
-        if char.strip():  # Skip whitespace-only characters
-            output_path_group = output_path
-            if group:
-                output_path_group = output_path / group
-                output_path_group.mkdir(parents=True, exist_ok=True)
-
-            # Add background subfolder if available
-            if background_subfolder:
-                output_path_group = output_path_group / background_subfolder
-                output_path_group.mkdir(parents=True, exist_ok=True)
-
-            # create the oversampled image
-            if background_image:
-                img = background_image.copy()
-            else:
-                img = Image.new('RGBA', work_size, (0, 0, 0, 0))
-
-            draw = ImageDraw.Draw(img)
-            
-            # Calculate text size to center it
-            try:
-                # For newer Pillow versions
-                left, top, right, bottom = draw.textbbox((0, 0), char, font=font)
-                text_width = right - left
-                text_height = bottom - top
-                
-                # Account for the text's position relative to the origin for proper centering
-                position = ((img.width - text_width) // 2 - left, (img.height - text_height) // 2 - top)
-            except AttributeError:
-                # For older Pillow versions
-                text_width, text_height = draw.textsize(char, font=font)
-                
-                # Try to get offset information if available
-                try:
-                    offset_x, offset_y = font.getoffset(char)
-                    position = ((img.width - text_width) // 2 - offset_x, (img.height - text_height) // 2 - offset_y)
-                except (AttributeError, TypeError):
-                    # Fallback to simple centering if offset isn't available
-                    position = ((img.width - text_width) // 2, (img.height - text_height) // 2)
-            
-            # Draw the letter
-            draw.text(position, char, font=font, fill=text_color)
+        if not char.strip():  # Skip whitespace-only characters
+            continue
+        images.append((
+            char,
+            _letter_image_path(output_path, filename, group, background_subfolder, suffix),
+            cache_key(char)))
+    return LetterSetPlan(set_id, settings, images, [], "".join(char_map.keys()))
+
+def _select_pending(
+        plans: list[LetterSetPlan],
+        letter_cache: "LetterCache | None",
+        glyph_metrics: "GlyphMetrics"
+    ) -> Iterable[tuple[RenderSettings, list[tuple[str, str, tuple]]]]:
+    '''
+    Works out which images of the letter sets have to be rendered. When
+    multiple letter sets produce the same image, only the last one renders
+    it, because it would overwrite the others. Images generated from the same
+    inputs by a previous run are reused. The characters to render are
+    measured here, so the worker processes share the glyph metrics, and the
+    directories of the images are created here, once each.
+
+    The images of the letter sets rendered in the streaming mode are
+    selected lazily, after the other letter sets.
+
+    Returns:
+        The list of (render settings, [(character, output path, metrics), ...])
+        work units. Every letter is a separate work unit, except for the letter
+        sets rendered in the atlas mode or with the FreeType backend, which
+        are split into batches. If any letter set is streamed, an iterator
+        that selects the work units of the streamed letter sets lazily.
+    '''
+    owners = {
+        image_path: plan.set_id
+        for plan in plans
+        for _, image_path, _ in plan.images
+    }
+    streams = [plan for plan in plans if plan.stream is not None]
+    created_directories = set()
+    units = []
+    for plan in plans:
+        if plan.stream is not None:
+            continue
+        for char, image_path, key in plan.images:
+            if owners[image_path] != plan.set_id:
+                continue
+            if letter_cache is not None:
+                fresh = letter_cache.is_fresh(image_path, key)
+                letter_cache.record(plan.set_id, image_path, key)
+                if fresh:
+                    continue
+            plan.pending.append((char, image_path))
+        _create_image_directories(
+            (image_path for _, image_path in plan.pending), created_directories)
+        items = [
+            (char, str(image_path), tuple(_measure_letter(plan.settings, char, glyph_metrics)))
+            for char, image_path in plan.pending
+        ]
+        batch_size = _unit_batch_size(plan.settings)
+        units.extend(
+            (plan.settings, items[i:i + batch_size])
+            for i in range(0, len(items), batch_size))
+    # The letters drawn with the same glyph are rendered one after another,
+    # so they're likely to be rendered by the same worker process, which
+    # rasterizes the glyph once (see glyph_mask)
+    units.sort(key=_unit_glyph_key)
+    if not streams:
+        return units
+    return itertools.chain(units, *(
+        _select_stream_pending(
+            plan, owners, letter_cache, glyph_metrics, created_directories)
+        for plan in streams))
+
+def _create_image_directories(image_paths: Iterable[Path], created: set[Path]):
+    '''
+    Creates the directories of the images, each of them once. The main
+    process creates them before the images are rendered, so the renderers
+    write the images without checking their directories.
+
+    Args:
+        image_paths: Paths of the images.
+        created: The directories created before, updated with the new ones.
+    '''
+    for directory in {image_path.parent for image_path in image_paths} - created:
+        directory.mkdir(parents=True, exist_ok=True)
+        created.add(directory)
 
-            # downsample to final size with aliasing
-            if aliasing:
-                img = img.resize(image_size, resample=Image.LANCZOS)
-            else:
-                img = img.resize(image_size, resample=Image.NEAREST)
+def _unit_glyph_key(unit: tuple[RenderSettings, list[tuple[str, str, tuple]]]) -> tuple:
+    '''
+    Returns the key that orders the work units by the glyph of their first
+    letter: the fonts, the size of the font and of the oversampled image and
+    the character.
+    '''
+    settings, items = unit
+    return (
+        settings.font_path or "", settings.fallback_fonts,
+        _scaled_font_size(settings), settings.work_size, items[0][0])
 
-            # Determine filename with optional background suffix
-            name = f"{filename}{suffix}.block.png" if suffix else f"{filename}.block.png"
-            img.save(output_path_group / name)
+def _unit_batch_size(settings: RenderSettings) -> int:
+    '''
+    Returns the number of letters of a letter set rendered by one work unit.
+    '''
+    if settings.backend == "freetype":
+        return FREETYPE_BATCH_SIZE
+    if settings.render_mode == "atlas":
+        return _ATLAS_MAX_TILES
+    return 1
+
+def _select_stream_pending(
+        plan: LetterSetPlan,
+        owners: dict[Path, str],
+        letter_cache: "LetterCache | None",
+        glyph_metrics: "GlyphMetrics",
+        created_directories: set[Path]
+    ) -> Iterator[tuple[RenderSettings, list[tuple[str, str, tuple]]]]:
+    '''
+    Works out which images of a streamed letter set have to be rendered (see
+    _select_pending), while its images are listed.
+
+    Yields:
+        The work units of the letter set, each one as soon as it's full.
+    '''
+    batch_size = _unit_batch_size(plan.settings)
+    items = []
+    for char, image_path, key in plan.images:
+        if owners[image_path] != plan.set_id:
+            continue
+        if letter_cache is not None:
+            fresh = letter_cache.is_fresh(image_path, key)
+            letter_cache.record(plan.set_id, image_path, key)
+            if fresh:
+                continue
+        plan.stream["rendered"] += 1
+        if image_path.parent not in created_directories:
+            _create_image_directories((image_path,), created_directories)
+        items.append(
+            (char, str(image_path), tuple(_measure_letter(plan.settings, char, glyph_metrics))))
+        if len(items) >= batch_size:
+            yield plan.settings, items
+            items = []
+    if items:
+        yield plan.settings, items
 
+def _finish_letter_set(plan: LetterSetPlan, letter_cache: "LetterCache | None"):
+    '''
+    Prints the summary of a rendered letter set and removes its stale images.
+    '''
     # Print a summary of all characters generated
-    print("Generated characters: " + "".join(char_map.keys()))
-    
+    print("Generated characters: " + plan.characters)
+    rendered = len(plan.pending) if plan.stream is None else plan.stream["rendered"]
+    if letter_cache is not None:
+        removed = letter_cache.prune(plan.set_id)
+        print(
+            f"Letter cache '{plan.set_id}': rendered {rendered}, "
+            f"removed {len(removed)} stale images")
+
+def _move_custom_backgrounds(output_dir: str):
+    '''
+    Moves the custom background images into their own subdirectories of the
+    "custom" directory.
+    '''
     # Move files to backgrounds subdirectory
     output_path = Path(output_dir)
     backgrounds_dir = output_path / "custom"
@@ -245,10 +884,185 @@ def generate_letter_images(
             # Create target file path
             target_file = target_dir / file_path.name
             
-            # Move the file
+            # Move the file, renaming it doesn't copy its content
             print(f"Moving {file_path} to {target_file}")
-            shutil.copy2(file_path, target_file)
-            os.remove(file_path)
+            os.replace(file_path, target_file)
+
+def generate_letter_images(
+        map_py_item: dict[str, Any],
+        letters: list[LetterItem],
+        output_dir: str = ".",
+        font_path: str = None,
+        font_size: int = 64,
+        text_color: tuple = (255, 255, 255, 255),
+        image_size: tuple = (64, 64),
+        background_image_path: str = None,
+        suffix: str = None,
+        aliasing: bool = False,
+        set_id: str = None,
+        cache: bool = True,
+        render_mode: str = "glyph",
+        downsample: str = "lanczos",
+        encoding: str = "default",
+        stream: bool = False,
+        fallback_fonts: list[str] = None,
+        validation: dict[str, Any] = None,
+        backend: str = "oversample"
+    ) -> dict[str, Any]:
+    '''
+    Generates an image for each letter in the provided string with transparent background.
+    
+    Args:
+        map_py_item: The map_py item from system_template.
+        letters: String containing all the letters to generate images for.
+        output_dir: Directory where the images will be saved.
+        font_path: Path to a custom font file. If None, default font will be used.
+        font_size: Font size to use.
+        text_color: RGBA color tuple for the text.
+        image_size: Tuple with (width, height) of the output image.
+        background_image_path: Path to background image. If None, transparent background will be used.
+        aliasing: Enable aliasing via oversampling and downsampling
+        set_id: ID of the letter set, used to track its images in the cache.
+            If None, an ID is derived from the letter set settings.
+        cache: Skip the images whose inputs didn't change since the previous
+            run and remove the images that are no longer generated.
+        render_mode: "glyph" renders every letter on its own image, "atlas"
+            renders the letters on one sheet and slices it. Both modes
+            produce the same images.
+        downsample: Filter used to downsample the oversampled images with
+            aliasing: "box", "nearest" or "lanczos".
+        encoding: PNG encoding profile of the images: "default", "fast"
+            (low compression effort) or "release" (smallest lossless files).
+        stream: Read, render and save the letters in small batches instead of
+            listing all of them first, so the memory used doesn't grow with
+            the number of letters. Meant for letter sets with thousands of
+            characters. The images are the same.
+        fallback_fonts: Paths to fonts that draw the characters missing from
+            the font, in the order of preference. A character missing from
+            all of them is drawn with the font.
+        validation: Check the images after generating them, see
+            generate_letter_sets.
+        backend: How the letters are rasterized: "oversample" draws them on
+            the oversampled images (with aliasing) and downsamples them,
+            "freetype" rasterizes them at the size of the images with the
+            hinting and anti-aliasing of the font, which is faster. The
+            render_mode only applies to "oversample".
+        
+    Returns:
+        The unmodified map_py_item.
+    '''
+    # Create output directory if it doesn't exist
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    letter_cache = LetterCache(output_path) if cache else None
+    glyph_metrics = load_glyph_metrics(output_path)
+    plan = _plan_letter_set(
+        letters, output_path, font_path, font_size, text_color, image_size,
+        background_image_path, suffix, aliasing, set_id, render_mode,
+        downsample, encoding, stream, fallback_fonts, backend)
+    stats = _render_work_units(_select_pending([plan], letter_cache, glyph_metrics))
+    glyph_metrics.save()
+    if stats[0]:
+        print(encoding_summary(encoding, stats))
+    _finish_letter_set(plan, letter_cache)
+    if letter_cache is not None:
+        letter_cache.save()
+    if validation is not None:
+        validate_letter_sets(
+            [plan], validation.get("preview_dir"), workers=1,
+            compare_backend=validation.get("compare_backend"))
+    with profile_span("file_moves"):
+        _move_custom_backgrounds(output_dir)
+    # The textures changed, the _map.py has to index them again
+    invalidate_glyph_index()
+
+    # Return unmodified map_py_item
+    return map_py_item
+
+def generate_letter_sets(
+        map_py_item: dict[str, Any],
+        letter_sets: list[dict[str, Any]],
+        output_dir: str = ".",
+        workers: int = None,
+        plugins_dir: str = "_plugins",
+        cache: bool = True,
+        encoding: str = "default",
+        character_lists: dict[str, list[LetterItem]] = None,
+        defaults: dict[str, Any] = None,
+        validation: dict[str, Any] = None
+    ) -> dict[str, Any]:
+    '''
+    Generates the images of multiple letter sets (see generate_letter_images)
+    at once. The (letter set, character) pairs are rendered in parallel by a
+    pool of worker processes. The output is identical to calling
+    generate_letter_images for each letter set, one after another.
+
+    Args:
+        map_py_item: The map_py item from system_template.
+        letter_sets: The letter sets from the scope. Every letter set provides
+            the "id" and the arguments of generate_letter_images. Instead of
+            the "letters", it can reference the "characters" lists (see
+            expand_letter_sets).
+        output_dir: Directory where the images will be saved.
+        workers: Number of worker processes. 1 renders in the current process,
+            None uses one process per CPU core.
+        plugins_dir: Path to the _plugins folder of the system.
+        cache: Skip the images whose inputs didn't change since the previous
+            run and remove the images that are no longer generated.
+        encoding: PNG encoding profile of the images of all of the letter
+            sets, see generate_letter_images.
+        character_lists: The character lists shared by the letter sets.
+        defaults: The default settings of the letter sets.
+        validation: Check the images of the letter sets after generating
+            them (see validate_letter_sets). None skips the check, a
+            dictionary enables it, its "preview_dir" is the directory of the
+            contact sheets and of the report (None only prints the problems)
+            and its "compare_backend" is a render backend the images are
+            compared with (see RENDER_BACKENDS, None skips the comparison).
+
+    Returns:
+        The unmodified map_py_item.
+    '''
+    # Create output directory if it doesn't exist
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    letter_cache = LetterCache(output_path) if cache else None
+    glyph_metrics = load_glyph_metrics(output_path)
+    with profile_span("plan_letter_sets"):
+        plans = [
+            _plan_letter_set(
+                ls["letters"], output_path, ls.get("font_path"),
+                ls.get("font_size", 64), ls.get("text_color", (255, 255, 255, 255)),
+                ls.get("image_size", (64, 64)), ls.get("background_image_path"),
+                ls.get("suffix"), ls.get("aliasing", False), ls.get("id"),
+                ls.get("render_mode", "glyph"), ls.get("downsample", "lanczos"),
+                encoding, ls.get("stream", False),
+                ls.get("fallback_fonts"), ls.get("backend", "oversample"))
+            for ls in expand_letter_sets(letter_sets, character_lists, defaults)
+        ]
+        units = _select_pending(plans, letter_cache, glyph_metrics)
+    with profile_span("render_letters"):
+        stats = _render_work_units(units, workers=workers, plugins_dir=plugins_dir)
+    glyph_metrics.save()
+    if stats[0]:
+        print(encoding_summary(encoding, stats))
+    for plan in plans:
+        _finish_letter_set(plan, letter_cache)
+    if letter_cache is not None:
+        removed = letter_cache.prune_missing_sets([plan.set_id for plan in plans])
+        if removed:
+            print(f"Removed {len(removed)} images of letter sets that no longer exist")
+        letter_cache.save()
+    if validation is not None:
+        validate_letter_sets(
+            plans, validation.get("preview_dir"), workers, plugins_dir,
+            validation.get("compare_backend"))
+    with profile_span("file_moves"):
+        _move_custom_backgrounds(output_dir)
+    # The textures changed, the _map.py has to index them again
+    invalidate_glyph_index()
 
     # Return unmodified map_py_item
     return map_py_item
@@ -0,0 +1,227 @@
+'''
+This script indexes the letter block textures for the _map.py. The texture
+directory is walked once and every map entry is built from the same index,
+instead of globbing the directory for each of them.
+
+The index is also saved to a snapshot in the directory, so the next
+evaluation of the _map.py loads it instead of walking the directory again.
+The snapshot is used while the directory has the same textures and folders:
+the entries of the directory are listed (the caches of the letter generation
+are written to it) and the modification times of its folders are checked,
+the time of a folder changes when a file is added to it, removed or replaced.
+'''
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple
+import json
+import os
+
+# Name of the snapshot of the index, stored in the indexed directory
+GLYPH_INDEX_SNAPSHOT_FILE = ".glyph_index.json"
+# Bump this when the format of the snapshot or the fields of the records change
+GLYPH_INDEX_SNAPSHOT_VERSION = 1
+
+class GlyphRecord(NamedTuple):
+    '''
+    A single letter block texture.
+    '''
+    # Path to the texture
+    path: Path
+    # Filename without the ".png" extension (e.g. "A_rainbow.block")
+    stem: str
+    # Name of the letter block (e.g. "A_rainbow")
+    letter: str
+    # Name of the letter group folder (e.g. "letter")
+    group: str
+    # Name of the background of the texture (e.g. "rainbow")
+    background: str
+    # Name of the top level folder of the texture, None for the textures
+    # directly in the root directory
+    category: str | None
+
+class GlyphIndex(NamedTuple):
+    '''
+    The index of all of the letter block textures in a directory.
+    '''
+    # All of the textures, sorted by path
+    glyphs: tuple[GlyphRecord, ...]
+    # The textures of each top level folder (category), including the empty ones
+    categories: Mapping[str, tuple[GlyphRecord, ...]]
+
+_glyph_indices: dict[str, GlyphIndex] = {}
+# (directory, block ID format) -> scope of the templates, see glyph_scope
+_glyph_scopes: dict[tuple[str, str], dict[str, Any]] = {}
+
+def index_glyphs(root: str = "letter_blocks") -> GlyphIndex:
+    """
+    Get the index of the letter block textures in a directory. The index is
+    loaded from the snapshot of the directory, or the directory is walked if
+    the snapshot is missing or outdated, only on the first call. The
+    following calls return the same index until invalidate_glyph_index is
+    called.
+
+    Args:
+        root: Path to the directory with the textures.
+
+    Returns:
+        The index of the textures.
+    """
+    key = os.path.abspath(root)
+    index = _glyph_indices.get(key)
+    if index is None:
+        with profile_span("index_glyphs", root=root):
+            index = _load_snapshot(Path(root))
+            if index is None:
+                index, directories = _scan_glyphs(Path(root))
+                _save_snapshot(Path(root), index, directories)
+        _glyph_indices[key] = index
+    return index
+
+def glyph_scope(
+        root: str = "letter_blocks",
+        block_id: str = "{letter}"
+    ) -> dict[str, Any]:
+    """
+    Get the lists of the letter blocks passed to the scopes of the templates,
+    built once from the index of the directory (see index_glyphs). The same
+    lists are returned by the following calls, they must not be modified.
+
+    Args:
+        root: Path to the directory with the textures.
+        block_id: Format of the IDs of the blocks, with the "{letter}" field.
+
+    Returns:
+        Dictionary with "letters" (the names of all of the letter blocks),
+        "blocks" (the IDs of all of the letter blocks), "categories" (the IDs
+        of the letter blocks of every category) and "category_names".
+    """
+    key = (os.path.abspath(root), block_id)
+    scope = _glyph_scopes.get(key)
+    if scope is None:
+        index = index_glyphs(root)
+        scope = {
+            "letters": [glyph.letter for glyph in index.glyphs],
+            "blocks": [block_id.format(letter=glyph.letter) for glyph in index.glyphs],
+            "categories": {
+                name: [block_id.format(letter=glyph.letter) for glyph in glyphs]
+                for name, glyphs in index.categories.items()
+            },
+            "category_names": list(index.categories),
+        }
+        _glyph_scopes[key] = scope
+    return scope
+
+def invalidate_glyph_index():
+    """
+    Drop the cached indices. Must be called after adding or removing textures.
+    The snapshots don't need to be removed, they are checked when loaded.
+    """
+    _glyph_indices.clear()
+    _glyph_scopes.clear()
+
+def _root_entries(root: Path) -> list[str]:
+    '''
+    Returns the names of the folders and of the textures in the indexed
+    directory, the entries the index depends on.
+    '''
+    with os.scandir(root) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.name.endswith(".png") or entry.is_dir())
+
+def _load_snapshot(root: Path) -> GlyphIndex | None:
+    '''
+    Returns the index saved in the snapshot of a directory, or None if there
+    is no snapshot or if the directory changed since it was saved.
+    '''
+    path = root / GLYPH_INDEX_SNAPSHOT_FILE
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != GLYPH_INDEX_SNAPSHOT_VERSION:
+            return None
+        if snapshot["root_entries"] != _root_entries(root):
+            return None
+        for directory, mtime in snapshot["directories"].items():
+            if os.stat(root / directory).st_mtime_ns != mtime:
+                return None
+        glyphs = tuple(
+            GlyphRecord(root / relative, *fields)
+            for relative, *fields in snapshot["glyphs"])
+        category_names = snapshot["category_names"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Ignoring unreadable glyph index snapshot '{path}': {e}")
+        return None
+    return _build_index(glyphs, category_names)
+
+def _save_snapshot(root: Path, index: GlyphIndex, directories: dict[str, int]):
+    '''
+    Saves the index to the snapshot of the directory, with the modification
+    times of its folders. The index is still used if it can't be saved.
+    '''
+    if not root.is_dir():
+        return
+    snapshot = {
+        "version": GLYPH_INDEX_SNAPSHOT_VERSION,
+        "root_entries": _root_entries(root),
+        "directories": directories,
+        "category_names": list(index.categories),
+        "glyphs": [
+            [glyph.path.relative_to(root).as_posix(), *glyph[1:]]
+            for glyph in index.glyphs
+        ],
+    }
+    try:
+        write_file_atomic(
+            root / GLYPH_INDEX_SNAPSHOT_FILE,
+            json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    except OSError as e:
+        print(f"Couldn't save the glyph index snapshot to '{root}': {e}")
+
+def _scan_glyphs(root: Path) -> tuple[GlyphIndex, dict[str, int]]:
+    '''
+    Walks the directory. Returns the index and the modification times of the
+    folders of the directory (paths relative to the directory).
+    '''
+    glyphs = []
+    category_names = []
+    directories = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        directory = Path(dirpath)
+        if directory == root:
+            category_names.extend(dirnames)
+        else:
+            directories[directory.relative_to(root).as_posix()] = os.stat(directory).st_mtime_ns
+        for filename in sorted(filenames):
+            if not filename.endswith(".png"):
+                continue
+            path = directory / filename
+            stem = path.stem
+            relative = path.relative_to(root).parts
+            glyphs.append(GlyphRecord(
+                path=path,
+                stem=stem,
+                letter=stem.removesuffix(".block"),
+                group=path.parent.parent.name,
+                background=(
+                    path.parent.name if path.parent != root
+                    else filename.removesuffix(".block.png")),
+                category=relative[0] if len(relative) > 1 else None,
+            ))
+    return _build_index(glyphs, category_names), directories
+
+def _build_index(glyphs: list[GlyphRecord] | tuple, category_names: list[str]) -> GlyphIndex:
+    categories = {name: [] for name in category_names}
+    for glyph in glyphs:
+        if glyph.category is not None:
+            categories[glyph.category].append(glyph)
+    return GlyphIndex(
+        glyphs=tuple(glyphs),
+        categories=MappingProxyType({
+            name: tuple(category_glyphs)
+            for name, category_glyphs in categories.items()
+        }),
+    )
@@ -0,0 +1,186 @@
+'''
+This script provides a persistent cache of the glyph metrics used to center
+the letters in their images. The metrics are keyed on the hash of the font
+file, the font size and the character, so the letter sets that only differ in
+their background measure every character once, and the following runs don't
+measure the characters at all.
+'''
+from array import array
+from pathlib import Path
+from typing import Any, NamedTuple
+from PIL import Image, ImageDraw
+import os
+import struct
+import sys
+
+# Name of the metrics file stored in the output directory
+GLYPH_METRICS_FILE = ".glyph_metrics.bin"
+# Bump this when the format of the file or the measuring code changes
+GLYPH_METRICS_VERSION = 1
+
+# File header: magic, version and number of fonts
+_HEADER = struct.Struct("<8sII")
+_MAGIC = b"GLYPHMET"
+# Font header: SHA-256 digest of the font file, font size and number of glyphs.
+# It's followed by the glyphs as 6 little-endian int32 values each: code point,
+# left, top, right, bottom and exact (see GlyphMetric).
+_FONT_HEADER = struct.Struct("<32sII")
+_GLYPH_FIELDS = 6
+
+class GlyphMetric(NamedTuple):
+    '''
+    The bounding box of a character drawn at (0, 0).
+    '''
+    left: int
+    top: int
+    right: int
+    bottom: int
+    # False when the box was estimated from the text size (older Pillow
+    # versions), the drawn text may not fit into it
+    exact: bool
+
+# Used only to measure text, never drawn on
+_measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+def measure_glyph(font: Any, char: str) -> GlyphMetric:
+    """
+    Measure a character with Pillow.
+
+    Args:
+        font: The font of the character.
+        char: The character.
+
+    Returns:
+        The metrics of the character.
+    """
+    try:
+        # For newer Pillow versions
+        return GlyphMetric(*_measure_draw.textbbox((0, 0), char, font=font), True)
+    except AttributeError:
+        # For older Pillow versions
+        text_width, text_height = _measure_draw.textsize(char, font=font)
+
+        # Try to get offset information if available
+        try:
+            offset_x, offset_y = font.getoffset(char)
+        except (AttributeError, TypeError):
+            # Fallback to simple centering if offset isn't available
+            offset_x, offset_y = 0, 0
+        return GlyphMetric(
+            offset_x, offset_y, offset_x + text_width, offset_y + text_height, False)
+
+class GlyphMetrics:
+    '''
+    The metrics of the characters of every font used to render into an output
+    directory, stored in a compact binary file.
+    '''
+    def __init__(self, output_dir: str | Path):
+        self.path = Path(output_dir) / GLYPH_METRICS_FILE
+        # (font digest, font size) -> {character: metric}
+        self.fonts: dict[tuple[str, int], dict[str, GlyphMetric]] = {}
+        self._changed = False
+        if self.path.exists():
+            try:
+                self._read()
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Ignoring unreadable glyph metrics '{self.path}': {e}")
+                self.fonts = {}
+
+    def get(self, font_digest: str, font_size: int, char: str) -> GlyphMetric | None:
+        """
+        Get the metrics of a character measured by a previous call of put.
+
+        Args:
+            font_digest: Hash of the font file (see file_digest).
+            font_size: Size of the font (after oversampling).
+            char: The character.
+
+        Returns:
+            The metrics or None if the character wasn't measured yet.
+        """
+        return self.fonts.get((font_digest, font_size), {}).get(char)
+
+    def put(self, font_digest: str, font_size: int, char: str, metric: GlyphMetric):
+        """
+        Store the metrics of a character.
+
+        Args:
+            font_digest: Hash of the font file (see file_digest).
+            font_size: Size of the font (after oversampling).
+            char: The character.
+            metric: The metrics measured by measure_glyph.
+        """
+        self.fonts.setdefault((font_digest, font_size), {})[char] = metric
+        self._changed = True
+
+    def save(self):
+        """
+        Write the metrics file, if any metrics were added since it was read.
+        """
+        if not self._changed:
+            return
+        # Only single characters have a code point, the others are measured
+        # again by every run
+        fonts = [
+            (font_digest, font_size, [
+                (ord(char), metric) for char, metric in glyphs.items()
+                if len(char) == 1
+            ])
+            for (font_digest, font_size), glyphs in sorted(self.fonts.items())
+        ]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, GLYPH_METRICS_VERSION, len(fonts)))
+            for font_digest, font_size, glyphs in fonts:
+                f.write(_FONT_HEADER.pack(bytes.fromhex(font_digest), font_size, len(glyphs)))
+                values = array("i")
+                for code_point, metric in sorted(glyphs):
+                    values.extend((code_point, *metric))
+                if sys.byteorder != "little":
+                    values.byteswap()
+                values.tofile(f)
+        self._changed = False
+
+    def _read(self):
+        data = self.path.read_bytes()
+        magic, version, font_count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("not a glyph metrics file")
+        if version != GLYPH_METRICS_VERSION:
+            return
+        offset = _HEADER.size
+        for _ in range(font_count):
+            digest, font_size, glyph_count = _FONT_HEADER.unpack_from(data, offset)
+            offset += _FONT_HEADER.size
+            size = glyph_count * _GLYPH_FIELDS * array("i").itemsize
+            if offset + size > len(data):
+                raise ValueError("truncated glyph metrics file")
+            values = array("i", data[offset:offset + size])
+            offset += size
+            if sys.byteorder != "little":
+                values.byteswap()
+            self.fonts[(digest.hex(), font_size)] = {
+                chr(values[i]): GlyphMetric(*values[i + 1:i + 5], bool(values[i + 5]))
+                for i in range(0, len(values), _GLYPH_FIELDS)
+            }
+
+_glyph_metrics: dict[str, GlyphMetrics] = {}
+
+def load_glyph_metrics(output_dir: str | Path) -> GlyphMetrics:
+    """
+    Get the glyph metrics of an output directory. The file is read only on
+    the first call, the following calls in the same process return the same
+    object.
+
+    Args:
+        output_dir: The output directory of the letter images.
+
+    Returns:
+        The glyph metrics.
+    """
+    key = os.path.abspath(output_dir)
+    metrics = _glyph_metrics.get(key)
+    if metrics is None:
+        metrics = GlyphMetrics(output_dir)
+        _glyph_metrics[key] = metrics
+    return metrics
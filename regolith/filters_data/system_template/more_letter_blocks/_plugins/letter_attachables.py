@@ -0,0 +1,116 @@
+'''
+This script shares the attachables of the placer items (the letter block
+shown in the hand of the player). In the "letter" attachable mode (the
+default) every placer item has its own attachable, which differs from the
+others only by its texture. In the "group" and "background" attachable modes
+the placer items of the letters of a group and background (or of a
+background, see letter_block_types) share one attachable and one render
+controller. The attachable lists the textures of all of its letters and
+finds the held letter before it's rendered, and the render controller picks
+the texture of the letter from an array of the textures.
+
+The placer items themselves stay separate, a letter is picked by its item.
+'''
+from typing import Any, NamedTuple
+
+# How the attachables of the placer items are generated, the first one is
+# the default
+LETTER_ATTACHABLE_MODES = ("letter", "group", "background")
+# Template of the attachables of the "letter" attachable mode, the shared
+# attachables use its textures
+LETTER_ATTACHABLE_TEMPLATE = "block/letter_block_placer.attachable.json"
+# The slot of the held placer item, the block items can't be held in the
+# off hand
+PLACER_ITEM_SLOT = "slot.weapon.mainhand"
+
+class LetterAttachableGroup(NamedTuple):
+    '''
+    The letters sharing an attachable in the "group" and "background"
+    attachable modes.
+    '''
+    # Name of the attachable without the namespace (e.g.
+    # "letter_blocks_rainbow_placer")
+    name: str
+    # The letters, indexed by their position in the texture array
+    glyphs: tuple["GlyphRecord", ...]
+
+def _check_attachable_mode(mode: str):
+    if mode not in LETTER_ATTACHABLE_MODES:
+        raise ValueError(
+            f"Unknown letter attachable mode '{mode}', expected one of: "
+            + ", ".join(LETTER_ATTACHABLE_MODES))
+
+def letter_attachable_glyphs(
+        root: str = "letter_blocks",
+        mode: str = "letter"
+    ) -> tuple["GlyphRecord", ...]:
+    """
+    Get the letters with attachables of their own.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The attachable mode, see LETTER_ATTACHABLE_MODES.
+
+    Returns:
+        All of the letters in the "letter" attachable mode, otherwise none.
+    """
+    _check_attachable_mode(mode)
+    if mode == "letter":
+        return index_glyphs(root).glyphs
+    return ()
+
+def letter_attachable_groups(
+        root: str = "letter_blocks",
+        mode: str = "letter"
+    ) -> tuple[LetterAttachableGroup, ...]:
+    """
+    Get the groups of letters sharing an attachable.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The attachable mode, see LETTER_ATTACHABLE_MODES.
+
+    Returns:
+        The groups, none in the "letter" attachable mode.
+    """
+    _check_attachable_mode(mode)
+    if mode == "letter":
+        return ()
+    groups: dict[str, list[GlyphRecord]] = {}
+    for glyph in index_glyphs(root).glyphs:
+        groups.setdefault(f"{_block_type_name(glyph, mode)}_placer", []).append(glyph)
+    return tuple(
+        LetterAttachableGroup(name, tuple(glyphs)) for name, glyphs in groups.items())
+
+def letter_attachable_scope(group: LetterAttachableGroup) -> dict[str, Any]:
+    """
+    Get the scope of the templates of a shared attachable
+    (block/letter_block_placer_group.attachable.json) and of its render
+    controller (block/letter_block_placer.rc.json).
+
+    Args:
+        group: The letters of the attachable.
+
+    Returns:
+        Dictionary with the IDs of the "attachable" and of its
+        "render_controller", the conditions of its placer "items", its
+        "textures" (the texture of every letter, in the order of the array
+        of the render controller) and the "glyph_selection" statements,
+        which set v.glyph to the position of the held letter.
+    """
+    template = load_json_template(LETTER_ATTACHABLE_TEMPLATE)
+    texture = template["minecraft:attachable"]["description"]["textures"]["default"]
+    items = [f"edu_tools:letter_block_{glyph.letter}_placer" for glyph in group.glyphs]
+    return {
+        "attachable": f"edu_tools:{group.name}",
+        "render_controller": f"controller.render.edu_tools.{group.name}",
+        "items": {item: "1.0" for item in items},
+        "textures": {
+            f"glyph_{position}": render_json_template(texture, {"letter": glyph.letter})
+            for position, glyph in enumerate(group.glyphs)
+        },
+        "glyph_selection": ["v.glyph = 0;"] + [
+            f"v.glyph = q.is_item_name_any('{PLACER_ITEM_SLOT}', 0, '{item}') ? {position} : v.glyph;"
+            for position, item in enumerate(items) if position
+        ],
+    }
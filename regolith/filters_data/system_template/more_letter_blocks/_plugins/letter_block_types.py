@@ -0,0 +1,388 @@
+'''
+This script collapses the letter blocks into fewer block types. In the
+"letter" block mode (the default) every letter is its own block type
+(edu_tools:letter_block_<letter>), so more_letter_blocks registers more than
+a thousand of them, which slows down loading the worlds. In the "group" and
+"background" block modes the letters of a group and background (or of a
+background) are the permutations of a single block type
+(edu_tools:letter_blocks_<group>_<background> or
+edu_tools:letter_blocks_<background>). Its "edu_tools:glyph" and
+"edu_tools:glyph_page" states select the texture of the letter, and the
+placer item of a letter places the block with the states of the letter.
+
+The letters keep their state values between the builds. The values are
+stored in a state table in the system folder (see LETTER_BLOCK_STATES_FILE),
+which is committed with the backgrounds. New letters get new values, the
+values of removed letters are not reused, so the placed blocks keep their
+letters.
+
+The blocks of the worlds built with the "letter" block mode stay loaded while
+the old block types are registered too (letter_block_compat). The migration
+functions replace them with the permutations of the new block types.
+'''
+from pathlib import Path
+from typing import Any, NamedTuple
+import itertools
+import json
+import math
+import os
+
+# How the letter blocks are registered, the first one is the default
+LETTER_BLOCK_MODES = ("letter", "group", "background")
+# Name of the state table, stored next to the indexed directory
+LETTER_BLOCK_STATES_FILE = "letter_block_states.json"
+# Folder of the state table, None for the folder next to the indexed
+# directory. The watch script sets it to the system, it builds a work copy of
+# the system, which isn't committed, so the slots assigned there would be lost.
+letter_block_states_dir: str | None = None
+# Bump this when the format of the state table changes
+LETTER_BLOCK_STATES_VERSION = 1
+# The states selecting the letter of a block type. A state can have up to 16
+# values, the block types with more letters use pages of 16 letters.
+GLYPH_STATE = "edu_tools:glyph"
+GLYPH_PAGE_STATE = "edu_tools:glyph_page"
+GLYPH_STATE_VALUES = 16
+# The values of the states of the placement direction trait. The old blocks
+# are migrated for every combination of the states enabled by their template.
+PLACEMENT_STATE_VALUES = {
+    "minecraft:facing_direction": ("down", "up", "north", "south", "west", "east"),
+    "minecraft:cardinal_direction": ("north", "south", "west", "east"),
+}
+# Template of the blocks of the "letter" block mode. The block types share its
+# format version, its placement direction, its rotation permutations and the
+# textures and the loot of its letters.
+LETTER_BLOCK_TEMPLATE = "block/letter_block.block.json"
+# Format versions of the placer items. The block placer accepts a block
+# descriptor with states (the "group" and "background" block modes) only
+# since Minecraft 1.21.60.
+PLACER_ITEM_FORMAT_VERSION = "1.20.10"
+PLACER_ITEM_STATES_FORMAT_VERSION = "1.21.60"
+
+class LetterBlockType(NamedTuple):
+    '''
+    A block type of the "group" and "background" block modes.
+    '''
+    # Name of the block type without the namespace (e.g. "letter_blocks_rainbow")
+    name: str
+    # The letters of the block type indexed by their slot (the value of the
+    # glyph states), None for the slots of the removed letters
+    slots: tuple["GlyphRecord | None", ...]
+
+class _LetterBlockLayout(NamedTuple):
+    '''
+    The block types of a directory in a block mode, built from its index.
+    '''
+    index: "GlyphIndex"
+    block_types: tuple[LetterBlockType, ...]
+    # The block placed by the placer item of every letter: the ID of its
+    # block, or the ID and the states of its permutation
+    placements: dict[str, str | dict[str, Any]]
+
+# (directory, block mode) -> layout, see _letter_block_layout
+_letter_block_layouts: dict[tuple[str, str], _LetterBlockLayout] = {}
+
+def _check_block_mode(mode: str):
+    if mode not in LETTER_BLOCK_MODES:
+        raise ValueError(
+            f"Unknown letter block mode '{mode}', expected one of: "
+            + ", ".join(LETTER_BLOCK_MODES))
+
+def _block_type_name(glyph: "GlyphRecord", mode: str) -> str:
+    if mode == "group" and glyph.category is not None:
+        return f"letter_blocks_{glyph.category}_{glyph.background}"
+    return f"letter_blocks_{glyph.background}"
+
+def glyph_states(slot: int, slot_count: int) -> dict[str, int]:
+    """
+    Get the states of the permutation of a letter.
+
+    Args:
+        slot: The slot of the letter in its block type.
+        slot_count: The number of slots of the block type.
+
+    Returns:
+        The glyph states and their values.
+    """
+    states = {GLYPH_STATE: slot % GLYPH_STATE_VALUES}
+    if slot_count > GLYPH_STATE_VALUES:
+        states[GLYPH_PAGE_STATE] = slot // GLYPH_STATE_VALUES
+    return states
+
+def _block_states(states: dict[str, Any]) -> str:
+    '''
+    Formats block states for the commands, e.g. ["edu_tools:glyph"=3].
+    '''
+    return "[" + ",".join(
+        f"{json.dumps(state)}={json.dumps(value)}" for state, value in states.items()) + "]"
+
+def _letter_block_template() -> tuple[dict[str, Any], list[str]]:
+    '''
+    Returns the compiled template of the blocks of the "letter" block mode and
+    the placement states enabled by it.
+    '''
+    template = load_json_template(LETTER_BLOCK_TEMPLATE)
+    traits = template["minecraft:block"]["description"].get("traits", {})
+    enabled_states = traits.get("minecraft:placement_direction", {}).get("enabled_states", [])
+    return template, [state for state in enabled_states if state in PLACEMENT_STATE_VALUES]
+
+def _load_state_table(path: Path) -> dict[str, dict[str, list[str]]]:
+    '''
+    Returns the letters of the slots of every block type of every block mode,
+    or an empty table if there is none.
+    '''
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if table.get("version") != LETTER_BLOCK_STATES_VERSION:
+        raise ValueError(
+            f"Unsupported version of the letter block state table '{path}': "
+            f"{table.get('version')}, expected {LETTER_BLOCK_STATES_VERSION}")
+    return table["modes"]
+
+def _letter_block_layout(root: str, mode: str) -> _LetterBlockLayout:
+    '''
+    Returns the block types of the letters of a directory, built once for
+    every index of the directory (see index_glyphs). Assigns the slots of the
+    new letters and saves them to the state table.
+    '''
+    index = index_glyphs(root)
+    key = (os.path.abspath(root), mode)
+    layout = _letter_block_layouts.get(key)
+    if layout is not None and layout.index is index:
+        return layout
+    if mode == "letter":
+        layout = _LetterBlockLayout(index, (), {
+            glyph.letter: f"edu_tools:letter_block_{glyph.letter}" for glyph in index.glyphs
+        })
+        _letter_block_layouts[key] = layout
+        return layout
+
+    glyphs_by_type: dict[str, dict[str, GlyphRecord]] = {}
+    for glyph in index.glyphs:
+        glyphs_by_type.setdefault(_block_type_name(glyph, mode), {})[glyph.letter] = glyph
+    table_path = Path(letter_block_states_dir or Path(root).parent) / LETTER_BLOCK_STATES_FILE
+    table = _load_state_table(table_path)
+    # The block types without letters keep their slots too, their letters
+    # may come back
+    slot_table = dict(table.get(mode, {}))
+    block_types = []
+    placements = {}
+    new_letters = 0
+    for name, glyphs in glyphs_by_type.items():
+        slots = list(slot_table.get(name, ()))
+        new = [letter for letter in glyphs if letter not in slots]
+        new_letters += len(new)
+        slots += new
+        slot_table[name] = slots
+        block_type = LetterBlockType(name, tuple(glyphs.get(letter) for letter in slots))
+        block_types.append(block_type)
+        for slot, glyph in enumerate(block_type.slots):
+            if glyph is not None:
+                placements[glyph.letter] = {
+                    "name": f"edu_tools:{name}",
+                    "states": glyph_states(slot, len(slots)),
+                }
+    if new_letters:
+        table[mode] = slot_table
+        write_file_atomic(table_path, (json.dumps(
+            {"version": LETTER_BLOCK_STATES_VERSION, "modes": table},
+            indent="\t", ensure_ascii=False) + "\n").encode("utf-8"))
+        print(
+            f"Assigned the block states of {new_letters} new letters in "
+            f"'{table_path}', commit it to keep the letters of the placed blocks")
+    layout = _LetterBlockLayout(index, tuple(block_types), placements)
+    _letter_block_layouts[key] = layout
+    return layout
+
+def letter_block_types(
+        root: str = "letter_blocks",
+        mode: str = "letter"
+    ) -> tuple[LetterBlockType, ...]:
+    """
+    Get the block types of the letters of a directory.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The block mode, see LETTER_BLOCK_MODES.
+
+    Returns:
+        The block types, none in the "letter" block mode.
+    """
+    _check_block_mode(mode)
+    return _letter_block_layout(root, mode).block_types
+
+def letter_block_placement(
+        letter: str,
+        root: str = "letter_blocks",
+        mode: str = "letter"
+    ) -> str | dict[str, Any]:
+    """
+    Get the block placed by the placer item of a letter, the "block" of its
+    "minecraft:block_placer" component.
+
+    Args:
+        letter: The name of the letter block (e.g. "A_rainbow").
+        root: Path to the directory with the textures.
+        mode: The block mode, see LETTER_BLOCK_MODES.
+
+    Returns:
+        The ID of the block of the letter in the "letter" block mode,
+        otherwise a block descriptor with the ID of its block type and the
+        states of its permutation.
+    """
+    _check_block_mode(mode)
+    return _letter_block_layout(root, mode).placements[letter]
+
+def letter_block_item_format_version(mode: str = "letter") -> str:
+    """
+    Get the format version of the placer items.
+
+    Args:
+        mode: The block mode, see LETTER_BLOCK_MODES.
+
+    Returns:
+        The format version, a newer one in the modes placing the permutations
+        of the block types.
+    """
+    _check_block_mode(mode)
+    if mode == "letter":
+        return PLACER_ITEM_FORMAT_VERSION
+    return PLACER_ITEM_STATES_FORMAT_VERSION
+
+def letter_block_glyphs(
+        root: str = "letter_blocks",
+        mode: str = "letter",
+        compat: bool = True
+    ) -> tuple["GlyphRecord", ...]:
+    """
+    Get the letters registered as block types of their own, all of them in
+    the "letter" block mode, and in the other modes with the compatibility
+    with the old worlds.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The block mode, see LETTER_BLOCK_MODES.
+        compat: Keep the block types of the "letter" block mode in the other
+            modes.
+
+    Returns:
+        The letters.
+    """
+    _check_block_mode(mode)
+    if mode == "letter" or compat:
+        return index_glyphs(root).glyphs
+    return ()
+
+def letter_block_scope(
+        root: str = "letter_blocks",
+        mode: str = "letter",
+        compat: bool = True
+    ) -> dict[str, Any]:
+    """
+    Get the scope of the blocks.json template.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The block mode, see LETTER_BLOCK_MODES.
+        compat: See letter_block_glyphs.
+
+    Returns:
+        Dictionary with "letters" (the names of the letters registered as
+        block types of their own) and "block_types" (the names of the block
+        types).
+    """
+    return {
+        "letters": (
+            glyph_scope(root)["letters"] if letter_block_glyphs(root, mode, compat) else []),
+        "block_types": [block_type.name for block_type in letter_block_types(root, mode)],
+    }
+
+def letter_block_type_scope(block_type: LetterBlockType) -> dict[str, Any]:
+    """
+    Get the scope of the template of a block type
+    (block/letter_block_type.block.json).
+
+    Args:
+        block_type: The block type.
+
+    Returns:
+        Dictionary with the "block" name, the glyph "states", the
+        "format_version" and the "placement_direction" trait of the letter
+        blocks, the "material_instances" and the "loot" of the default
+        permutation and the "permutations": the rotations of the letter
+        blocks and the components of every letter.
+    """
+    template, _ = _letter_block_template()
+    block = template["minecraft:block"]
+    components = block["components"]
+    slot_count = len(block_type.slots)
+    states = {GLYPH_STATE: list(range(min(slot_count, GLYPH_STATE_VALUES)))}
+    if slot_count > GLYPH_STATE_VALUES:
+        states[GLYPH_PAGE_STATE] = list(range(math.ceil(slot_count / GLYPH_STATE_VALUES)))
+
+    def letter_components(glyph: "GlyphRecord") -> dict[str, Any]:
+        # The components of the letter in the "letter" block mode
+        scope = {"letter": glyph.letter, "background": glyph.background}
+        return {
+            name: render_json_template(components[name], scope)
+            for name in ("minecraft:material_instances", "minecraft:loot")
+        }
+
+    # The rotations don't depend on the letter
+    permutations = render_json_template(block["permutations"], {})
+    for slot, glyph in enumerate(block_type.slots):
+        if glyph is None:
+            continue
+        permutations.append({
+            "condition": " && ".join(
+                f"q.block_state('{state}') == {value}"
+                for state, value in glyph_states(slot, slot_count).items()),
+            "components": letter_components(glyph),
+        })
+    default = letter_components(next(glyph for glyph in block_type.slots if glyph is not None))
+    return {
+        "block": block_type.name,
+        "states": states,
+        "format_version": template["format_version"],
+        "placement_direction": block["description"]["traits"]["minecraft:placement_direction"],
+        "material_instances": default["minecraft:material_instances"],
+        "loot": default["minecraft:loot"],
+        "permutations": permutations,
+    }
+
+def letter_block_migration_scope(
+        root: str = "letter_blocks",
+        mode: str = "letter"
+    ) -> dict[str, Any]:
+    """
+    Get the scope of the migration functions
+    (block/letter_block_migration.mcfunction), which replace the blocks of
+    the "letter" block mode with the permutations of the block types.
+
+    Args:
+        root: Path to the directory with the textures.
+        mode: The block mode, see LETTER_BLOCK_MODES.
+
+    Returns:
+        Dictionary with "migration_types" (the names of the block types) and
+        "migrations" (the arguments of the fill commands of every block type,
+        one for every letter and placement).
+    """
+    _, placement_states = _letter_block_template()
+    migrations = {}
+    for block_type in letter_block_types(root, mode):
+        commands = []
+        for slot, glyph in enumerate(block_type.slots):
+            if glyph is None:
+                continue
+            states = glyph_states(slot, len(block_type.slots))
+            for placement in itertools.product(
+                    *(PLACEMENT_STATE_VALUES[state] for state in placement_states)):
+                placement = dict(zip(placement_states, placement))
+                commands.append(
+                    f"edu_tools:{block_type.name}{_block_states({**states, **placement})} "
+                    f"replace edu_tools:letter_block_{glyph.letter}{_block_states(placement)}")
+        migrations[block_type.name] = commands
+    return {"migration_types": list(migrations), "migrations": migrations}
@@ -0,0 +1,204 @@
+'''
+This script provides a persistent, content-addressed cache for the images
+generated by generate_letter_images. Every image is keyed on a hash of all the
+inputs that affect its pixels, so unchanged glyphs can be skipped on the next
+run and images that are no longer produced can be removed.
+'''
+from pathlib import Path
+import hashlib
+import json
+import os
+
+# Name of the manifest file stored in the output directory
+LETTER_CACHE_FILE = ".letter_cache.json"
+# Bump this when the rendering code changes in a way that affects the output
+LETTER_CACHE_VERSION = 2
+
+_file_digests: dict[tuple, str] = {}
+
+def file_digest(path: str | None) -> str:
+    """
+    Get the SHA-256 hash of a file's content. The result is memoized on the
+    file's path, size and modification time, so the same font or background
+    is read only once per process.
+
+    Args:
+        path: Path to the file. None or a missing file results in an empty string.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    if not path or not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_digests.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _file_digests[key] = digest
+    return digest
+
+def glyph_cache_key(
+        char: str,
+        font_digest: str,
+        font_size: int,
+        text_color: tuple,
+        image_size: tuple,
+        background_digest: str,
+        aliasing: bool,
+        suffix: str | None,
+        downsample: str,
+        encoding: str,
+        backend: str = "oversample"
+    ) -> str:
+    """
+    Compute the cache key of a single letter image.
+
+    Args:
+        char: The rendered character.
+        font_digest: Hash of the font file (see file_digest).
+        font_size: Font size used for the character.
+        text_color: RGBA color tuple of the text.
+        image_size: Tuple with (width, height) of the output image.
+        background_digest: Hash of the background image (see file_digest).
+        aliasing: Whether aliasing via oversampling is enabled.
+        suffix: The filename suffix of the letter set.
+        downsample: Name of the downsampling filter.
+        encoding: The PNG encoding profile. The pixels don't depend on it,
+            but the files do.
+        backend: The render backend. It's a part of the key only when it's
+            not the default one, so the keys of the existing images don't
+            change.
+
+    Returns:
+        The hex digest identifying the image content.
+    """
+    payload = json.dumps([
+        LETTER_CACHE_VERSION, char, font_digest, font_size, list(text_color),
+        list(image_size), background_digest, aliasing, suffix, downsample,
+        encoding
+    ] + ([backend] if backend != "oversample" else []))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LetterCache:
+    '''
+    The manifest of the images generated into an output directory. It maps
+    the images (paths relative to the output directory) to their cache keys,
+    and the letter set IDs to the images of the set.
+    '''
+    def __init__(self, output_dir: str | Path):
+        self.root = Path(output_dir)
+        self.path = self.root / LETTER_CACHE_FILE
+        self.images: dict[str, str] = {}
+        self.sets: dict[str, list[str]] = {}
+        self._current: dict[str, set[str]] = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == LETTER_CACHE_VERSION:
+                    self.images = data.get("images", {})
+                    self.sets = data.get("sets", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable letter cache '{self.path}': {e}")
+
+    def is_fresh(self, image_path: Path, key: str) -> bool:
+        """
+        Check if an image from the previous run can be reused.
+
+        Args:
+            image_path: Path to the image.
+            key: The current cache key of the image.
+
+        Returns:
+            True if the image exists and was generated from the same inputs.
+        """
+        relative = image_path.relative_to(self.root).as_posix()
+        return self.images.get(relative) == key and image_path.exists()
+
+    def record(self, set_id: str, image_path: Path, key: str):
+        """
+        Record an image produced (or reused) by the current run.
+
+        Args:
+            set_id: ID of the letter set that owns the image.
+            image_path: Path to the image.
+            key: The cache key of the image.
+        """
+        relative = image_path.relative_to(self.root).as_posix()
+        self.images[relative] = key
+        self._current.setdefault(set_id, set()).add(relative)
+
+    def prune(self, set_id: str) -> list[Path]:
+        """
+        Delete the images of a letter set that were generated by a previous
+        run but are not produced anymore, and replace the set's entries in the
+        manifest with the ones recorded by the current run.
+
+        Args:
+            set_id: ID of the letter set.
+
+        Returns:
+            The list of deleted files.
+        """
+        current = self._current.pop(set_id, set())
+        claimed = {
+            relative
+            for other_id, images in self.sets.items() if other_id != set_id
+            for relative in images
+        }
+        claimed.update(*self._current.values())
+        removed = []
+        for relative in self.sets.get(set_id, []):
+            if relative in current or relative in claimed:
+                continue
+            self.images.pop(relative, None)
+            stale_path = self.root / relative
+            if stale_path.exists():
+                os.remove(stale_path)
+                removed.append(stale_path)
+                self._remove_empty_parents(stale_path.parent)
+        self.sets[set_id] = sorted(current)
+        return removed
+
+    def prune_missing_sets(self, set_ids: list[str]) -> list[Path]:
+        """
+        Delete the images of the letter sets that are not in set_ids anymore
+        and remove them from the manifest.
+
+        Args:
+            set_ids: IDs of all of the current letter sets.
+
+        Returns:
+            The list of deleted files.
+        """
+        removed = []
+        for set_id in [i for i in self.sets if i not in set_ids]:
+            removed.extend(self.prune(set_id))
+            del self.sets[set_id]
+        return removed
+
+    def _remove_empty_parents(self, directory: Path):
+        # Remove directories left empty by pruning, so they don't show up as
+        # empty categories in the _map.py
+        while directory != self.root and self.root in directory.parents:
+            try:
+                directory.rmdir()
+            except OSError:
+                return
+            directory = directory.parent
+
+    def save(self):
+        """
+        Write the manifest to the output directory.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": LETTER_CACHE_VERSION,
+                    "images": self.images,
+                    "sets": self.sets
+                },
+                f, indent="\t", sort_keys=True)
@@ -0,0 +1,61 @@
+'''
+This script expands the compact letter sets of the scope. Instead of listing
+its letters, a letter set can reference one or more shared character lists
+("characters") and inherit its settings from the letter set defaults, so
+adding a background only adds a few lines to the scope.
+'''
+from typing import Any, Iterator
+
+def expand_letter_sets(
+        letter_sets: list[dict[str, Any]],
+        character_lists: dict[str, list[dict[str, str]]] | None = None,
+        defaults: dict[str, Any] | None = None
+    ) -> Iterator[dict[str, Any]]:
+    """
+    Expand the compact letter sets lazily, one at a time. The letter sets
+    that reference the same character list share the same list of letters,
+    it's not copied for every letter set.
+
+    Args:
+        letter_sets: The letter sets from the scope. A letter set either
+            lists its "letters" or references character lists with
+            "characters" (the name of a list or a list of names).
+        character_lists: The shared character lists from the scope.
+        defaults: The default settings of the letter sets.
+
+    Yields:
+        The letter sets with the "letters" key and all of the defaults.
+    """
+    character_lists = character_lists or {}
+    defaults = defaults or {}
+    # Concatenations of multiple character lists, shared like the lists
+    joined_lists: dict[tuple[str, ...], list[dict[str, str]]] = {}
+    for letter_set in letter_sets:
+        expanded = {**defaults, **letter_set}
+        names = expanded.pop("characters", None)
+        if "letters" in expanded:
+            if names is not None:
+                raise ValueError(
+                    f"Letter set '{expanded.get('id')}' has both 'letters' and 'characters'")
+            yield expanded
+            continue
+        if names is None:
+            raise ValueError(
+                f"Letter set '{expanded.get('id')}' has neither 'letters' nor 'characters'")
+        if isinstance(names, str):
+            names = (names,)
+        names = tuple(names)
+        for name in names:
+            if name not in character_lists:
+                raise ValueError(
+                    f"Letter set '{expanded.get('id')}' references an unknown "
+                    f"character list '{name}'")
+        if len(names) == 1:
+            expanded["letters"] = character_lists[names[0]]
+        else:
+            if names not in joined_lists:
+                joined_lists[names] = [
+                    letter for name in names for letter in character_lists[name]
+                ]
+            expanded["letters"] = joined_lists[names]
+        yield expanded
@@ -0,0 +1,133 @@
+'''
+This script supports the watch mode of the letter blocks (see
+.github/python/watch_letter_blocks.py), a long-running process that
+rebuilds the letter blocks when their sources are saved. It tracks the
+sources every letter set depends on (its fonts, its background and its entry
+in the scope), so the watch mode can report which letter sets a change
+affects, and it forgets the fonts and backgrounds that changed, while the
+rest of them stay loaded between the rebuilds. The letter cache re-renders
+only the images whose inputs changed.
+'''
+from typing import Any, Iterable, NamedTuple
+import hashlib
+import json
+import os
+
+# Extensions of the font files
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+class LetterSetSources(NamedTuple):
+    '''
+    The sources of the images of a letter set.
+    '''
+    # Paths to the font and to the fallback fonts
+    fonts: tuple[str, ...]
+    # Path to the background image, None without a background
+    background: str | None
+    # Hash of the letter set in the scope (with its defaults and its letters)
+    # and of the other settings of the scope that affect its images
+    scope: str
+
+def _source_path(path: str) -> str:
+    return os.path.normpath(path)
+
+def letter_set_sources(
+        letter_sets: list[dict[str, Any]],
+        character_lists: dict[str, list[dict[str, str]]] | None = None,
+        defaults: dict[str, Any] | None = None,
+        encoding: str = "default"
+    ) -> dict[str, LetterSetSources]:
+    """
+    Find the sources of the letter sets of the scope.
+
+    Args:
+        letter_sets: The letter sets from the scope.
+        character_lists: The character lists shared by the letter sets.
+        defaults: The default settings of the letter sets.
+        encoding: The PNG encoding of the letter images.
+
+    Returns:
+        Dictionary of the letter set IDs to their sources.
+    """
+    sources = {}
+    for letter_set in expand_letter_sets(letter_sets, character_lists, defaults):
+        set_id = letter_set_id(
+            letter_set.get("id"), letter_set.get("background_image_path"),
+            letter_set.get("suffix"), letter_set.get("font_size", 64))
+        fonts = [letter_set.get("font_path"), *(letter_set.get("fallback_fonts") or ())]
+        background = letter_set.get("background_image_path")
+        scope = json.dumps([letter_set, encoding], sort_keys=True, default=str)
+        sources[set_id] = LetterSetSources(
+            tuple(_source_path(font) for font in fonts if font),
+            _source_path(background) if background else None,
+            hashlib.sha256(scope.encode("utf-8")).hexdigest())
+    return sources
+
+def affected_letter_sets(
+        previous: dict[str, LetterSetSources],
+        current: dict[str, LetterSetSources],
+        changed_paths: Iterable[str]
+    ) -> dict[str, list[str]]:
+    """
+    Find the letter sets affected by changed source files and by the changes
+    of the scope.
+
+    Args:
+        previous: The sources of the letter sets before the change (see
+            letter_set_sources).
+        current: The sources of the letter sets after the change.
+        changed_paths: Paths to the changed (or added, or removed) files,
+            relative to the system.
+
+    Returns:
+        Dictionary of the IDs of the affected letter sets to the reasons they
+        are affected, e.g. "font fonts/AzeretMono-Black.ttf", "background
+        letter_blocks/rainbow.block.png", "scope", "added" or "removed".
+    """
+    changed = {_source_path(path) for path in changed_paths}
+    affected = {}
+    for set_id, sources in current.items():
+        reasons = [f"font {font}" for font in sources.fonts if font in changed]
+        if sources.background in changed:
+            reasons.append(f"background {sources.background}")
+        if set_id not in previous:
+            reasons.append("added")
+        elif previous[set_id].scope != sources.scope:
+            reasons.append("scope")
+        if reasons:
+            affected[set_id] = reasons
+    for set_id in previous.keys() - current.keys():
+        affected[set_id] = ["removed"]
+    return affected
+
+def forget_source_files(changed_paths: Iterable[str]) -> list[str]:
+    """
+    Drop the fonts and the background images loaded from changed files, so
+    they are loaded again by the next rebuild. The fonts are loaded again
+    only if a font changed, the backgrounds if a font or a background
+    changed. The glyph metrics don't have to be dropped, they are stored
+    under the hash of the font file.
+
+    Args:
+        changed_paths: Paths to the changed files.
+
+    Returns:
+        The names of the dropped caches, for the log.
+    """
+    changed = [_source_path(path) for path in changed_paths]
+    fonts_changed = any(path.lower().endswith(FONT_EXTENSIONS) for path in changed)
+    images_changed = any(path.lower().endswith(".png") for path in changed)
+    dropped = []
+    if fonts_changed:
+        for cache in (load_font, resolve_font, font_characters, letter_font_path):
+            cache.cache_clear()
+        _failed_fonts.clear()
+        # The masks are keyed on the font objects
+        _glyph_masks.clear()
+        dropped += ["fonts", "glyph masks"]
+    if fonts_changed or images_changed:
+        # The render contexts hold the fonts and the backgrounds
+        for cache in (_load_render_context, _work_buffer, _letter_background):
+            cache.cache_clear()
+        dropped.append("backgrounds")
+    return dropped
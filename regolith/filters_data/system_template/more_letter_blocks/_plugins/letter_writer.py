@@ -0,0 +1,250 @@
+'''
+This script overlaps the rendering of the letter images with their encoding
+and writing. Without it, every image is rendered, encoded and written before
+the next one is rendered, so the CPU waits for every write (which is slow on
+network-mounted CI workspaces). The images rendered in the current process
+go through a pipeline of three stages instead:
+- render: the rendering code, which queues the images (see save_letter_image),
+- encode: a pool of threads encoding the images as PNG (zlib releases the
+  GIL, so the threads encode in parallel with the rendering),
+- write: a thread writing the encoded files.
+The stages are connected by bounded queues, a stage that gets ahead of the
+next one waits for it (backpressure), so the memory used by the queued images
+stays bounded. The throughput of the stages and the depths of the queues are
+reported at the end.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from PIL import Image
+import os
+import queue
+import threading
+import time
+
+# Number of threads encoding the images
+PIPELINE_ENCODE_THREADS = min(4, os.cpu_count() or 1)
+# Maximum number of images waiting for each of the encode and write stages
+PIPELINE_QUEUE_SIZE = 32
+
+class LetterWriter:
+    '''
+    The encode and write stages of the pipeline, fed by submit and stopped by
+    close. An error of a stage is raised by the next call of submit or by
+    close.
+    '''
+    def __init__(
+            self,
+            encode_threads: int = PIPELINE_ENCODE_THREADS,
+            queue_size: int = PIPELINE_QUEUE_SIZE
+        ):
+        self.encode_threads = encode_threads
+        self.queue_size = queue_size
+        # Images submitted and not encoded yet, the bounded encode queue
+        self._encode_slots = threading.BoundedSemaphore(queue_size)
+        self._encoders = ThreadPoolExecutor(
+            max_workers=encode_threads, thread_name_prefix="letter_encode")
+        # (path, content, size with the default profile) of the encoded images
+        self._write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._error: BaseException | None = None
+        self._encoding = 0
+
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        # Encoding stats of the written images (see save_letter_image)
+        self.images = 0
+        self.written = 0
+        self.default_written: int | None = 0
+        # The stats returned by close, None until the pipeline is closed
+        self.stats: tuple[int, int, int | None] | None = None
+        # Time spent by each stage working and waiting for the next stage
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self.render_wait = 0.0
+        self.encode_wait = 0.0
+        # Depths of the queues when the images were submitted
+        self.samples = 0
+        self.encode_depth_total = 0
+        self.encode_depth_max = 0
+        self.write_depth_total = 0
+        self.write_depth_max = 0
+
+        self._writer = threading.Thread(target=self._write_loop, name="letter_write", daemon=True)
+        self._writer.start()
+
+    def submit(self, img: Image.Image, image_path: Path, encoding: str):
+        """
+        Queue an image to be encoded and written. Waits while the encode
+        queue is full. The image must not be modified afterwards.
+
+        Args:
+            img: The RGBA image.
+            image_path: Path of the PNG file, in an existing directory.
+            encoding: The encoding profile, see ENCODING_PROFILES.
+        """
+        self._raise_error()
+        wait_start = time.perf_counter()
+        self._encode_slots.acquire()
+        waited = time.perf_counter() - wait_start
+        with self._lock:
+            self.render_wait += waited
+            encode_depth, write_depth = self._encoding, self._write_queue.qsize()
+            self.samples += 1
+            self.encode_depth_total += encode_depth
+            self.encode_depth_max = max(self.encode_depth_max, encode_depth)
+            self.write_depth_total += write_depth
+            self.write_depth_max = max(self.write_depth_max, write_depth)
+            self._encoding += 1
+        self._encoders.submit(self._encode, img, image_path, encoding)
+
+    def _encode(self, img: Image.Image, image_path: Path, encoding: str):
+        try:
+            start = time.perf_counter()
+            data, default_size = encode_letter_file(img, encoding)
+            encoded = time.perf_counter()
+            # Waits while the write queue is full
+            self._write_queue.put((image_path, data, default_size))
+            with self._lock:
+                self.encode_seconds += encoded - start
+                self.encode_wait += time.perf_counter() - encoded
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            with self._lock:
+                self._encoding -= 1
+            self._encode_slots.release()
+
+    def _write_loop(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep emptying the queue, so the encode threads don't wait
+                continue
+            image_path, data, default_size = item
+            try:
+                start = time.perf_counter()
+                with profile_span("write"):
+                    write_file_atomic(image_path, data)
+                self.write_seconds += time.perf_counter() - start
+                self.images += 1
+                self.written += len(data)
+                if default_size is None or self.default_written is None:
+                    self.default_written = None
+                else:
+                    self.default_written += default_size
+            except BaseException as e:
+                self._fail(e)
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def close(self, raise_error: bool = True) -> tuple[int, int, int | None]:
+        """
+        Wait for the queued images to be encoded and written, and stop the
+        threads.
+
+        Args:
+            raise_error: Raise the error of a stage. False when the rendering
+                failed, its error is the one reported.
+
+        Returns:
+            The encoding stats of the written images: the number of images,
+            the size of their files and their size with the default encoding
+            (see save_letter_image), also stored in the stats attribute.
+        """
+        self._encoders.shutdown(wait=True)
+        self._write_queue.put(None)
+        self._writer.join()
+        self.seconds = time.perf_counter() - self.start
+        self.stats = (self.images, self.written, self.default_written)
+        if raise_error:
+            self._raise_error()
+        return self.stats
+
+_letter_writer: LetterWriter | None = None
+
+def queue_letter_image(img: Image.Image, image_path: Path, encoding: str) -> bool:
+    """
+    Queue a letter image to the pipeline of the current process, if there is
+    one (see letter_writer).
+
+    Returns:
+        True if the image was queued, False if it has to be saved directly.
+    """
+    if _letter_writer is None:
+        return False
+    _letter_writer.submit(img, image_path, encoding)
+    return True
+
+@contextmanager
+def letter_writer(
+        encode_threads: int = PIPELINE_ENCODE_THREADS,
+        queue_size: int = PIPELINE_QUEUE_SIZE
+    ) -> Iterator[LetterWriter]:
+    """
+    Run the encode and write stages of the pipeline while the images are
+    rendered, used as a context manager:
+        with letter_writer() as writer:
+            ... # Render the images
+        stats = writer.stats
+    The images saved by save_letter_image in the current process are queued
+    to the pipeline, the pipeline is emptied when the context exits and its
+    summary is printed.
+
+    Args:
+        encode_threads: Number of threads encoding the images.
+        queue_size: Maximum number of images waiting for each stage.
+
+    Yields:
+        The pipeline. Its stats attribute has the encoding stats of the
+        written images once the context exits (None until then).
+    """
+    global _letter_writer
+    writer = LetterWriter(encode_threads, queue_size)
+    previous, _letter_writer = _letter_writer, writer
+    try:
+        yield writer
+    except BaseException:
+        _letter_writer = previous
+        writer.close(raise_error=False)
+        raise
+    _letter_writer = previous
+    writer.close()
+    if writer.images:
+        print(pipeline_summary(writer))
+
+def pipeline_summary(writer: LetterWriter) -> str:
+    """
+    Describe the throughput of the stages and the depths of the queues of a
+    closed pipeline for the log.
+
+    Args:
+        writer: The pipeline.
+
+    Returns:
+        A message for the log.
+    """
+    seconds = writer.seconds or 1e-9
+    samples = writer.samples or 1
+    return "\n".join([
+        f"Letter pipeline: {writer.images} images in {writer.seconds:.2f} s "
+        f"({writer.images / seconds:.0f} images/s)",
+        f"  render: waited {writer.render_wait:.2f} s for the encode queue",
+        f"  encode: {writer.encode_seconds:.2f} s in {writer.encode_threads} threads, "
+        f"waited {writer.encode_wait:.2f} s for the write queue, "
+        f"queue depth mean {writer.encode_depth_total / samples:.1f} "
+        f"max {writer.encode_depth_max}/{writer.queue_size}",
+        f"  write: {writer.write_seconds:.2f} s, "
+        f"queue depth mean {writer.write_depth_total / samples:.1f} "
+        f"max {writer.write_depth_max}/{writer.queue_size}",
+    ])
@@ -0,0 +1,264 @@
+'''
+This script records where the letter blocks spend their time. The plugins
+wrap their stages (font loading, metrics, drawing, resizing, encoding, file
+moves, template rendering...) in named spans, which cost almost nothing when
+profiling is off. When it's on, the spans of the main process and of the
+worker processes are written to a Chrome trace file (open it in
+chrome://tracing or https://ui.perfetto.dev) or to a JSON file, a per-stage
+timing report is printed, and the main process can also be profiled with
+cProfile.
+
+Profiling is turned on by the "letter_profile" setting of the scope, or by
+the LETTER_BLOCKS_PROFILE environment variable set to the path of the trace
+file (LETTER_BLOCKS_CPROFILE sets the path of the cProfile output).
+'''
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+
+# Environment variables that turn on profiling without editing the scope
+PROFILE_ENV_VAR = "LETTER_BLOCKS_PROFILE"
+CPROFILE_ENV_VAR = "LETTER_BLOCKS_CPROFILE"
+# Formats of the trace file
+PROFILE_FORMATS = ("chrome", "json")
+
+# The span returned when profiling is off
+_NO_SPAN = nullcontext()
+
+class _Span:
+    '''
+    A span being recorded, the context manager returned by profile_span.
+    '''
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler: "_Profiler", name: str, args: dict[str, Any]):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class _Profiler:
+    '''
+    The spans recorded by a process. The timestamps are perf_counter_ns
+    values, which use a system-wide clock, so the spans of the worker
+    processes line up with the spans of the main process.
+    '''
+    def __init__(
+            self,
+            trace_path: str | None = None,
+            trace_format: str = "chrome",
+            cprofile_path: str | None = None
+        ):
+        self.trace_path = trace_path
+        self.trace_format = trace_format
+        self.cprofile_path = cprofile_path
+        self.pid = os.getpid()
+        self.start = time.perf_counter_ns()
+        # (name, start, end, process ID, thread ID, arguments)
+        self.events: list[tuple] = []
+        self.cprofile = None
+        if cprofile_path:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add(self, name: str, start: int, end: int, args: dict[str, Any] | None = None):
+        self.events.append(
+            (name, start, end, os.getpid(), threading.get_ident(), args or None))
+
+    def drain(self) -> list[tuple]:
+        '''
+        Returns the recorded spans and forgets them.
+        '''
+        events, self.events = self.events, []
+        return events
+
+_profiler: _Profiler | None = None
+
+def profiling_enabled() -> bool:
+    """
+    Check if the spans are recorded by the current process.
+    """
+    return _profiler is not None
+
+def profile_span(name: str, **args: Any) -> Any:
+    """
+    Create a span that records the time spent in a stage, used as a context
+    manager:
+        with profile_span("encode"):
+            ...
+
+    Args:
+        name: Name of the stage. The spans with the same name are added up in
+            the timing report.
+        **args: Details shown with the span in the trace viewer.
+
+    Returns:
+        The context manager, a shared no-op one when profiling is off.
+    """
+    if _profiler is None:
+        return _NO_SPAN
+    return _Span(_profiler, name, args)
+
+def start_profiling(settings: dict[str, Any] | None = None) -> list:
+    """
+    Start recording the spans of the main process if profiling is turned on
+    by the settings or by the environment variables. The recording is
+    finished by finish_profiling, or when the process exits.
+
+    Args:
+        settings: The "letter_profile" setting of the scope: None (off) or a
+            dictionary with "trace" (path to the trace file), "format"
+            ("chrome" or "json", see PROFILE_FORMATS) and "cprofile" (path to
+            the cProfile output, optional). The environment variables override
+            the paths.
+
+    Returns:
+        An empty list, so the call can be a part of the _map.py.
+    """
+    global _profiler
+    settings = dict(settings or {})
+    if os.environ.get(PROFILE_ENV_VAR):
+        settings["trace"] = os.environ[PROFILE_ENV_VAR]
+    if os.environ.get(CPROFILE_ENV_VAR):
+        settings["cprofile"] = os.environ[CPROFILE_ENV_VAR]
+    if _profiler is not None or not (settings.get("trace") or settings.get("cprofile")):
+        return []
+    trace_format = settings.get("format", "chrome")
+    if trace_format not in PROFILE_FORMATS:
+        raise ValueError(
+            f"Unknown profile format '{trace_format}', expected one of: "
+            + ", ".join(PROFILE_FORMATS))
+    _profiler = _Profiler(settings.get("trace"), trace_format, settings.get("cprofile"))
+    atexit.register(finish_profiling)
+    return []
+
+def finish_profiling() -> list:
+    """
+    Stop recording the spans, write the trace file and the cProfile output
+    and print the timing report. Does nothing if profiling is off.
+
+    Returns:
+        An empty list, so the call can be a part of the _map.py.
+    """
+    global _profiler
+    profiler = _profiler
+    if profiler is None:
+        return []
+    _profiler = None
+    end = time.perf_counter_ns()
+    if profiler.cprofile is not None:
+        profiler.cprofile.disable()
+        Path(profiler.cprofile_path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.cprofile.dump_stats(profiler.cprofile_path)
+        print(f"Saved the cProfile stats to '{profiler.cprofile_path}'")
+    profiler.add("map", profiler.start, end)
+    events = profiler.drain()
+    print(timing_report(events))
+    if profiler.trace_path:
+        if profiler.trace_format == "chrome":
+            data = _chrome_trace(events, profiler.start)
+        else:
+            data = {
+                "stages": _stage_totals(events),
+                "spans": [
+                    {
+                        "name": name, "start": (start - profiler.start) / 1e9,
+                        "duration": (end - start) / 1e9, "pid": pid, "tid": tid,
+                        **({"args": args} if args else {}),
+                    }
+                    for name, start, end, pid, tid, args in events
+                ],
+            }
+        Path(profiler.trace_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(profiler.trace_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=str)
+        print(f"Saved the profile of {len(events)} spans to '{profiler.trace_path}'")
+    return []
+
+def _chrome_trace(events: list[tuple], origin: int) -> dict[str, Any]:
+    # Trace Event Format: complete events with microsecond timestamps
+    main_pid = os.getpid()
+    trace_events = [
+        {
+            "name": "process_name", "ph": "M", "pid": pid,
+            "args": {"name": "main" if pid == main_pid else f"worker {pid}"},
+        }
+        for pid in sorted({event[3] for event in events})
+    ]
+    for name, start, end, pid, tid, args in events:
+        trace_event = {
+            "name": name, "cat": "letter_blocks", "ph": "X",
+            "ts": (start - origin) / 1000, "dur": (end - start) / 1000,
+            "pid": pid, "tid": tid,
+        }
+        if args:
+            trace_event["args"] = args
+        trace_events.append(trace_event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+def _stage_totals(events: list[tuple]) -> dict[str, dict[str, float]]:
+    # Number of spans and the time spent in them, by name
+    totals = {}
+    for name, start, end, *_ in events:
+        stage = totals.setdefault(name, {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] += (end - start) / 1e9
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+
+def timing_report(events: list[tuple]) -> str:
+    """
+    Format the time spent in every stage for the log. The spans of nested
+    stages are included in the time of the outer ones, and the spans of the
+    worker processes overlap, so the times don't add up to the total.
+
+    Args:
+        events: The recorded spans.
+
+    Returns:
+        The report, one line per stage.
+    """
+    lines = ["Time spent in the stages of the letter blocks:"]
+    for name, stage in _stage_totals(events).items():
+        lines.append(f"  {name:<24} {stage['seconds']:9.3f} s  {stage['count']:7d} spans")
+    return "\n".join(lines)
+
+def profiled_worker_call(function: Any, args: Any) -> tuple[Any, list[tuple]]:
+    """
+    Call a function in a worker process and record its spans. This is the
+    function sent to the worker processes when profiling is on.
+
+    Args:
+        function: The function, picklable by reference.
+        args: The argument of the function.
+
+    Returns:
+        A tuple with the result of the function and its spans, to be passed
+        to add_worker_spans by the main process.
+    """
+    global _profiler
+    if _profiler is None or _profiler.pid != os.getpid():
+        # A forked worker process inherits the profiler of the main process
+        if _profiler is not None and _profiler.cprofile is not None:
+            _profiler.cprofile.disable()
+        _profiler = _Profiler()
+    return function(args), _profiler.drain()
+
+def add_worker_spans(events: list[tuple]):
+    """
+    Add the spans recorded by a worker process (see profiled_worker_call).
+    """
+    if _profiler is not None:
+        _profiler.events.extend(events)
@@ -0,0 +1,8 @@
+UNPACK:HERE
+
+foreach <_ block_type migration_types>:
+    definefunction <migrate_`eval:block_type`>:
+        ## This function replaces the letter blocks of the "letter" block mode
+        ## within 15 blocks with the permutations of a block type.
+        foreach <_ migration migrations[block_type]>:
+            fill ~-15 ~-15 ~-15 ~15 ~15 ~15 `eval:migration`
@@ -3,4 +3,5 @@ This is not a real regolith filter. The purpose of this "code" is only to make
 Regolith install some dependencies from requirements.txt.
 """
 
-import PIL
\ No newline at end of file
+import PIL
+import numpy
\ No newline at end of file